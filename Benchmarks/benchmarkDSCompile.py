@@ -0,0 +1,62 @@
+"""Compare the layout-only variable font build with a full varLib.build(),
+and print the time spent in each build stage.
+
+Usage:
+    python Benchmarks/benchmarkDSCompile.py [path/to/font.designspace ...]
+"""
+
+import pathlib
+import sys
+import tempfile
+from fontTools.designspaceLib import DesignSpaceDocument
+from fontgoggles.compile.dsCompiler import compileDSToFont, getTTPaths
+from fontgoggles.compile.ufoCompiler import compileUFOToPath
+
+
+testDataFolder = pathlib.Path(__file__).resolve().parent.parent / "Tests" / "data"
+
+
+def bestTimings(func, repeat=5):
+    best = None
+    for i in range(repeat):
+        timings = {}
+        func(timings)
+        if best is None or sum(timings.values()) < sum(best.values()):
+            best = timings
+    return best
+
+
+def printTimings(label, timings):
+    print(f"    {label}: {1000 * sum(timings.values()):8.2f} ms")
+    for stageName, seconds in timings.items():
+        print(f"        {stageName + ':':24} {1000 * seconds:8.2f} ms")
+
+
+def benchmarkDesignSpace(dsPath):
+    doc = DesignSpaceDocument.fromfile(dsPath)
+    with tempfile.TemporaryDirectory(prefix="fontgoggles_temp") as ttFolder:
+        for ufoPath, ttPath in getTTPaths(doc, ttFolder).items():
+            compileUFOToPath(ufoPath, ttPath)
+
+        def layoutOnly(timings):
+            compileDSToFont(dsPath, ttFolder, layoutOnly=True, timings=timings)
+
+        def full(timings):
+            compileDSToFont(dsPath, ttFolder, layoutOnly=False, timings=timings)
+
+        print(f"{dsPath.name}: {len(doc.sources)} sources")
+        printTimings("layout only", bestTimings(layoutOnly))
+        printTimings("varLib.build()", bestTimings(full))
+
+
+def main(args):
+    if args:
+        dsPaths = [pathlib.Path(arg) for arg in args]
+    else:
+        dsPaths = sorted(testDataFolder.glob("*/*.designspace"))
+    for dsPath in dsPaths:
+        benchmarkDesignSpace(dsPath)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
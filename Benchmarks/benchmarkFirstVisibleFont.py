@@ -0,0 +1,89 @@
+"""Measure the time it takes for the first visible font of a project with
+many UFOs to load, with and without prioritizing the visible fonts. The
+visible fonts are at the end of the project, as if the user scrolled down.
+The fonts are small enough to compile in process, so this is measured with
+the compile thread, and with the worker processes.
+
+Usage:
+    python Benchmarks/benchmarkFirstVisibleFont.py [numFonts [numVisibleFonts]]
+"""
+
+import asyncio
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+from fontgoggles.compile import compilerPool
+from fontgoggles.compile.compilerPool import getMaxWorkers
+from fontgoggles.project import Project, sortByPriority
+
+
+testDataFolder = pathlib.Path(__file__).resolve().parent.parent / "Tests" / "data"
+
+
+def copyUFOs(sourcePath, folder, numFonts):
+    ufoPaths = []
+    for i in range(numFonts):
+        ufoPath = pathlib.Path(shutil.copytree(sourcePath, folder / f"Font{i}.ufo"))
+        # Make the sources differ, so the fonts don't share a compile job
+        with open(ufoPath / "features.fea", "a") as f:
+            f.write(f"\n# Font{i}\n")
+        ufoPaths.append(ufoPath)
+    return ufoPaths
+
+
+def makeProject(ufoPaths, numVisibleFonts, prioritize):
+    project = Project()
+    for ufoPath in ufoPaths:
+        project.addFont(ufoPath, 0)
+    visible = {fontItemInfo.identifier for fontItemInfo in project.fonts[-numVisibleFonts:]}
+    if prioritize:
+        project.setFontPriorities(visible=visible)
+    return project, visible
+
+
+async def loadProject(project, visible):
+    # This loads the fonts like FGMainWindowController.loadFonts() does
+    startTime = time.perf_counter()
+    loadTimes = {}
+    output = []
+
+    async def loadFont(fontItemInfo):
+        await fontItemInfo.load(output.append)
+        loadTimes[fontItemInfo.identifier] = time.perf_counter() - startTime
+
+    await asyncio.gather(*(loadFont(fontItemInfo) for fontItemInfo in sortByPriority(project.fonts)))
+    firstVisible = min(loadTimes[identifier] for identifier in visible)
+    allVisible = max(loadTimes[identifier] for identifier in visible)
+    return firstVisible, allVisible, max(loadTimes.values())
+
+
+def main(args):
+    numFonts = int(args[0]) if args else max(12, 4 * getMaxWorkers())
+    numVisibleFonts = int(args[1]) if len(args) > 1 else 2
+    sourcePath = testDataFolder / "MutatorSans" / "MutatorSansLightWide.ufo"
+    print(f"{numFonts} UFOs, {numVisibleFonts} visible")
+    defaultMaxInProcessJobSize = compilerPool.maxInProcessJobSize
+    for maxInProcessJobSize in [defaultMaxInProcessJobSize, 0]:
+        compilerPool.maxInProcessJobSize = maxInProcessJobSize
+        if maxInProcessJobSize:
+            print("in the compile thread:")
+        else:
+            print(f"in {getMaxWorkers()} compile workers:")
+        for prioritize in [False, True]:
+            # Fresh copies, so nothing comes from a cache
+            with tempfile.TemporaryDirectory(prefix="fontgoggles_temp") as tempFolder:
+                ufoPaths = copyUFOs(sourcePath, pathlib.Path(tempFolder), numFonts)
+                project, visible = makeProject(ufoPaths, numVisibleFonts, prioritize)
+                firstVisible, allVisible, allFonts = asyncio.run(loadProject(project, visible))
+            label = "prioritized" if prioritize else "in project order"
+            print(f"    {label}:")
+            print(f"        {'first visible font:':24} {1000 * firstVisible:8.2f} ms")
+            print(f"        {'all visible fonts:':24} {1000 * allVisible:8.2f} ms")
+            print(f"        {'all fonts:':24} {1000 * allFonts:8.2f} ms")
+    compilerPool.maxInProcessJobSize = defaultMaxInProcessJobSize
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,67 @@
+"""Compare the array-based .glif outline parser with drawing glyph objects
+into a point-collecting pen, which is what we used to do.
+
+Usage:
+    python Benchmarks/benchmarkGLIFParser.py [path/to/font.ufo ...]
+"""
+
+import pathlib
+import sys
+import time
+from fontTools.pens.recordingPen import RecordingPen
+from fontTools.ufoLib import UFOReader
+from fontgoggles.misc.glifParser import parseGLIFOutline
+
+
+testDataFolder = pathlib.Path(__file__).resolve().parent.parent / "Tests" / "data"
+
+
+def timeIt(func, repeat=5):
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        func()
+        t = time.perf_counter() - t
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def benchmarkUFO(ufoPath):
+    reader = UFOReader(ufoPath, validate=False)
+    glyphSet = reader.getGlyphSet()
+    glyphNames = sorted(glyphSet.keys())
+    glifData = [glyphSet.getGLIF(glyphName) for glyphName in glyphNames]
+
+    def parseArrays():
+        for data in glifData:
+            parseGLIFOutline(data)
+
+    def drawToPen():
+        for glyphName in glyphNames:
+            glyphSet[glyphName].draw(RecordingPen())
+
+    def readAndParseArrays():
+        for glyphName in glyphNames:
+            parseGLIFOutline(glyphSet.getGLIF(glyphName))
+
+    tArrays = timeIt(parseArrays)
+    tPen = timeIt(drawToPen)
+    tReadArrays = timeIt(readAndParseArrays)
+    print(f"{ufoPath.name}: {len(glyphNames)} glyphs")
+    print(f"    parseGLIFOutline():         {1000 * tArrays:8.2f} ms")
+    print(f"    read + parseGLIFOutline():  {1000 * tReadArrays:8.2f} ms")
+    print(f"    glyph.draw(pen):            {1000 * tPen:8.2f} ms  ({tPen / tArrays:.1f}x)")
+
+
+def main(args):
+    if args:
+        ufoPaths = [pathlib.Path(arg) for arg in args]
+    else:
+        ufoPaths = sorted(testDataFolder.glob("*/*.ufo"))
+    for ufoPath in ufoPaths:
+        benchmarkUFO(ufoPath)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
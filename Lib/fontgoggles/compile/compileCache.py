@@ -0,0 +1,200 @@
+""" Optional on-disk cache for compiled fonts, so reopening a project doesn't
+mean compiling all its sources again. Entries are keyed by a hash of the
+source data that the compilers actually use, so they stay valid as long as
+that data doesn't change, regardless of file modification times.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+from types import SimpleNamespace
+import fontTools
+from fontTools.ufoLib import UFOReader
+from fontTools.ufoLib import GROUPS_FILENAME, KERNING_FILENAME
+import ufo2ft
+from .. import __version__ as fontGogglesVersion
+from ..misc.diskCache import getCacheFolder, writeFileAtomically
+from .ufoCompiler import extractIncludedFeatureFiles, scanGLIFs
+
+
+CACHE_FORMAT_VERSION = 1
+
+# The maximum total size of the cache files, in bytes. When it is exceeded,
+# the least recently used entries are removed.
+maxCompileCacheSize = 512 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+# Entries made by other versions of the compiling code are never used
+_versionStamp = (CACHE_FORMAT_VERSION, fontGogglesVersion, fontTools.version, ufo2ft.__version__)
+
+_cacheFileSuffix = ".fgcompiled"
+
+# Of the UFO lib, only these keys affect compiling the features
+_ufo2ftLibKeyPrefixes = ("public.", "com.github.googlei18n.ufo2ft.", "com.github.fonttools.ufo2ft.")
+
+
+def getCompileCache():
+    """Return the CompileCache, or None if on-disk caching is disabled."""
+    cacheFolder = getCacheFolder("compiledFonts")
+    if cacheFolder is None:
+        return None
+    return CompileCache(cacheFolder, maxCompileCacheSize)
+
+
+class CompileCache:
+
+    """Compiled font data plus compiler output, stored as one file per entry.
+    The modification time of the entry files is used to keep track of when
+    they were last used.
+    """
+
+    def __init__(self, cacheFolder, maxSize):
+        self.cacheFolder = cacheFolder
+        self.maxSize = maxSize
+
+    def _getPath(self, cacheKey):
+        return self.cacheFolder / (cacheKey + _cacheFileSuffix)
+
+    def get(self, cacheKey):
+        """Return a (fontData, output) tuple, or None if there is no entry
+        for `cacheKey`.
+        """
+        path = self._getPath(cacheKey)
+        try:
+            with open(path, "rb") as f:
+                versionStamp, fontData, output = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Can't read compile cache entry '%s': %r", path, e)
+            return None
+        if versionStamp != _versionStamp:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return fontData, output
+
+    def put(self, cacheKey, fontData, output):
+        data = pickle.dumps((_versionStamp, fontData, output), protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            writeFileAtomically(self._getPath(cacheKey), data)
+        except OSError as e:
+            logger.warning("Can't write compile cache entry for '%s': %r", cacheKey, e)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the total size is
+        below the maximum size.
+        """
+        entries = []
+        totalSize = 0
+        with os.scandir(self.cacheFolder) as scanner:
+            for entry in scanner:
+                if not entry.name.endswith(_cacheFileSuffix):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                totalSize += st.st_size
+        if totalSize <= self.maxSize:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            totalSize -= size
+            if totalSize <= self.maxSize:
+                break
+
+
+def getUFOCacheKey(ufoPath, unicodesAndAnchors=None):
+    """Return the cache key for compiling the UFO at `ufoPath`. It is based on
+    everything compileUFOToFont() uses: the features, including the included
+    feature files, the groups, kerning, the relevant lib keys, the glyph names,
+    the cmap and anchors, and the unitsPerEm value.
+
+    `unicodesAndAnchors` can be a ({glyphName: unicodes}, {glyphName: anchors})
+    tuple, as kept by UFOState. If it is None, all .glif files will be read to
+    collect that data.
+    """
+    reader = UFOReader(ufoPath, validate=False)
+    glyphSet = reader.getGlyphSet()
+    info = SimpleNamespace()
+    reader.readInfo(info)
+    lib = reader.readLib()
+    if unicodesAndAnchors is None:
+        unicodes = {}
+        anchors = {}
+        for glyphName, glyphUnicodes, glyphAnchors in scanGLIFs(glyphSet):
+            if glyphUnicodes:
+                unicodes[glyphName] = glyphUnicodes
+            if glyphAnchors:
+                anchors[glyphName] = glyphAnchors
+    else:
+        unicodes, anchors = unicodesAndAnchors
+    h = _newHash("ufo")
+    _updateHash(h, reader.readFeatures())
+    for includedFeaturePath in extractIncludedFeatureFiles(ufoPath, reader):
+        # The include statements are part of the features, so we don't need
+        # the (absolute) paths of the included files
+        _updateHash(h, includedFeaturePath.read_bytes())
+    for fileName in [GROUPS_FILENAME, KERNING_FILENAME]:
+        _updateHash(h, reader.fs.readbytes(fileName) if reader.fs.exists(fileName) else b"")
+    _updateHash(h, sorted((key, value) for key, value in lib.items() if key.startswith(_ufo2ftLibKeyPrefixes)))
+    _updateHash(h, getattr(info, "unitsPerEm", None))
+    _updateHash(h, sorted(glyphSet.keys()))
+    _updateHash(h, sorted(_buildCmap(unicodes).items()))
+    _updateHash(h, sorted((glyphName, glyphAnchors) for glyphName, glyphAnchors in anchors.items() if glyphAnchors))
+    return h.hexdigest()
+
+
+def getDSCacheKey(dsPath, masterFontData):
+    """Return the cache key for compiling the designspace at `dsPath`, with
+    `masterFontData`, a {ufoPath: fontData} dict with the compiled sources.
+    """
+    h = _newHash("designspace")
+    with open(dsPath, "rb") as f:
+        _updateHash(h, f.read())
+    for ufoPath in sorted(masterFontData):
+        _updateHash(h, masterFontData[ufoPath])
+    return h.hexdigest()
+
+
+def getTTXCacheKey(ttxPath):
+    """Return the cache key for compiling the .ttx file at `ttxPath`."""
+    h = _newHash("ttx")
+    with open(ttxPath, "rb") as f:
+        _updateHash(h, f.read())
+    return h.hexdigest()
+
+
+def _buildCmap(unicodes):
+    # Like fetchCharacterMappingAndAnchors(), the first glyph in sorted order
+    # gets a code point that is assigned to multiple glyphs.
+    cmap = {}
+    for glyphName in sorted(unicodes):
+        for codePoint in unicodes[glyphName]:
+            cmap.setdefault(codePoint, glyphName)
+    return cmap
+
+
+def _newHash(sourceType):
+    h = hashlib.sha1()
+    _updateHash(h, (_versionStamp, sourceType))
+    return h
+
+
+def _updateHash(h, value):
+    if not isinstance(value, bytes):
+        value = repr(value).encode("utf-8")
+    h.update(len(value).to_bytes(8, "little"))
+    h.update(value)
@@ -1,71 +1,153 @@
 import asyncio
+import functools
+import itertools
+import logging
 import os
-import shlex
+import pickle
 import signal
 import sys
-import tempfile
-from .workServer import ERROR_MARKER, SUCCESS_MARKER
+import traceback
+from fontTools.ufoLib import FEATURES_FILENAME, GROUPS_FILENAME, KERNING_FILENAME, UFOReader
+from ..misc.priority import CombinedPriority, getCurrentPriority, priorityContext
+from .compileCache import getCompileCache, getDSCacheKey, getTTXCacheKey, getUFOCacheKey
+from .inProcess import callFunctionInThread, getCompileThreadExecutor
+from .sharedMemory import iterSharedBytes, shareBytes, unshareBytes
+from .workServer import MESSAGE_HEADER_SIZE, packMessage, unpackMessageSize
 
 
-async def compileUFOToPath(ufoPath, ttPath, outputWriter):
-    pool = getCompilerPool()
-    func = "fontgoggles.compile.ufoCompiler.compileUFOToPath"
-    args = [
-        os.fspath(ufoPath),
-        os.fspath(ttPath),
-    ]
-    return await pool.callFunction(func, args, outputWriter)
+logger = logging.getLogger(__name__)
+
 
+async def compileUFOToPath(ufoPath, ttPath, outputWriter, unicodesAndAnchors=None):
+    fontData = await compileUFOToBytes(ufoPath, outputWriter, unicodesAndAnchors)
+    with open(ttPath, "wb") as f:
+        f.write(fontData or b"")
 
-async def compileUFOToBytes(ufoPath, outputWriter):
-    with tempfile.NamedTemporaryFile(prefix="fontgoggles_temp", suffix=".ttf") as tmp:
-        await compileUFOToPath(ufoPath, tmp.name, outputWriter)
-        with open(tmp.name, "rb") as f:
-            fontData = f.read()
-            if not fontData:
-                fontData = None
-    return fontData
+
+async def compileUFOToBytes(ufoPath, outputWriter, unicodesAndAnchors=None):
+    # `unicodesAndAnchors` is optional, and only used to determine the compile
+    # cache key, see compileCache.getUFOCacheKey()
+    pool = getCompilerPool()
+    func = "fontgoggles.compile.ufoCompiler.compileUFOToBytes"
+    args = [os.fspath(ufoPath)]
+    # The worker keeps the UFO data around, so let's send the next compile of
+    # this UFO to the same worker
+    affinityKey = os.fspath(ufoPath)
+    # Without `unicodesAndAnchors`, the cache key takes reading all .glif files
+    return await callFunctionCached(pool, func, args, outputWriter,
+                                    getUFOCacheKey, ufoPath, unicodesAndAnchors,
+                                    affinityKey=affinityKey,
+                                    getJobSize=functools.partial(getUFOJobSize, ufoPath),
+                                    keyIsCheap=unicodesAndAnchors is not None)
 
 
-async def compileDSToPath(dsPath, ttFolder, ttPath, outputWriter):
+async def compileDSToBytes(dsPath, masterFontData, outputWriter):
+    # `masterFontData` is a {ufoPath: fontData} dict with the compiled sources
     pool = getCompilerPool()
-    func = "fontgoggles.compile.dsCompiler.compileDSToPath"
+    func = "fontgoggles.compile.dsCompiler.compileDSToBytes"
     args = [
         os.fspath(dsPath),
-        os.fspath(ttFolder),
-        os.fspath(ttPath),
+        masterFontData,
     ]
-    return await pool.callFunction(func, args, outputWriter)
+    return await callFunctionCached(pool, func, args, outputWriter, getDSCacheKey, dsPath, masterFontData,
+                                    getJobSize=functools.partial(getDSJobSize, dsPath, masterFontData))
 
 
-async def compileDSToBytes(dsPath, ttFolder, outputWriter):
-    with tempfile.NamedTemporaryFile(prefix="fontgoggles_temp", suffix=".ttf") as tmp:
-        await compileDSToPath(dsPath, ttFolder, tmp.name, outputWriter)
-        with open(tmp.name, "rb") as f:
-            fontData = f.read()
-            if not fontData:
-                fontData = None
-    return fontData
+async def compileTTXToPath(ttxPath, ttPath, outputWriter):
+    fontData = await compileTTXToBytes(ttxPath, outputWriter)
+    with open(ttPath, "wb") as f:
+        f.write(fontData or b"")
 
 
-async def compileTTXToPath(ttxPath, ttPath, outputWriter):
+async def compileTTXToBytes(ttxPath, outputWriter):
     pool = getCompilerPool()
-    func = "fontgoggles.compile.ttxCompiler.compileTTXToPath"
-    args = [
-        os.fspath(ttxPath),
-        os.fspath(ttPath),
-    ]
-    return await pool.callFunction(func, args, outputWriter)
+    func = "fontgoggles.compile.ttxCompiler.compileTTXToBytes"
+    args = [os.fspath(ttxPath)]
+    return await callFunctionCached(pool, func, args, outputWriter, getTTXCacheKey, ttxPath,
+                                    getJobSize=functools.partial(os.path.getsize, ttxPath))
 
 
-async def compileTTXToBytes(ttxPath, outputWriter):
-    with tempfile.NamedTemporaryFile(prefix="fontgoggles_temp", suffix=".ttf") as tmp:
-        await compileTTXToPath(ttxPath, tmp.name, outputWriter)
-        with open(tmp.name, "rb") as f:
-            fontData = f.read()
-            if not fontData:
-                fontData = None
-    return fontData
+async def callFunctionCached(pool, func, args, outputWriter, getCacheKey, *keyArgs, affinityKey=None,
+                             getJobSize=None, keyIsCheap=True):
+    """Like pool.callFunction(), for a `func` that returns font data, but if
+    the compile cache is enabled, use the cached font data and output for the
+    key returned by `getCacheKey(*keyArgs)` when available, instead of calling
+    `func`. Return the font data, or None if it is empty.
+
+    The key identifies the input, so concurrent calls with the same key share
+    one job, see CompilerPool.callFunctionShared(). If `keyIsCheap` is False,
+    the key is only computed for the compile cache: if that is disabled, jobs
+    are not shared.
+
+    If `getJobSize()` returns at most `maxInProcessJobSize`, the job runs in
+    this process rather than in a worker.
+    """
+    if outputWriter is None:
+        outputWriter = sys.stderr.write
+
+    loop = asyncio.get_running_loop()
+    # These read the sources, so let's not block the event loop
+    inProcess = await loop.run_in_executor(None, _isSmallJob, getJobSize)
+    compileCache = getCompileCache()
+    if compileCache is None and not keyIsCheap:
+        return await pool.callFunction(func, args, outputWriter, affinityKey=affinityKey,
+                                       inProcess=inProcess) or None
+    try:
+        cacheKey = await loop.run_in_executor(None, getCacheKey, *keyArgs)
+    except Exception as e:
+        # The compiler will most likely run into the same problem, and report it
+        logger.info("Can't determine compile cache key for %s: %r", keyArgs[0], e)
+        return await pool.callFunction(func, args, outputWriter, affinityKey=affinityKey,
+                                       inProcess=inProcess) or None
+
+    if compileCache is not None:
+        cachedEntry = compileCache.get(cacheKey)
+        if cachedEntry is not None:
+            fontData, output = cachedEntry
+            if output:
+                outputWriter(output)
+            return fontData
+
+    def resultHandler(fontData, output):
+        if fontData and compileCache is not None:
+            compileCache.put(cacheKey, fontData, output)
+
+    # If this raises CompilerError, we don't cache anything
+    fontData = await pool.callFunctionShared((func, cacheKey), func, args, outputWriter,
+                                             affinityKey=affinityKey, resultHandler=resultHandler,
+                                             inProcess=inProcess)
+    return fontData or None
+
+
+def _isSmallJob(getJobSize):
+    if getJobSize is None or not maxInProcessJobSize:
+        return False
+    try:
+        return getJobSize() <= maxInProcessJobSize
+    except Exception as e:
+        logger.info("Can't estimate compile job size: %r", e)
+        return False
+
+
+def getUFOJobSize(ufoPath):
+    """Estimate the size of the job of compiling the UFO at `ufoPath`: the
+    size of the feature, kerning and groups data in bytes, plus
+    `jobSizePerGlyph` for each glyph. The outlines don't count, as they don't
+    get compiled.
+    """
+    reader = UFOReader(ufoPath, validate=False)
+    jobSize = jobSizePerGlyph * len(reader.getGlyphSet().contents)
+    for fileName in [FEATURES_FILENAME, GROUPS_FILENAME, KERNING_FILENAME]:
+        if reader.fs.exists(fileName):
+            jobSize += reader.fs.getsize(fileName)
+    return jobSize
+
+
+def getDSJobSize(dsPath, masterFontData):
+    """Estimate the size of the job of compiling the designspace at `dsPath`:
+    the size of the compiled sources in bytes.
+    """
+    return sum(len(fontData) for fontData in masterFontData.values() if fontData)
 
 
 def getCompilerPool():
@@ -77,43 +159,506 @@ def getCompilerPool():
     return pool
 
 
+async def prewarmCompilerPool(numWorkers=None):
+    """Start worker processes ahead of time, see CompilerPool.prewarm().
+    By default, start as many as set with setPrewarmWorkers().
+    """
+    if numWorkers is None:
+        numWorkers = _prewarmWorkers
+    if numWorkers:
+        await getCompilerPool().prewarm(numWorkers)
+
+
+def setPrewarmWorkers(numWorkers):
+    """Set the number of worker processes prewarmCompilerPool() starts. Pass
+    0 to not start any ahead of time.
+    """
+    global _prewarmWorkers
+    _prewarmWorkers = numWorkers
+
+
+# The maximum number of worker processes is derived from the number of CPUs
+# and the amount of physical memory, unless it is set with setMaxWorkers(),
+# or through the FONTGOGGLES_MAX_COMPILE_WORKERS environment variable.
+_maxWorkers = int(os.environ.get("FONTGOGGLES_MAX_COMPILE_WORKERS") or 0) or None
+
+# The number of workers prewarmCompilerPool() starts, unless it is set with
+# setPrewarmWorkers(), or through the FONTGOGGLES_PREWARM_COMPILE_WORKERS
+# environment variable. Each of them uses memory, also when the user only
+# opens binary fonts, so let's start one: it serves the first source font.
+_prewarmWorkers = int(os.environ.get("FONTGOGGLES_PREWARM_COMPILE_WORKERS") or 1)
+
+# Jobs that are estimated to be at most this large are run in a thread of
+# this process: for small fonts, talking to a worker takes longer than the
+# compile itself. Set to 0 to run all jobs in workers. The sizes are roughly
+# in bytes of input, see getUFOJobSize() and getDSJobSize().
+maxInProcessJobSize = 64 * 1024
+jobSizePerGlyph = 100
+
+# A rough estimate of the memory a worker uses for compiling a big font
+workerMemoryEstimate = 512 * 1024 * 1024
+
+# Workers that have not done a job for this many seconds are shut down
+idleWorkerTimeout = 300
+
+# Workers are replaced by fresh ones after doing this many jobs, or once their
+# peak resident memory size reached this many bytes, as memory builds up in
+# long-running processes. Set to None to disable.
+maxJobsPerWorker = 200
+maxWorkerMemory = 2 * workerMemoryEstimate
+
+# A shared job that nobody waits for anymore keeps running for this many
+# seconds, in case it gets requested again: reloading a font cancels the
+# running load, which then usually starts over with the same input.
+detachedJobGracePeriod = 2
+
+# The modules prewarmed workers import before their first job
+prewarmModules = [
+    "fontgoggles.compile.ufoCompiler",
+    "fontgoggles.compile.dsCompiler",
+    "fontgoggles.compile.ttxCompiler",
+]
+
+
+def setMaxWorkers(maxWorkers):
+    """Set the maximum number of worker processes for pools created after
+    this call. Pass None to go back to the default.
+    """
+    global _maxWorkers
+    _maxWorkers = maxWorkers
+
+
+def getMaxWorkers():
+    """Return the maximum number of worker processes: the value set with
+    setMaxWorkers(), or one less than the number of CPUs, limited so the
+    workers would use at most a quarter of the physical memory.
+    """
+    if _maxWorkers is not None:
+        return _maxWorkers
+    maxWorkers = (os.cpu_count() or 2) - 1  # leave a CPU for the app
+    memorySize = _getPhysicalMemorySize()
+    if memorySize is not None:
+        maxWorkers = min(maxWorkers, memorySize // 4 // workerMemoryEstimate)
+    return max(1, maxWorkers)
+
+
+def _getPhysicalMemorySize():
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
 class CompilerError(Exception):
     pass
 
 
+class BrokenWorkerError(RuntimeError):
+    pass
+
+
+class CompilerPoolMetrics:
+
+    """Statistics of a CompilerPool: how many jobs are waiting for a
+    worker, how long they waited, and how long the jobs took per function.
+    """
+
+    def __init__(self):
+        self.queueDepth = 0  # jobs currently waiting for a worker
+        self.maxQueueDepth = 0
+        self.jobCount = 0
+        self.totalWaitTime = 0
+        self.maxWaitTime = 0
+        self.jobDurations = {}  # func: (count, totalDuration, maxDuration)
+
+    def addJob(self, func, waitTime, duration):
+        self.jobCount += 1
+        self.totalWaitTime += waitTime
+        self.maxWaitTime = max(self.maxWaitTime, waitTime)
+        count, totalDuration, maxDuration = self.jobDurations.get(func, (0, 0, 0))
+        self.jobDurations[func] = count + 1, totalDuration + duration, max(maxDuration, duration)
+
+    @property
+    def averageWaitTime(self):
+        return self.totalWaitTime / self.jobCount if self.jobCount else 0
+
+
+class _SharedJob:
+
+    """A job of CompilerPool.callFunctionShared(). It sends its output to
+    the output writers of all callers waiting for it, and has the most urgent
+    of their priorities.
+    """
+
+    def __init__(self):
+        self.task = None
+        self.output = []
+        self.outputWriters = []
+        self.priority = CombinedPriority()
+        self.cancelHandle = None
+        self.cancelled = False
+
+    def writeOutput(self, text):
+        self.output.append(text)
+        for outputWriter in self.outputWriters:
+            outputWriter(text)
+
+    def attach(self, outputWriter, priority):
+        if self.cancelHandle is not None:
+            self.cancelHandle.cancel()
+            self.cancelHandle = None
+        if self.output:
+            outputWriter("".join(self.output))
+        self.outputWriters.append(outputWriter)
+        self.priority.priorities.append(priority)
+
+    def detach(self, outputWriter, priority, loop, cancelJob):
+        self.outputWriters.remove(outputWriter)
+        self.priority.priorities.remove(priority)
+        if not self.outputWriters and not self.task.done():
+            self.cancelHandle = loop.call_later(detachedJobGracePeriod, cancelJob)
+
+    def cancel(self):
+        # The task may take a while to finish, for example while the worker
+        # handles the interrupt, so mark the job as unusable for new callers
+        self.cancelled = True
+        self.cancelHandle = None
+        self.task.cancel()
+
+
+class _WorkerWaiter:
+
+    def __init__(self, affinityKey, priority, sequenceNumber, future):
+        self.affinityKey = affinityKey
+        self.priority = priority
+        self.sequenceNumber = sequenceNumber
+        self.future = future
+
+
 class CompilerPool:
 
-    def __init__(self, maxWorkers=5):
+    """Pool of worker processes. Workers may keep state between jobs, for
+    example the data of the UFOs they compiled. Jobs with the same affinity
+    key are sent to the same worker when it is available, so they can make
+    use of that state. Jobs waiting for a worker get one in order of their
+    priority, see getWorker().
+
+    Workers are started when needed, or in advance with prewarm(), and are
+    shut down after being idle for `idleTimeout` seconds. Workers that died
+    are replaced, as are workers that did `maxJobsPerWorker` jobs or used
+    `maxWorkerMemory` bytes.
+    """
+
+    def __init__(self, maxWorkers=None, idleTimeout=None):
         self.loop = asyncio.get_running_loop()
-        self.maxWorkers = maxWorkers
+        self.maxWorkers = getMaxWorkers() if maxWorkers is None else maxWorkers
+        self.idleTimeout = idleWorkerTimeout if idleTimeout is None else idleTimeout
         self.workers = []
-        self.availableWorkers = asyncio.Queue()
-
-    async def getWorker(self):
-        if self.availableWorkers.empty() and len(self.workers) < self.maxWorkers:
-            # Add a worker process
-            worker = CompilerWorker()
-            self.workers.append(worker)
-            assert len(self.workers) <= self.maxWorkers
+        self.availableWorkers = []  # least recently used first
+        self.waiters = []  # _WorkerWaiter objects
+        self.inProcessWaiters = []  # _WorkerWaiter objects waiting for the compile thread
+        self.inProcessBusy = False
+        self.affinities = {}  # affinity key: the worker that last did a job for it
+        self.metrics = CompilerPoolMetrics()
+        self.sharedJobs = {}  # jobKey: _SharedJob
+        self._lastUsed = {}  # worker: loop time of its last release
+        self._reapHandle = None
+        self._waiterCounter = itertools.count()
+
+    async def getWorker(self, affinityKey=None, priority=None):
+        """Return a worker, waiting for one to become available if needed.
+        Waiting callers get a worker in order of `priority`, which defaults
+        to the current priority, see misc/priority.py. As the priority gets
+        evaluated at that moment, it can be changed while waiting.
+        """
+        worker = self._takeAvailableWorker(affinityKey)
+        if worker is None and len(self.workers) < self.maxWorkers:
+            worker = self._addWorker(affinityKey)
+        if worker is None:
+            if priority is None:
+                priority = getCurrentPriority()
+            worker = await self._waitForWorker(affinityKey, priority)
+        if worker.process is None:
+            await worker.start()
+        return worker
+
+    def _addWorker(self, affinityKey=None):
+        worker = CompilerWorker()
+        self.workers.append(worker)
+        if affinityKey is not None:
+            self.affinities[affinityKey] = worker
+        return worker
+
+    async def _waitForWorker(self, affinityKey, priority):
+        waiter = _WorkerWaiter(affinityKey, priority, next(self._waiterCounter), self.loop.create_future())
+        self.waiters.append(waiter)
+        self.metrics.queueDepth += 1
+        self.metrics.maxQueueDepth = max(self.metrics.maxQueueDepth, self.metrics.queueDepth)
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # We got cancelled after being handed a worker
+                await self.releaseWorker(waiter.future.result())
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            self.metrics.queueDepth -= 1
+
+    def _takeAvailableWorker(self, affinityKey):
+        for worker in list(self.availableWorkers):
+            if worker.isDead:
+                logger.warning("compile worker exited unexpectedly")
+                self._removeWorker(worker)
+        worker = self.affinities.get(affinityKey)
+        if worker not in self.availableWorkers:
+            if not self.availableWorkers:
+                return None
+            # Prefer a worker that doesn't hold state for other jobs
+            statefulWorkers = set(self.affinities.values())
+            freeWorkers = [worker for worker in self.availableWorkers if worker not in statefulWorkers]
+            worker = freeWorkers[0] if freeWorkers else self.availableWorkers[0]
+        self.availableWorkers.remove(worker)
+        if affinityKey is not None:
+            self.affinities[affinityKey] = worker
+        return worker
+
+    async def releaseWorker(self, worker):
+        if self._shouldRetire(worker):
+            self._removeWorker(worker)
+            if not self.waiters:
+                return
+            # The replacement gets started by the waiter that gets it
+            worker = self._addWorker()
+        self._lastUsed[worker] = self.loop.time()
+        waiter = self._takeNextWaiter(worker)
+        if waiter is not None:
+            if waiter.affinityKey is not None:
+                self.affinities[waiter.affinityKey] = worker
+            waiter.future.set_result(worker)
+            return
+        self.availableWorkers.append(worker)
+        if self._reapHandle is None and self.idleTimeout is not None:
+            self._reapHandle = self.loop.call_later(self.idleTimeout, self._reapIdleWorkers)
+
+    def _takeNextWaiter(self, worker):
+        # The most urgent waiter goes first, then the one that holds state in
+        # `worker`, then the one that has waited longest
+        waiters = [waiter for waiter in self.waiters if not waiter.future.done()]
+        if not waiters:
+            return None
+        waiter = min(waiters, key=lambda waiter: (waiter.priority.value,
+                                                  self.affinities.get(waiter.affinityKey) is not worker,
+                                                  waiter.sequenceNumber))
+        self.waiters.remove(waiter)
+        return waiter
+
+    def _shouldRetire(self, worker):
+        if worker.isDead:
+            return True
+        if maxJobsPerWorker is not None and worker.jobCount >= maxJobsPerWorker:
+            logger.debug("recycling compile worker after %s jobs", worker.jobCount)
+            return True
+        if maxWorkerMemory is not None and worker.maxResidentSize >= maxWorkerMemory:
+            logger.debug("recycling compile worker using %s bytes", worker.maxResidentSize)
+            return True
+        return False
+
+    def _reapIdleWorkers(self):
+        self._reapHandle = None
+        now = self.loop.time()
+        for worker in list(self.availableWorkers):
+            if now - self._lastUsed[worker] >= self.idleTimeout:
+                self._removeWorker(worker)
+        if self.availableWorkers:
+            nextTimeout = min(self._lastUsed[worker] for worker in self.availableWorkers) + self.idleTimeout
+            self._reapHandle = self.loop.call_at(nextTimeout, self._reapIdleWorkers)
+
+    def _removeWorker(self, worker):
+        self.workers.remove(worker)
+        if worker in self.availableWorkers:
+            self.availableWorkers.remove(worker)
+        self._lastUsed.pop(worker, None)
+        for affinityKey, affinityWorker in list(self.affinities.items()):
+            if affinityWorker is worker:
+                del self.affinities[affinityKey]
+        self.loop.create_task(worker.stop())
+
+    async def prewarm(self, numWorkers=None):
+        """Start `numWorkers` worker processes, or as many as allowed, and
+        let them import the compile modules, so the first jobs don't have to
+        wait for that.
+        """
+        if numWorkers is None:
+            numWorkers = self.maxWorkers
+        newWorkers = [CompilerWorker() for i in range(min(numWorkers, self.maxWorkers) - len(self.workers))]
+        self.workers.extend(newWorkers)
+        await asyncio.gather(*(self._prewarmWorker(worker) for worker in newWorkers))
+
+    async def _prewarmWorker(self, worker):
+        try:
             await worker.start()
-            return worker
-        else:
-            return await self.availableWorkers.get()
+            await worker.callFunction("fontgoggles.compile.workServer.importModules", [prewarmModules],
+                                      sys.stderr.write)
+        finally:
+            await self.releaseWorker(worker)
 
-    async def callFunction(self, func, args, outputWriter):
+    async def callFunction(self, func, args, outputWriter, affinityKey=None, eventHandler=None,
+                           inProcess=False):
+        """Call `func` (a "module.function" string) with `args` in a worker
+        process, and return its result. See CompilerWorker.callFunction().
+        If the worker process dies during the call, it is tried once more
+        with another worker. If `inProcess` is True, `func` is called in a
+        thread of this process instead, see inProcess.py.
+        """
         if outputWriter is None:
             outputWriter = sys.stderr.write
-        worker = await self.getWorker()
+        if inProcess:
+            return await self._callFunctionInProcess(func, args, outputWriter, eventHandler)
         try:
-            error = await worker.callFunction(func, args, outputWriter)
+            return await self._callFunction(func, args, outputWriter, affinityKey, eventHandler)
+        except BrokenWorkerError:
+            logger.warning("compile worker died while running %s, trying again", func)
+            return await self._callFunction(func, args, outputWriter, affinityKey, eventHandler)
+
+    async def _callFunction(self, func, args, outputWriter, affinityKey, eventHandler):
+        startTime = self.loop.time()
+        worker = await self.getWorker(affinityKey)
+        jobStartTime = self.loop.time()
+        try:
+            return await worker.callFunction(func, args, outputWriter, eventHandler)
         finally:
-            await self.availableWorkers.put(worker)
-        if error:
+            await self.releaseWorker(worker)
+            waitTime = jobStartTime - startTime
+            duration = self.loop.time() - jobStartTime
+            self.metrics.addJob(func, waitTime, duration)
+            logger.debug("%s: waited %.3f s, took %.3f s", func, waitTime, duration)
+
+    async def _callFunctionInProcess(self, func, args, outputWriter, eventHandler):
+        def sendMessage(message):
+            self.loop.call_soon_threadsafe(_handleOutputMessage, message, outputWriter, eventHandler)
+
+        startTime = self.loop.time()
+        await self._acquireCompileThread(getCurrentPriority())
+        jobStartTime = self.loop.time()
+        future = getCompileThreadExecutor().submit(callFunctionInThread, func, args, sendMessage)
+        # If we get cancelled, the thread still runs the job to completion
+        future.add_done_callback(lambda future: self.loop.call_soon_threadsafe(self._releaseCompileThread))
+        try:
+            return await asyncio.wrap_future(future)
+        except Exception:
+            outputWriter(traceback.format_exc())
             raise CompilerError(func)
+        finally:
+            waitTime = jobStartTime - startTime
+            duration = self.loop.time() - jobStartTime
+            self.metrics.addJob(func, waitTime, duration)
+            logger.debug("%s: waited %.3f s, took %.3f s in process", func, waitTime, duration)
+
+    async def _acquireCompileThread(self, priority):
+        # The compile thread does one job at a time: the jobs wait for it in
+        # order of priority, like the jobs that wait for a worker
+        if not self.inProcessBusy:
+            self.inProcessBusy = True
+            return
+        waiter = _WorkerWaiter(None, priority, next(self._waiterCounter), self.loop.create_future())
+        self.inProcessWaiters.append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # We got cancelled after being handed the thread
+                self._releaseCompileThread()
+            raise
+        finally:
+            if waiter in self.inProcessWaiters:
+                self.inProcessWaiters.remove(waiter)
+
+    def _releaseCompileThread(self):
+        waiters = [waiter for waiter in self.inProcessWaiters if not waiter.future.done()]
+        if not waiters:
+            self.inProcessBusy = False
+            return
+        waiter = min(waiters, key=lambda waiter: (waiter.priority.value, waiter.sequenceNumber))
+        self.inProcessWaiters.remove(waiter)
+        waiter.future.set_result(None)
+
+    async def callFunctionShared(self, jobKey, func, args, outputWriter, affinityKey=None,
+                                 resultHandler=None, inProcess=False):
+        """Like callFunction(), but if a job with the same `jobKey` is
+        running, wait for that instead of starting a new one. The key must
+        identify the input, so jobs with the same key have the same result.
+
+        If the caller gets cancelled, the job keeps running as long as others
+        wait for it, or until it has been unwanted for `detachedJobGracePeriod`
+        seconds. If the job succeeds, `resultHandler(result, output)` gets
+        called once, with the complete output as a string. The job waits for
+        a worker with the most urgent priority of the callers waiting for it.
+        """
+        if outputWriter is None:
+            outputWriter = sys.stderr.write
+        job = self.sharedJobs.get(jobKey)
+        if job is None or job.cancelled:
+            job = self.sharedJobs[jobKey] = _SharedJob()
+            job.task = self.loop.create_task(self._runSharedJob(job, func, args, affinityKey, resultHandler,
+                                                                inProcess))
+            job.task.add_done_callback(functools.partial(self._sharedJobDone, jobKey, job))
+        priority = getCurrentPriority()
+        job.attach(outputWriter, priority)
+        try:
+            return await asyncio.shield(job.task)
+        finally:
+            job.detach(outputWriter, priority, self.loop,
+                       functools.partial(self._cancelSharedJob, jobKey, job))
+
+    async def _runSharedJob(self, job, func, args, affinityKey, resultHandler, inProcess):
+        with priorityContext(job.priority):
+            result = await self.callFunction(func, args, job.writeOutput, affinityKey=affinityKey,
+                                             inProcess=inProcess)
+        if resultHandler is not None:
+            resultHandler(result, "".join(job.output))
+        return result
+
+    def _cancelSharedJob(self, jobKey, job):
+        job.cancel()
+        if self.sharedJobs.get(jobKey) is job:
+            del self.sharedJobs[jobKey]
+
+    def _sharedJobDone(self, jobKey, job, task):
+        if self.sharedJobs.get(jobKey) is job:
+            del self.sharedJobs[jobKey]
+        if not task.cancelled():
+            # Nobody may be waiting for the result anymore, so retrieve the
+            # exception, if any, to prevent asyncio from logging it
+            task.exception()
+
+
+def _handleOutputMessage(message, outputWriter, eventHandler):
+    messageType = message[0]
+    if messageType == "output":
+        outputWriter(message[1])
+    elif messageType == "log":
+        outputWriter(message[3] + "\n")
+        if eventHandler is not None:
+            eventHandler(message)
+    elif messageType == "progress":
+        if eventHandler is not None:
+            eventHandler(message)
 
 
 class CompilerWorker:
 
+    def __init__(self):
+        self.process = None
+        self.isBroken = False  # the pipe broke
+        self.jobCount = 0
+        self.maxResidentSize = 0  # as reported by the process
+
+    @property
+    def isDead(self):
+        return self.process is not None and (self.isBroken or self.process.returncode is not None)
+
     async def start(self):
         env = dict(PYTHONPATH=":".join(sys.path), PYTHONHOME=sys.prefix)
         args = ["-u", "-m", "fontgoggles.compile.workServer"]
@@ -121,19 +666,45 @@ class CompilerWorker:
             sys.executable, *args,
             env=env,
             stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT)
-
-    async def callFunction(self, func, args, outputWriter):
-        args = [func] + args
-        inData = " ".join(shlex.quote(item) for item in args)
-        self.process.stdin.write((inData + "\n").encode("utf-8"))
-        await self.process.stdin.drain()
-        error = True
+            stdout=asyncio.subprocess.PIPE)
+
+    async def stop(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        await self.process.wait()
+
+    async def callFunction(self, func, args, outputWriter, eventHandler=None):
+        """Call `func` with `args` in the worker process, and return its
+        result. Raise CompilerError if it raised an exception. Its output is
+        written to `outputWriter`, as are warnings it logged. If given,
+        `eventHandler` is called with the ("log", levelno, loggerName, message)
+        and ("progress", info) messages, see workServer.py. Raise
+        BrokenWorkerError if the process died.
+        """
+        self.jobCount += 1
+        args = shareBytes(list(args))
+        try:
+            return await self._callFunction(func, args, outputWriter, eventHandler)
+        finally:
+            for sharedArg in iterSharedBytes(args):
+                sharedArg.unlink()
+
+    async def _callFunction(self, func, args, outputWriter, eventHandler):
+        try:
+            self.process.stdin.write(packMessage((func, args)))
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            self.isBroken = True
+            raise BrokenWorkerError("broken subprocess")
         cancelling = False
         while True:
             try:
-                line = await self.process.stdout.readline()
+                message = await self._readMessage()
+            except BrokenWorkerError:
+                if cancelling:
+                    raise asyncio.CancelledError()
+                raise
             except asyncio.CancelledError:
                 self.process.send_signal(signal.SIGINT)
                 # We will re-raise only after we've received all
@@ -141,18 +712,34 @@ class CompilerWorker:
                 # we just sent SIGINT to the worker process.
                 cancelling = True
                 continue
-            if not line:
-                raise RuntimeError("broken subprocess")
+            messageType = message[0]
+            if messageType in {"output", "log", "progress"}:
+                _handleOutputMessage(message, outputWriter, eventHandler)
+            elif messageType == "memory":
+                if message[1] is not None:
+                    self.maxResidentSize = message[1]
+            elif messageType == "result":
+                result = unshareBytes(message[1], unlink=True)
+                error = False
                 break
-            line = line.decode("utf-8")
-            line = line.rstrip('\n')
-            if line == ERROR_MARKER:
+            elif messageType == "error":
+                if message[1]:
+                    outputWriter(message[1])
                 error = True
                 break
-            if line == SUCCESS_MARKER:
-                error = False
-                break
-            outputWriter(line + "\n")
+            else:
+                raise RuntimeError(f"unexpected message from subprocess: {messageType!r}")
         if cancelling:
             raise asyncio.CancelledError()
-        return error
+        if error:
+            raise CompilerError(func)
+        return result
+
+    async def _readMessage(self):
+        try:
+            header = await self.process.stdout.readexactly(MESSAGE_HEADER_SIZE)
+            data = await self.process.stdout.readexactly(unpackMessageSize(header))
+        except asyncio.IncompleteReadError:
+            self.isBroken = True
+            raise BrokenWorkerError("broken subprocess")
+        return pickle.loads(data)
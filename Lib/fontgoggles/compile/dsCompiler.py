@@ -1,41 +1,74 @@
+from copy import deepcopy
+import io
 import os
 import pickle
 import sys
 from fontTools.designspaceLib import DesignSpaceDocument
 from fontTools.fontBuilder import FontBuilder
 from fontTools.ttLib import TTFont, newTable
+from fontTools.ttLib.tables import otTables as ot
 from fontTools import varLib
 from fontTools.varLib.errors import VarLibError
+from fontTools.varLib.merger import VariationMerger
+from fontTools.varLib.models import VariationModel
+from .profiling import storeCompileTimings, timeStage
 
 
-def compileDSToFont(dsPath, ttFolder):
-    doc = DesignSpaceDocument.fromfile(dsPath)
-    doc.findDefault()
+def compileDSToFont(dsPath, ttFolder, layoutOnly=True, timings=None, masterFontData=None):
+    """Build a variable font from the designspace at `dsPath`, using the
+    compiled sources from `ttFolder`, or from `masterFontData`, a
+    {ufoPath: fontData} dict, if given. The resulting font is only used by
+    HarfBuzz for layout, as we interpolate outlines and advances ourselves.
 
-    ufoPathToTTPath = getTTPaths(doc, ttFolder)
+    If `layoutOnly` is True, only the tables HarfBuzz needs are built, instead
+    of doing a full varLib.build(). If `timings` is a dict, the duration in
+    seconds of each build stage will be stored in it.
+    """
+    if timings is None:
+        timings = {}
 
-    for source in doc.sources:
-        if source.layerName is None:
-            ttPath = ufoPathToTTPath[source.path]
-            if not os.path.exists(ttPath):
-                raise FileNotFoundError(ttPath)
-            source.font = TTFont(ttPath, lazy=False)
+    with timeStage(timings, "loadDesignSpace"):
+        doc = DesignSpaceDocument.fromfile(dsPath)
+        doc.findDefault()
 
-    assert doc.default.font is not None
-    if "name" not in doc.default.font:
-        doc.default.font["name"] = newTable("name")  # This is the template for the VF, and needs a name table
+    with timeStage(timings, "loadMasters"):
+        if masterFontData is None:
+            ufoPathToTTPath = getTTPaths(doc, ttFolder)
 
-    if any(s.layerName is not None for s in doc.sources):
-        fb = FontBuilder(unitsPerEm=doc.default.font["head"].unitsPerEm)
-        fb.setupGlyphOrder(doc.default.font.getGlyphOrder())
-        fb.setupPost()  # This makes sure we store the glyph names
-        font = fb.font
         for source in doc.sources:
-            if source.font is None:
-                source.font = font
+            if source.layerName is None:
+                if masterFontData is not None:
+                    source.font = TTFont(io.BytesIO(masterFontData[source.path]), lazy=False)
+                    continue
+                ttPath = ufoPathToTTPath[source.path]
+                if not os.path.exists(ttPath):
+                    raise FileNotFoundError(ttPath)
+                source.font = TTFont(ttPath, lazy=False)
+
+        assert doc.default.font is not None
+        if "name" not in doc.default.font:
+            doc.default.font["name"] = newTable("name")  # This is the template for the VF, and needs a name table
+
+        if any(s.layerName is not None for s in doc.sources):
+            fb = FontBuilder(unitsPerEm=doc.default.font["head"].unitsPerEm)
+            fb.setupGlyphOrder(doc.default.font.getGlyphOrder())
+            fb.setupPost()  # This makes sure we store the glyph names
+            font = fb.font
+            for source in doc.sources:
+                if source.font is None:
+                    source.font = font
+
+    if layoutOnly:
+        def build(exclude):
+            return buildLayoutVariableFont(doc, exclude=exclude, timings=timings)
+    else:
+        def build(exclude):
+            with timeStage(timings, "varLibBuild"):
+                ttFont, masterModel, _ = varLib.build(doc, exclude=['MVAR', 'HVAR', 'VVAR', 'STAT'] + exclude)
+            return ttFont, masterModel
 
     try:
-        ttFont, masterModel, _ = varLib.build(doc, exclude=['MVAR', 'HVAR', 'VVAR', 'STAT'])
+        ttFont, masterModel = build([])
     except VarLibError as e:
         if 'GSUB' in e.args:
             extraExclude = ['GSUB']
@@ -46,20 +79,102 @@ def compileDSToFont(dsPath, ttFolder):
         print(f"{e!r}", file=sys.stderr)
         print(f"Error while building {extraExclude[0]} table, trying again without {' and '.join(extraExclude)}.",
               file=sys.stderr)
-        ttFont, masterModel, _ = varLib.build(doc, exclude=['MVAR', 'HVAR', 'VVAR', 'STAT'] + extraExclude)
+        ttFont, masterModel = build(extraExclude)
 
     # Our client needs the masterModel, so we save a pickle into the font
     ttFont["MPcl"] = newTable("MPcl")
     ttFont["MPcl"].data = pickle.dumps(masterModel)
 
+    # Same for the build timings, which our client may want to report
+    storeCompileTimings(ttFont, timings)
+
     return ttFont
 
 
+def buildLayoutVariableFont(doc, exclude=(), timings=None):
+    """Build a variable font containing just fvar, avar and the OpenType Layout
+    tables, plus the glyph order, cmap and the bare minimum of other tables.
+    `doc` is a DesignSpaceDocument with compiled master fonts assigned to its
+    sources' `font` attribute. Return the font and the master model.
+
+    This does the same as varLib.build(), except that it doesn't copy the
+    default master wholesale, and doesn't optimize the VarStore, which can be
+    slow for large fonts and only makes the font smaller.
+    """
+    if timings is None:
+        timings = {}
+
+    with timeStage(timings, "setupVariableFont"):
+        ds = varLib.load_designspace(doc)
+        masterFonts = [source.font for source in doc.sources]
+        defaultFont = masterFonts[ds.base_idx]
+
+        vf = TTFont()
+        vf.setGlyphOrder(defaultFont.getGlyphOrder())
+        for tag in ["head", "maxp", "cmap", "post", "name"]:
+            if tag in defaultFont:
+                # The masters are discarded after the build, so we can share these
+                vf[tag] = defaultFont[tag]
+        for tag in ["GDEF", "GSUB", "GPOS"]:
+            if tag in defaultFont and tag not in exclude:
+                # These get merged in-place, so they need to be copies
+                vf[tag] = deepcopy(defaultFont[tag])
+
+        fvar = varLib._add_fvar(vf, ds.axes, ds.instances)
+        varLib._add_avar(vf, ds.axes)
+
+        normalizedMasterLocations = [
+            {ds.axes[k].tag: v for k, v in loc.items()} for loc in ds.normalized_master_locs
+        ]
+        axisTags = [axis.axisTag for axis in fvar.axes]
+        model = VariationModel(normalizedMasterLocations, axisOrder=axisTags)
+        assert 0 == model.mapping[ds.base_idx]
+
+    with timeStage(timings, "mergeOTL"):
+        _mergeOTL(vf, model, masterFonts, axisTags)
+
+    if "GSUB" not in exclude and ds.rules:
+        with timeStage(timings, "featureVariations"):
+            varLib._add_GSUB_feature_variations(vf, ds.axes, ds.internal_axis_supports,
+                                                ds.rules, ds.rulesProcessingLast)
+
+    return vf, model
+
+
+def _mergeOTL(font, model, masterFonts, axisTags):
+    # This is varLib._merge_OTL(), minus the VarStore optimization
+    merger = VariationMerger(model, axisTags, font)
+    merger.mergeTables(font, masterFonts, ['GSUB', 'GDEF', 'GPOS'])
+    store = merger.store_builder.finish()
+    if not store.VarData:
+        return
+    if "GDEF" in font:
+        gdef = font["GDEF"].table
+        assert gdef.Version <= 0x00010002
+    else:
+        font["GDEF"] = newTable("GDEF")
+        gdef = font["GDEF"].table = ot.GDEF()
+        gdef.GlyphClassDef = None
+        gdef.AttachList = None
+        gdef.LigCaretList = None
+        gdef.MarkAttachClassDef = None
+        gdef.MarkGlyphSetsDef = None
+    gdef.Version = 0x00010003
+    gdef.VarStore = store
+
+
 def compileDSToPath(dsPath, ttFolder, ttPath):
     ttFont = compileDSToFont(dsPath, ttFolder)
     ttFont.save(ttPath, reorderTables=False)
 
 
+def compileDSToBytes(dsPath, masterFontData):
+    ttFont = compileDSToFont(dsPath, None, masterFontData=masterFontData)
+    f = io.BytesIO()
+    ttFont.save(f, reorderTables=False)
+    return f.getvalue()
+
+
 def getTTPaths(doc, ttFolder):
     ufoPaths = sorted({s.path for s in doc.sources if s.layerName is None})
     return {ufoPath: os.path.join(ttFolder, f"master_{index}.ttf")
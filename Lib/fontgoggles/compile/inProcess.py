@@ -0,0 +1,82 @@
+""" Run compile functions in a thread of this process instead of in a worker
+process, for jobs that are so small that the round trip to a worker takes
+longer than the job itself. See CompilerPool.callFunction().
+
+The functions run one at a time, on a single thread, as they keep state
+between calls like they do in a worker. Their output gets captured like
+workServer.py does it: what they write to sys.stdout and sys.stderr, and the
+warnings they log, are sent as "output" and "log" messages.
+"""
+
+import concurrent.futures
+import importlib
+import io
+import logging
+import sys
+import threading
+from .workServer import _LogHandler
+
+
+_executor = None
+_threadState = threading.local()
+
+
+def getCompileThreadExecutor():
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="fontgoggles_compile")
+    return _executor
+
+
+def callFunctionInThread(func, args, sendMessage):
+    """Call `func` (a "module.function" string) with `args`, and return its
+    result. This is meant to run on the getCompileThreadExecutor() executor.
+    """
+    moduleName, funcName = func.rsplit(".", 1)
+    module = importlib.import_module(moduleName)
+    function = getattr(module, funcName)
+    threadID = threading.get_ident()
+    logHandler = _LogHandler(sendMessage)
+    logHandler.addFilter(lambda record: record.thread == threadID)
+    savedStreams = sys.stdout, sys.stderr
+    sys.stdout = _ThreadOutputStream(sys.stdout)
+    sys.stderr = _ThreadOutputStream(sys.stderr)
+    _threadState.sendMessage = sendMessage
+    logging.getLogger().addHandler(logHandler)
+    try:
+        return function(*args)
+    finally:
+        logging.getLogger().removeHandler(logHandler)
+        _threadState.sendMessage = None
+        # Others may have replaced them in the meantime
+        if isinstance(sys.stdout, _ThreadOutputStream):
+            sys.stdout = savedStreams[0]
+        if isinstance(sys.stderr, _ThreadOutputStream):
+            sys.stderr = savedStreams[1]
+
+
+class _ThreadOutputStream(io.TextIOBase):
+
+    # Sends what the compile thread writes as "output" messages, and passes
+    # on what other threads write to `stream`.
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        sendMessage = getattr(_threadState, "sendMessage", None)
+        if sendMessage is None:
+            return self.stream.write(text)
+        if text:
+            sendMessage(("output", text))
+        return len(text)
+
+    def flush(self):
+        if getattr(_threadState, "sendMessage", None) is None:
+            self.stream.flush()
+
+    def fileno(self):
+        return self.stream.fileno()
@@ -0,0 +1,98 @@
+""" Timing of the compile stages. The compilers record the seconds spent per
+stage in a {stageName: seconds} dict, and store it in the compiled font as
+a private "FGTm" table, so it travels along with the font data, through the
+compile cache, too.
+
+As font data can come from the compile cache, or from a compiler that found
+nothing changed since it last compiled a source, the timings may be of an
+earlier compile. Each compile gets an ID, so claimCompileTimings() can tell.
+"""
+
+import contextlib
+import os
+import pickle
+import time
+import uuid
+from fontTools.ttLib import newTable
+
+
+# The compile timings are written to the compile output if this is set with
+# setPrintCompileTimings(), or through the FONTGOGGLES_PRINT_COMPILE_TIMINGS
+# environment variable.
+_printCompileTimings = bool(os.environ.get("FONTGOGGLES_PRINT_COMPILE_TIMINGS"))
+
+
+def setPrintCompileTimings(flag):
+    """Enable or disable writing the compile timings to the compile output."""
+    global _printCompileTimings
+    _printCompileTimings = bool(flag)
+
+
+@contextlib.contextmanager
+def timeStage(timings, stageName):
+    """Add the time spent in the with-block to `timings[stageName]`."""
+    startTime = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stageName] = timings.get(stageName, 0) + time.perf_counter() - startTime
+
+
+# Compiles done before this, by earlier sessions, can only come from the cache
+_sessionStartTime = time.time()
+
+# The IDs of the compiles of which the timings were claimed
+_claimedCompileIDs = set()
+
+
+def storeCompileTimings(ttFont, timings):
+    ttFont["FGTm"] = newTable("FGTm")
+    ttFont["FGTm"].data = pickle.dumps((uuid.uuid4().hex, time.time(), timings))
+
+
+def _readCompileTimingsTable(ttFont):
+    if "FGTm" not in ttFont:
+        return None, None, {}
+    return pickle.loads(ttFont["FGTm"].data)
+
+
+def readCompileTimings(ttFont):
+    """Return the timings stored in `ttFont`, or an empty dict if there are
+    none.
+    """
+    return _readCompileTimingsTable(ttFont)[2]
+
+
+def claimCompileTimings(ttFont):
+    """Return a (timings, isFresh) tuple for the font data in `ttFont`.
+    `isFresh` is False if the timings were claimed before in this session, or
+    are from an earlier session: the font data was then not compiled for
+    this call, but reused.
+    """
+    compileID, compileTime, timings = _readCompileTimingsTable(ttFont)
+    if compileID is None:
+        return timings, False
+    isFresh = compileTime >= _sessionStartTime and compileID not in _claimedCompileIDs
+    _claimedCompileIDs.add(compileID)
+    return timings, isFresh
+
+
+def formatCompileTimings(timings, name):
+    lines = [f"compile timings for {name}:"]
+    for stageName, seconds in timings.items():
+        lines.append(f"    {stageName + ':':28} {1000 * seconds:9.1f} ms")
+    lines.append(f"    {'total:':28} {1000 * sum(timings.values()):9.1f} ms")
+    return "\n".join(lines) + "\n"
+
+
+def writeCompileTimings(outputWriter, timings, name, isFresh=True):
+    """Write the timings to `outputWriter`, if enabled with
+    setPrintCompileTimings(). If `isFresh` is False, only write that an
+    earlier compile was reused, see claimCompileTimings().
+    """
+    if not _printCompileTimings or not timings:
+        return
+    if isFresh:
+        outputWriter(formatCompileTimings(timings, name))
+    else:
+        outputWriter(f"compile timings for {name}: none, reused an earlier compile\n")
@@ -0,0 +1,141 @@
+""" Pass large bytes objects, such as compiled fonts, between the compiler pool
+and its worker processes through shared memory, instead of pickling them
+through the pipe.
+
+The parent process owns all segments: it unlinks the segments it created for
+function arguments after the call, and the segments a worker created for a
+result after reading them. The worker keeps the result segments registered
+with its resource tracker until it knows the parent got them, so they don't
+outlive a crash of either process.
+"""
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+
+# Smaller data is not worth the trouble
+minSharedBytesSize = 64 * 1024
+
+
+class SharedBytes:
+
+    """A picklable reference to bytes in a shared memory segment."""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self._shm = None
+
+    def __reduce__(self):
+        return SharedBytes, (self.name, self.size)
+
+    @classmethod
+    def create(cls, data):
+        """Copy `data` into a new segment. It will be unlinked when this
+        process exits, unless it is handed over with disown().
+        """
+        shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        shm.buf[:len(data)] = data
+        self = cls(shm.name, len(data))
+        self._shm = shm
+        return self
+
+    def read(self, unlink=False):
+        """Return the data, as bytes. If `unlink` is True, the segment is
+        removed afterwards.
+        """
+        if self._shm is not None:
+            # We created it
+            data = bytes(self._shm.buf[:self.size])
+            if unlink:
+                self.unlink()
+            return data
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            return bytes(shm.buf[:self.size])
+        finally:
+            shm.close()
+            if unlink:
+                shm.unlink()
+            else:
+                _untrack(shm)
+
+    def close(self):
+        """Unmap the segment this object created, without unlinking it."""
+        assert self._shm is not None
+        self._shm.close()
+
+    def unlink(self, missingOK=False):
+        """Remove the segment this object created. If `missingOK` is True, it
+        is not an error if another process removed it already.
+        """
+        assert self._shm is not None
+        self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            if not missingOK:
+                raise
+            _untrack(self._shm)
+        self._shm = None
+
+    def disown(self):
+        """Leave unlinking the segment this object created to the process
+        that received it.
+        """
+        assert self._shm is not None
+        self._shm.close()
+        _untrack(self._shm)
+        self._shm = None
+
+
+def _untrack(shm):
+    # SharedMemory registers every segment it creates or attaches to with the
+    # resource tracker, which unlinks them when the process exits.
+    resource_tracker.unregister(shm._name, "shared_memory")
+
+
+def shareBytes(value):
+    """Return `value` with large bytes objects replaced by SharedBytes. Lists,
+    tuples and dict values are searched recursively. Without shared memory
+    support, `value` is returned unchanged.
+    """
+    if shared_memory is None:
+        return value
+    if isinstance(value, bytes):
+        if len(value) >= minSharedBytesSize:
+            return SharedBytes.create(value)
+        return value
+    if isinstance(value, (list, tuple)):
+        return type(value)(shareBytes(item) for item in value)
+    if isinstance(value, dict):
+        return {key: shareBytes(item) for key, item in value.items()}
+    return value
+
+
+def unshareBytes(value, unlink=False):
+    """The reverse of shareBytes(): return `value` with the SharedBytes
+    objects replaced by their data.
+    """
+    if isinstance(value, SharedBytes):
+        return value.read(unlink)
+    if isinstance(value, (list, tuple)):
+        return type(value)(unshareBytes(item, unlink) for item in value)
+    if isinstance(value, dict):
+        return {key: unshareBytes(item, unlink) for key, item in value.items()}
+    return value
+
+
+def iterSharedBytes(value):
+    """Yield the SharedBytes objects in `value`, see shareBytes()."""
+    if isinstance(value, SharedBytes):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from iterSharedBytes(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iterSharedBytes(item)
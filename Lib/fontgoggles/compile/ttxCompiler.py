@@ -1,3 +1,4 @@
+import io
 from fontTools.ttLib import TTFont
 
 
@@ -5,3 +6,11 @@ def compileTTXToPath(ttxPath, ttPath):
     font = TTFont()
     font.importXML(ttxPath)
     font.save(ttPath, reorderTables=False)
+
+
+def compileTTXToBytes(ttxPath):
+    font = TTFont()
+    font.importXML(ttxPath)
+    f = io.BytesIO()
+    font.save(f, reorderTables=False)
+    return f.getvalue()
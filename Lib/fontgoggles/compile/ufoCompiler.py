@@ -1,21 +1,36 @@
 """ Tools to compile a UFO's features as quickly as possible."""
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import html
+import io
+import itertools
 import logging
+import os
+import pathlib
 import pickle
 import re
 import sys
 import traceback
 from types import SimpleNamespace
-import xml.etree.ElementTree as ET
+import fs.errors
+from fontTools.feaLib.ast import IncludeStatement
+from fontTools.feaLib.builder import Builder as FeatureBuilder
 from fontTools.feaLib.error import FeatureLibError
+from fontTools.feaLib.parser import Parser as FeatureParser
 from fontTools.fontBuilder import FontBuilder
 from fontTools.ttLib import newTable
-from fontTools.ufoLib import UFOReader
-from fontTools.ufoLib.glifLib import _BaseParser as BaseGlifParser
-from ufo2ft.featureCompiler import FeatureCompiler
+from fontTools.ttLib.tables.DefaultTable import DefaultTable
+from fontTools.ufoLib import UFOReader, UFOFileStructure
+from fontTools.ufoLib import (FONTINFO_FILENAME, GROUPS_FILENAME, KERNING_FILENAME,
+                              FEATURES_FILENAME, LIB_FILENAME)
+from fontTools.ufoLib.glifLib import CONTENTS_FILENAME, GlifLibError, _BaseParser as BaseGlifParser
+from ufo2ft.featureCompiler import FeatureCompiler, parseLayoutFeatures
+from .profiling import storeCompileTimings, timeStage
 
 
-def compileUFOToFont(ufoPath):
+def compileUFOToFont(ufoPath, ufoData=None, timings=None):
     """Compile the source UFO to a TTF with the smallest amount of tables
     needed to let HarfBuzz do its work. That would be 'cmap', 'post' and
     whatever OTL tables are needed for the features. Return the compiled
@@ -24,29 +39,51 @@ def compileUFOToFont(ufoPath):
     This function may do some redundant work (eg. we need an UFOReader
     elsewhere, too), but having a picklable argument and return value
     allows us to run it in a separate process, enabling parallelism.
+
+    `ufoData` is an optional, up to date UFOCompileData object for `ufoPath`.
+    If `timings` is a dict, the duration in seconds of each compile stage,
+    including each feature writer, will be stored in it. The timings are
+    also stored in the font, see profiling.py.
     """
-    reader = UFOReader(ufoPath, validate=False)
-    glyphSet = reader.getGlyphSet()
-    info = SimpleNamespace()
-    reader.readInfo(info)
-
-    glyphOrder = sorted(glyphSet.keys())  # no need for the "real" glyph order
-    if ".notdef" not in glyphOrder:
-        # We need a .notdef glyph, so let's make one.
-        glyphOrder.insert(0, ".notdef")
-    cmap, revCmap, anchors = fetchCharacterMappingAndAnchors(glyphSet, ufoPath)
-    fb = FontBuilder(round(info.unitsPerEm))
-    fb.setupGlyphOrder(glyphOrder)
-    fb.setupCharacterMap(cmap)
-    fb.setupPost()  # This makes sure we store the glyph names
-    ttFont = fb.font
-    # Store anchors in the font as a private table: this is valuable
-    # data that our parent process can use to do faster reloading upon
-    # changes.
-    ttFont["FGAx"] = newTable("FGAx")
-    ttFont["FGAx"].data = pickle.dumps(anchors)
-    ufo = MinimalFontObject(ufoPath, reader, revCmap, anchors)
-    feaComp = FeatureCompiler(ufo, ttFont)
+    if timings is None:
+        timings = {}
+    if ufoData is None:
+        with timeStage(timings, "readSources"):
+            ufoData = UFOCompileData(ufoPath)
+            ufoData.update()
+
+    with timeStage(timings, "setupFont"):
+        glyphOrder = sorted(ufoData.glyphSet.keys())  # no need for the "real" glyph order
+        if ".notdef" not in glyphOrder:
+            # We need a .notdef glyph, so let's make one.
+            glyphOrder.insert(0, ".notdef")
+        cmap, revCmap = buildCharacterMapping(sorted(ufoData.unicodes.items()), ufoPath)
+        anchors = ufoData.anchors
+        fb = FontBuilder(round(ufoData.info.unitsPerEm))
+        fb.setupGlyphOrder(glyphOrder)
+        fb.setupCharacterMap(cmap)
+        fb.setupPost()  # This makes sure we store the glyph names
+        ttFont = fb.font
+        # Store anchors in the font as a private table: this is valuable
+        # data that our parent process can use to do faster reloading upon
+        # changes.
+        ttFont["FGAx"] = newTable("FGAx")
+        ttFont["FGAx"].data = pickle.dumps(anchors)
+        ufo = MinimalFontObject(ufoPath, ufoData, revCmap)
+        feaComp = PartialFeatureCompiler(ufo, ttFont, timings=timings)
+
+    # If only the kerning, groups or anchors changed, the GSUB table is the
+    # same as last time: the feature writers only generate GPOS features. We
+    # pass it to the writers, which need it to classify glyphs, and skip the
+    # substitution rules when building the tables.
+    glyphOrder = tuple(glyphOrder)
+    gsubKey = (glyphOrder, ufoData.features, ufoData.includedFeatureFileStamps, ufoData.lib)
+    cachedGSUB = None
+    if ufoData.gsubCache is not None and ufoData.gsubCache[0] == gsubKey:
+        cachedGSUB = ufoData.gsubCache
+        if cachedGSUB[1] is not None:
+            feaComp._gsub = cachedGSUB[1]
+        feaComp.skipGSUB = True
     try:
         feaComp.compile()
     except FeatureLibError as e:
@@ -57,47 +94,303 @@ def compileUFOToFont(ufoPath):
         error = traceback.format_exc()
     else:
         error = None
+    if error is None:
+        if cachedGSUB is None:
+            with timeStage(timings, "compileGSUB"):
+                gsub = ttFont.get("GSUB")
+                gsubData = gsub.compile(ttFont) if gsub is not None else None
+            cachedGSUB = ufoData.gsubCache = gsubKey, gsub, gsubData
+        if cachedGSUB[2] is not None:
+            ttFont["GSUB"] = DefaultTable("GSUB")
+            ttFont["GSUB"].data = cachedGSUB[2]
+
+    # Compiling the glyph names takes a lot of the time for large fonts, so
+    # we keep the data around for the next compile with the same glyph order
+    if ufoData.postTableData is None or ufoData.postTableData[0] != glyphOrder:
+        with timeStage(timings, "compilePost"):
+            ttFont["maxp"].numGlyphs = len(glyphOrder)  # post.compile() checks this
+            ufoData.postTableData = glyphOrder, ttFont["post"].compile(ttFont)
+    ttFont["post"] = DefaultTable("post")
+    ttFont["post"].data = ufoData.postTableData[1]
+    storeCompileTimings(ttFont, timings)
     return ttFont, error
 
 
-def compileUFOToPath(ufoPath, ttPath):
-    ttFont, error = compileUFOToFont(ufoPath)
+def compileUFOToBytes(ufoPath):
+    ufoData = getUFOCompileData(ufoPath)
+    timings = {}
+    with timeStage(timings, "readSources"):
+        changed = ufoData.update()
+    if changed or ufoData.compiledFont is None:
+        ttFont, error = compileUFOToFont(ufoPath, ufoData, timings)
+        f = io.BytesIO()
+        ttFont.save(f, reorderTables=False)
+        ufoData.compiledFont = f.getvalue(), error
+    fontData, error = ufoData.compiledFont
     if error:
         print(error, file=sys.stderr)
-    ttFont.save(ttPath, reorderTables=False)
+    return fontData
+
+
+def compileUFOToPath(ufoPath, ttPath):
+    fontData = compileUFOToBytes(ufoPath)
+    with open(ttPath, "wb") as f:
+        f.write(fontData)
+
+
+class PartialFeatureCompiler(FeatureCompiler):
+
+    """A FeatureCompiler that can skip building GSUB: if `skipGSUB` is True,
+    the substitution rules are ignored and no GSUB table is built.
+
+    The time spent per stage, and per feature writer, is added to the
+    `timings` dict.
+    """
+
+    skipGSUB = False
+
+    def __init__(self, *args, timings=None, **kwargs):
+        self.timings = {} if timings is None else timings
+        super().__init__(*args, **kwargs)
+
+    def setupFeatures(self):
+        # This is FeatureCompiler.setupFeatures(), plus timing
+        if not self.featureWriters:
+            with timeStage(self.timings, "readFeatures"):
+                super().setupFeatures()
+            return
+        with timeStage(self.timings, "parseFeatures"):
+            featureFile = parseLayoutFeatures(self.ufo)
+        for writer in self.featureWriters:
+            with timeStage(self.timings, type(writer).__name__):
+                writer.write(self.ufo, featureFile, compiler=self)
+        with timeStage(self.timings, "writeFeatures"):
+            # stringify AST to get correct line numbers in error messages
+            self.features = featureFile.asFea()
+
+    def buildTables(self):
+        with timeStage(self.timings, "buildOTL"):
+            self._buildTables()
+
+    def _buildTables(self):
+        if not self.features or not self.skipGSUB:
+            super().buildTables()
+            return
+        # The features were generated by the feature writers, so the include
+        # statements have been resolved already
+        builder = _GPOSOnlyFeatureBuilder(self.ttFont, io.StringIO(self.features))
+        builder.build(tables=FeatureBuilder.supportedTables - {"GSUB"})
+
+
+class _GPOSOnlyFeatureBuilder(FeatureBuilder):
+
+    # The substitution lookups don't contribute to the other tables: GDEF
+    # glyph classes are only inferred from positioning lookups. Resetting
+    # the current lookup makes sure the positioning lookups get split up
+    # the same way as when the substitution rules are there.
+
+    def _skipSubstitution(self, *args, **kwargs):
+        self.cur_lookup_ = None
+
+    add_single_subst = _skipSubstitution
+    add_multiple_subst = _skipSubstitution
+    add_alternate_subst = _skipSubstitution
+    add_ligature_subst = _skipSubstitution
+    add_chain_context_subst = _skipSubstitution
+    add_reverse_chain_single_subst = _skipSubstitution
+
+    def add_lookup_call(self, lookup_name):
+        if self.named_lookups_[lookup_name] is None:
+            # A (skipped) substitution lookup
+            self.cur_lookup_ = None
+            return
+        super().add_lookup_call(lookup_name)
+
+
+# A compile worker process keeps the data of the UFOs it compiled, so that
+# a recompile only needs to reread what changed. The compiler pool sends
+# the jobs for a UFO to the same worker, if it can.
+maxCachedUFOCompileData = 8
+_ufoCompileDataCache = OrderedDict()  # ufoPath: UFOCompileData, least recently used first
+
+
+def getUFOCompileData(ufoPath):
+    """Return the cached UFOCompileData object for `ufoPath`, or a new one.
+    The caller is responsible for calling its update() method.
+    """
+    ufoPath = os.fspath(ufoPath)
+    ufoData = _ufoCompileDataCache.pop(ufoPath, None)
+    if ufoData is None:
+        ufoData = UFOCompileData(ufoPath)
+    _ufoCompileDataCache[ufoPath] = ufoData
+    while len(_ufoCompileDataCache) > maxCachedUFOCompileData:
+        _ufoCompileDataCache.popitem(last=False)
+    return ufoData
+
+
+_trackedUFOFileNames = [FONTINFO_FILENAME, GROUPS_FILENAME, KERNING_FILENAME, FEATURES_FILENAME,
+                        LIB_FILENAME]
+
+
+class UFOCompileData:
+
+    """The UFO data compileUFOToFont() needs: the font info, features, groups,
+    kerning and lib, and the glyph names with their unicodes and anchors.
 
+    The update() method brings the data up to date, rereading only the files
+    that changed since the previous update, based on their modification times
+    and sizes. For a .ufoz, everything is read again.
+    """
+
+    def __init__(self, ufoPath):
+        self.ufoPath = ufoPath
+        self.reader = None
+        self.glyphSet = None
+        self.info = None
+        self.features = self.groups = self.kerning = self.lib = None
+        self.unicodes = {}  # glyphName: unicodes
+        self.anchors = {}  # glyphName: anchors
+        self.compiledFont = None  # (fontData, error), see compileUFOToPath()
+        self.postTableData = None  # (glyphOrder, data), see compileUFOToFont()
+        self.gsubCache = None  # (key, table, data), see compileUFOToFont()
+        self.includedFeatureFileStamps = ()
+        self.glyphObjects = {}  # glyphName: MinimalGlyphObject
+        self._fileStamps = {}
+        self._glyphFileStamps = {}
+        self._contents = {}
+
+    def update(self):
+        """Reread what changed. Return True if anything changed."""
+        try:
+            return self._update()
+        except BaseException:
+            # Our data may be partially updated, start over next time
+            self.reader = None
+            raise
+
+    def _update(self):
+        if self.reader is None or self.reader.fileStructure != UFOFileStructure.PACKAGE:
+            self.reader = UFOReader(self.ufoPath, validate=False)
+            self.glyphSet = self.reader.getGlyphSet()
+            self._fileStamps = {}
+            self._glyphFileStamps = {}
+            self._contents = {}
+            self.unicodes = {}
+            self.anchors = {}
+            self.glyphObjects = {}
+        reader = self.reader
+        glyphSet = self.glyphSet
+        self.includedFeatureFileStamps = tuple((os.fspath(path), _getFileStamp(path))
+                                               for path in extractIncludedFeatureFiles(self.ufoPath, reader))
+        if reader.fileStructure == UFOFileStructure.PACKAGE:
+            fileStamps = _getFileStamps(reader.fs.getsyspath("/"), _trackedUFOFileNames)
+            fileStamps.update(self.includedFeatureFileStamps)
+            glyphFileStamps = _getFileStamps(glyphSet.fs.getsyspath("/"))
+        else:
+            fileStamps = {}
+            glyphFileStamps = {}
+
+        changedFiles = {fileName for fileName in fileStamps.keys() | self._fileStamps.keys()
+                        if fileStamps.get(fileName) != self._fileStamps.get(fileName)}
+        if self.info is None or not fileStamps:
+            changedFiles.update(_trackedUFOFileNames)
+        if FONTINFO_FILENAME in changedFiles:
+            self.info = SimpleNamespace()
+            reader.readInfo(self.info)
+        if FEATURES_FILENAME in changedFiles:
+            self.features = reader.readFeatures()
+        if GROUPS_FILENAME in changedFiles or KERNING_FILENAME in changedFiles:
+            # For UFO 2, reading the kerning depends on the groups
+            self.groups = reader.readGroups()
+            self.kerning = reader.readKerning()
+        if LIB_FILENAME in changedFiles:
+            self.lib = reader.readLib()
+
+        previousContents = self._contents
+        if (self._glyphFileStamps and
+                glyphFileStamps.get(CONTENTS_FILENAME) != self._glyphFileStamps.get(CONTENTS_FILENAME)):
+            # Glyphs may have been added, deleted or renamed
+            glyphSet.rebuildContents()
+        contents = dict(glyphSet.contents)
+        changedFileNames = {fileName for fileName in glyphFileStamps.keys() | self._glyphFileStamps.keys()
+                            if glyphFileStamps.get(fileName) != self._glyphFileStamps.get(fileName)}
+        changedGlyphNames = {glyphName for glyphName in contents.keys() | previousContents.keys()
+                             if contents.get(glyphName) != previousContents.get(glyphName) or
+                             contents.get(glyphName) in changedFileNames}
+        if not glyphFileStamps:
+            changedGlyphNames = set(contents)
+        for glyphName in changedGlyphNames:
+            self.unicodes.pop(glyphName, None)
+            self.anchors.pop(glyphName, None)
+            self.glyphObjects.pop(glyphName, None)
+        for glyphName, unicodes, anchors in scanGLIFs(glyphSet, sorted(changedGlyphNames & contents.keys())):
+            if unicodes:
+                self.unicodes[glyphName] = unicodes
+            if anchors:
+                self.anchors[glyphName] = anchors
+
+        self._fileStamps = fileStamps
+        self._glyphFileStamps = glyphFileStamps
+        self._contents = contents
+        return bool(changedFiles or changedGlyphNames)
+
+
+def _getFileStamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime, st.st_size
 
-_unicodeOrAnchorGLIFPattern = re.compile(re.compile(rb'(<\s*(anchor|unicode)\s+([^>]+)>)'))
-_unicodeAttributeGLIFPattern = re.compile(re.compile(rb'hex\s*=\s*\"([0-9A-Fa-f]+)\"'))
+
+def _getFileStamps(folder, fileNames=None):
+    # Return a {fileName: (mtime, size)} dict for the files in `folder`, or
+    # for `fileNames` only. Missing files are left out.
+    stamps = {}
+    with os.scandir(folder) as scanner:
+        for entry in scanner:
+            if fileNames is not None and entry.name not in fileNames:
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            stamps[entry.name] = st.st_mtime, st.st_size
+    return stamps
+
+
+_unicodeOrAnchorGLIFPattern = re.compile(rb'<\s*(anchor|unicode)\s+([^>]+)>')
+_unicodeAttributeGLIFPattern = re.compile(rb'hex\s*=\s*\"([0-9A-Fa-f]+)\"')
+_attributeGLIFPattern = re.compile(rb'''([\w.:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+
+# Below this number of glyphs, scanning the GLIF files in multiple threads
+# is not worth the overhead.
+parallelScanMinGlyphs = 2000
+parallelScanChunkSize = 1000
+parallelScanMaxWorkers = 8
 
 
 def fetchCharacterMappingAndAnchors(glyphSet, ufoPath, glyphNames=None):
     # This seems about 2.3 times faster than reader.getCharacterMapping()
+    anchors = {}  # glyphName: [(anchorName, x, y), ...]
+    glyphUnicodes = []
+    for glyphName, unicodes, glyphAnchors in scanGLIFs(glyphSet, glyphNames):
+        glyphUnicodes.append((glyphName, unicodes))
+        if glyphAnchors:
+            anchors[glyphName] = glyphAnchors
+    cmap, revCmap = buildCharacterMapping(glyphUnicodes, ufoPath)
+    return cmap, revCmap, anchors
+
+
+def buildCharacterMapping(glyphUnicodes, ufoPath):
+    """Return a (cmap, revCmap) tuple for a sequence of (glyphName, unicodes)
+    tuples. A code point that is assigned to multiple glyphs goes to the first
+    glyph, and a warning will be logged.
+    """
     cmap = {}  # unicode: glyphName
     revCmap = {}
-    anchors = {}  # glyphName: [(anchorName, x, y), ...]
     duplicateUnicodes = {}
-    if glyphNames is None:
-        glyphNames = sorted(glyphSet.keys())
-    for glyphName in glyphNames:
-        data = glyphSet.getGLIF(glyphName)
-        if b"<!--" in data:
-            # Fall back to proper parser, assuming this to be uncommon
-            unicodes, glyphAnchors = fetchUnicodesAndAnchors(data)
-        else:
-            # Fast route with regex
-            unicodes = []
-            glyphAnchors = []
-            for rawElement, tag, rawAttributes in _unicodeOrAnchorGLIFPattern.findall(data):
-                if tag == b"unicode":
-                    m = _unicodeAttributeGLIFPattern.match(rawAttributes)
-                    try:
-                        unicodes.append(int(m.group(1), 16))
-                    except ValueError:
-                        pass
-                elif tag == b"anchor":
-                    root = ET.fromstring(rawElement)
-                    glyphAnchors.append(_parseAnchorAttrs(root.attrib))
+    for glyphName, unicodes in glyphUnicodes:
         uniqueUnicodes = []
         for codePoint in unicodes:
             if codePoint not in cmap:
@@ -108,8 +401,6 @@ def fetchCharacterMappingAndAnchors(glyphSet, ufoPath, glyphNames=None):
                     duplicateUnicodes[codePoint].append(glyphName)
                 else:
                     duplicateUnicodes[codePoint] = [cmap[codePoint], glyphName]
-        if glyphAnchors:
-            anchors[glyphName] = glyphAnchors
         if uniqueUnicodes:
             revCmap[glyphName] = uniqueUnicodes
 
@@ -119,7 +410,87 @@ def fetchCharacterMappingAndAnchors(glyphSet, ufoPath, glyphNames=None):
         logger = logging.getLogger("fontgoggles.font.ufoFont")
         logger.warning("Some code points in '%s' are assigned to multiple glyphs: %s",
                        ufoPath, dupMessage)
-    return cmap, revCmap, anchors
+    return cmap, revCmap
+
+
+def scanGLIFs(glyphSet, glyphNames=None):
+    """Return a list of (glyphName, unicodes, anchors) tuples, in the order
+    of `glyphNames`. If `glyphNames` is None, all glyphs are scanned, sorted
+    by name.
+    """
+    if glyphNames is None:
+        glyphNames = sorted(glyphSet.keys())
+    else:
+        glyphNames = list(glyphNames)
+    readGLIF = _getGLIFReader(glyphSet)
+    if readGLIF is None or len(glyphNames) < parallelScanMinGlyphs:
+        return _scanGLIFs(glyphNames, readGLIF or glyphSet.getGLIF)
+    # Reading the files releases the GIL, so for large UFOs it pays off
+    # to do it from multiple threads. executor.map() keeps the chunks
+    # in order, so the result doesn't depend on the scheduling.
+    chunks = [glyphNames[i:i + parallelScanChunkSize]
+              for i in range(0, len(glyphNames), parallelScanChunkSize)]
+    numWorkers = min(len(chunks), os.cpu_count() or 1, parallelScanMaxWorkers)
+    with ThreadPoolExecutor(numWorkers) as executor:
+        chunkResults = executor.map(functools.partial(_scanGLIFs, readGLIF=readGLIF), chunks)
+        return list(itertools.chain.from_iterable(chunkResults))
+
+
+def _getGLIFReader(glyphSet):
+    # Reading the GLIF files directly is a lot faster than going through
+    # the glyph set's file system object. This is only possible if the
+    # files are on disk, so not for .ufoz. Return None if we can't.
+    try:
+        glyphsFolder = glyphSet.fs.getsyspath("/")
+    except fs.errors.NoSysPath:
+        return None
+    contents = glyphSet.contents
+
+    def readGLIF(glyphName):
+        fileName = contents[glyphName]
+        try:
+            with open(os.path.join(glyphsFolder, fileName), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise GlifLibError(f"The file '{fileName}' associated with glyph '{glyphName}' "
+                               f"in contents.plist does not exist in {glyphsFolder}")
+
+    return readGLIF
+
+
+def _scanGLIFs(glyphNames, readGLIF):
+    # Return a list of (glyphName, unicodes, anchors) tuples
+    results = []
+    for glyphName in glyphNames:
+        data = readGLIF(glyphName)
+        if b"<!--" in data:
+            # Fall back to proper parser, assuming this to be uncommon
+            unicodes, glyphAnchors = fetchUnicodesAndAnchors(data)
+        else:
+            # Fast route with regex
+            unicodes = []
+            glyphAnchors = []
+            for tag, rawAttributes in _unicodeOrAnchorGLIFPattern.findall(data):
+                if tag == b"unicode":
+                    m = _unicodeAttributeGLIFPattern.match(rawAttributes)
+                    try:
+                        unicodes.append(int(m.group(1), 16))
+                    except ValueError:
+                        pass
+                elif tag == b"anchor":
+                    glyphAnchors.append(_parseAnchorAttrs(_parseRawAttributes(rawAttributes)))
+        results.append((glyphName, unicodes, glyphAnchors))
+    return results
+
+
+def _parseRawAttributes(rawAttributes):
+    attrs = {}
+    for name, doubleQuotedValue, singleQuotedValue in _attributeGLIFPattern.findall(rawAttributes):
+        value = (doubleQuotedValue or singleQuotedValue).decode("utf-8")
+        if "&" in value:
+            value = html.unescape(value)
+        attrs[name.decode("ascii")] = value
+    return attrs
 
 
 def fetchUnicodesAndAnchors(glif):
@@ -168,6 +539,87 @@ class FetchUnicodesAndAnchorsParser(BaseGlifParser):
         super().startElementHandler(name, attrs)
 
 
+def extractIncludedFeatureFiles(ufoPath, reader=None):
+    if isinstance(ufoPath, str):
+        ufoPath = pathlib.Path(ufoPath)
+    if reader is None:
+        reader = UFOReader(ufoPath, validate=False)
+    mainFeatures = reader.readFeatures()
+    if not mainFeatures:
+        return ()
+    return sorted(set(_extractIncludedFeatureFiles(mainFeatures, [ufoPath.parent])))
+
+
+def _extractIncludedFeatureFiles(featureSource, searchPaths):
+    for fileName in _getIncludeFileNamesFromSource(featureSource):
+        yield from _resolveIncludedFeatureFile(fileName, searchPaths)
+
+
+def _resolveIncludedFeatureFile(fileName, searchPaths, recursionLevel=0):
+    if recursionLevel > 50:
+        raise FeatureLibError("Too many recursive includes", None)
+    for d in searchPaths:
+        p = d / fileName
+        if p.exists():
+            p = p.resolve()
+            yield p
+            for includedFileName in _getIncludeFileNamesFromFile(p):
+                yield from _resolveIncludedFeatureFile(includedFileName, [searchPaths[0], p.parent],
+                                                       recursionLevel+1)
+            break
+
+
+# Parsing the include statements is relatively expensive, and the same .fea
+# files tend to be included by all sources of a designspace, so we keep the
+# include statements of each included file for the lifetime of the process:
+# {resolvedPath: ((mtime, size), fileNames)}. A changed file will be parsed
+# again, the files it includes only if they changed, too.
+_includedFileNamesCache = {}
+
+
+def _getIncludeFileNamesFromFile(path):
+    st = path.stat()
+    stamp = (st.st_mtime, st.st_size)
+    cached = _includedFileNamesCache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    fileNames = tuple(_parseFeaSource(path.read_text("utf-8", "replace")))
+    _includedFileNamesCache[path] = stamp, fileNames
+    return fileNames
+
+
+@functools.lru_cache(maxsize=64)
+def _getIncludeFileNamesFromSource(featureSource):
+    # The features.fea data of a UFO has no path of its own (think .ufoz), so
+    # we cache the include statements by their source
+    return tuple(_parseFeaSource(featureSource))
+
+
+_feaIncludePat = re.compile(r"include\s*\(([^)]+)\)")
+
+
+def _parseFeaSource(featureSource):
+    pos = 0
+    while True:
+        m = _feaIncludePat.search(featureSource, pos)
+        if m is None:
+            break
+        pos = m.end()
+
+        lineStart = featureSource.rfind("\n", 0, m.start())
+        lineEnd = featureSource.find("\n", m.end())
+        if lineStart == -1:
+            lineStart = 0
+        if lineEnd == -1:
+            lineEnd = len(featureSource)
+        line = featureSource[lineStart:lineEnd]
+        f = io.StringIO(line)
+        p = FeatureParser(f, followIncludes=False)
+        for st in p.parse().statements:
+            if isinstance(st, IncludeStatement):
+                yield st.filename
+
+
 class MinimalFontObject:
 
     # This class and its relatives implement a defcon-like font object, but
@@ -176,17 +628,17 @@ class MinimalFontObject:
     # unicodes and anchors, and at the font level, only features, groups,
     # kerning and lib are needed.
 
-    def __init__(self, ufoPath, reader, revCmap, anchors):
+    def __init__(self, ufoPath, ufoData, revCmap):
         self.path = ufoPath
         self._revCmap = revCmap
-        self._anchors = anchors
-        self._glyphNames = set(reader.getGlyphSet().contents.keys())
+        self._anchors = ufoData.anchors
+        self._glyphNames = set(ufoData.glyphSet.contents.keys())
         self._glyphNames.add(".notdef")  # ensure we have .notdef
-        self.features = MinimalFeaturesObject(reader.readFeatures())
-        self.groups = reader.readGroups()
-        self.kerning = reader.readKerning()
-        self.lib = reader.readLib()
-        self._glyphs = {}
+        self.features = MinimalFeaturesObject(ufoData.features)
+        self.groups = ufoData.groups
+        self.kerning = ufoData.kerning
+        self.lib = ufoData.lib
+        self._glyphs = ufoData.glyphObjects
 
     def keys(self):
         return self._glyphNames
@@ -194,11 +646,14 @@ class MinimalFontObject:
     def __getitem__(self, glyphName):
         if glyphName not in self._glyphNames:
             raise KeyError(glyphName)
-        # TODO: should we even bother caching?
+        # The glyph objects are kept by the UFOCompileData object between
+        # compiles. The unicodes of a glyph can change without the glyph
+        # changing, if other glyphs claim the same code points.
+        unicodes = self._revCmap.get(glyphName)
         glyph = self._glyphs.get(glyphName)
-        if glyph is None:
-            glyph = MinimalGlyphObject(glyphName, self._revCmap.get(glyphName), self._anchors.get(glyphName, ()))
-            self._glyphs[glyphName] = glyphName
+        if glyph is None or glyph.unicodes != unicodes:
+            glyph = MinimalGlyphObject(glyphName, unicodes, self._anchors.get(glyphName, ()))
+            self._glyphs[glyphName] = glyph
         return glyph
 
 
@@ -1,8 +1,34 @@
+""" The compile worker process. It receives function calls from the compiler
+pool (see compilerPool.py) on stdin, and sends back what happens on stdout.
+
+Both directions use the same framing: each message is a pickled tuple,
+prefixed by its length as an 8-byte little-endian integer. A request is a
+(funcName, args) tuple. The worker answers with any number of
+
+    ("output", text)
+    ("log", levelno, loggerName, message)
+    ("progress", info)
+
+messages, then ("memory", maxResidentSize), with the peak memory use of the
+worker in bytes, or None, and finally either ("result", returnValue) or
+("error", text).
+Large bytes objects in the arguments and the return value are passed through
+shared memory, see sharedMemory.py.
+
+The protocol has stdin and stdout to itself: sys.stdout and sys.stderr are
+replaced by streams that send "output" messages, and the stdout file
+descriptor is redirected to stderr, so nothing else can write to the pipe.
+"""
+
 import importlib
-import shlex
+import io
+import logging
+import os
+import pickle
 import signal
 import sys
 import traceback
+from .sharedMemory import iterSharedBytes, shareBytes, unshareBytes
 
 
 def ignoreSignal(sig, frame):
@@ -13,35 +39,153 @@ def raiseKeyboardInterrupt(sig, frame):
     raise KeyboardInterrupt()
 
 
-ERROR_MARKER = "---- ERROR ----"
-SUCCESS_MARKER = "---- SUCCESS ----"
+MESSAGE_HEADER_SIZE = 8
+
+
+def packMessage(message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return len(data).to_bytes(MESSAGE_HEADER_SIZE, "little") + data
+
+
+def unpackMessageSize(header):
+    return int.from_bytes(header, "little")
+
+
+def readMessage(f):
+    """Read a message from binary file `f`. Return None at the end of the
+    file.
+    """
+    header = f.read(MESSAGE_HEADER_SIZE)
+    if len(header) < MESSAGE_HEADER_SIZE:
+        return None
+    size = unpackMessageSize(header)
+    data = f.read(size)
+    if len(data) < size:
+        return None
+    return pickle.loads(data)
+
+
+_sendMessage = None
+
+
+def reportProgress(info):
+    """Send a progress event to the compiler pool, if we're running in a
+    worker process. `info` must be picklable.
+    """
+    if _sendMessage is not None:
+        _sendMessage(("progress", info))
+
+
+def getMaxResidentSize():
+    """Return the peak resident memory size of this process in bytes, or None
+    if it can't be determined.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxResidentSize = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        maxResidentSize *= 1024  # Linux reports kilobytes
+    return maxResidentSize
+
+
+def importModules(moduleNames):
+    """Import modules ahead of time, see CompilerPool.prewarm()."""
+    for moduleName in moduleNames:
+        importlib.import_module(moduleName)
+
+
+class _OutputStream(io.TextIOBase):
+
+    def __init__(self, sendMessage):
+        self.sendMessage = sendMessage
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text:
+            self.sendMessage(("output", text))
+        return len(text)
+
+
+class _LogHandler(logging.Handler):
+
+    def __init__(self, sendMessage):
+        super().__init__(logging.WARNING)
+        self.sendMessage = sendMessage
+
+    def emit(self, record):
+        try:
+            message = record.getMessage()
+        except Exception:
+            self.handleError(record)
+            return
+        self.sendMessage(("log", record.levelno, record.name, message))
 
 
 def workServer():
+    global _sendMessage
     signal.signal(signal.SIGINT, ignoreSignal)
+    inFile = sys.stdin.buffer
+    outFile = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def sendMessage(message):
+        outFile.write(packMessage(message))
+        outFile.flush()
+
+    _sendMessage = sendMessage
+    sys.stdout = sys.stderr = _OutputStream(sendMessage)
+    logging.getLogger().addHandler(_LogHandler(sendMessage))
+
+    # The shared memory segments of the last result, see sharedMemory.py
+    sentResult = None
     while True:
-        input = sys.stdin.readline()
-        input = input.strip()
-        if not input:
+        request = readMessage(inFile)
+        # A new request means the parent read the last result, but if it
+        # quit, it may not have
+        for sharedBytes in iterSharedBytes(sentResult):
+            if request is None:
+                sharedBytes.unlink(missingOK=True)
+            else:
+                sharedBytes.disown()
+        sentResult = None
+        if request is None:
             break
         try:
             try:
                 signal.signal(signal.SIGINT, raiseKeyboardInterrupt)
-                command, *args = shlex.split(input)
+                command, args = request
                 moduleName, funcName = command.rsplit(".", 1)
                 module = importlib.import_module(moduleName)
                 func = getattr(module, funcName)
-                func(*args)
+                result = func(*unshareBytes(args))
             finally:
                 signal.signal(signal.SIGINT, ignoreSignal)
+                sendMessage(("memory", getMaxResidentSize()))
         except KeyboardInterrupt:
-            print(ERROR_MARKER)
+            sendMessage(("error", ""))
         except:
-            traceback.print_exc()
-            print(ERROR_MARKER)
+            sendMessage(("error", traceback.format_exc()))
         else:
-            print(SUCCESS_MARKER)
+            result = shareBytes(result)
+            try:
+                sendMessage(("result", result))
+            except Exception:
+                # The result could not be pickled, or not be sent
+                for sharedBytes in iterSharedBytes(result):
+                    sharedBytes.unlink()
+                sendMessage(("error", traceback.format_exc()))
+            else:
+                for sharedBytes in iterSharedBytes(result):
+                    sharedBytes.close()
+                sentResult = result
 
 
 if __name__ == "__main__":
+    # Run the imported module's server rather than __main__'s, so
+    # reportProgress() works for the functions we call
+    from fontgoggles.compile.workServer import workServer
     workServer()
@@ -1,3 +1,5 @@
+import asyncio
+import time
 from ..misc.properties import cachedProperty
 from ..misc.hbShape import characterGlyphMapping
 from . import mergeScriptsAndLanguages
@@ -5,14 +7,19 @@ from . import mergeScriptsAndLanguages
 
 class BaseFont:
 
+    # The number of variation locations for which we keep glyph drawings
+    maxCachedVarLocations = 16
+
     def __init__(self, fontPath, fontNumber, dataProvider=None):
         self.fontPath = fontPath
         self.fontNumber = fontNumber
+        self.compileTimings = {}  # seconds per stage, if compiled from sources for this load
         self.resetCache()
 
     def resetCache(self):
         self._glyphDrawings = [{}, {}]  # cache for (outline, colorLayers) objects
-        self._currentVarLocation = None  # used to determine whether to purge the outline cache
+        self._glyphDrawingsByVarLocation = {}  # _glyphDrawings caches for recent locations
+        self._currentVarLocation = None  # used to determine whether to switch the outline cache
         # Invalidate cached properties
         del self.unitsPerEm
         del self.colorPalettes
@@ -140,15 +147,87 @@ class BaseFont:
             glyph.glyphDrawing = glyphDrawing
         return glyphInfo
 
+    def getGlyphRuns(self, text, varLocations, *, features=None,
+                     direction=None, language=None, script=None,
+                     colorLayers=False):
+        """Return a list of glyph runs for `text`, one for each location in
+        `varLocations`. This is cheaper than calling getGlyphRun() for each
+        location, as the glyph sequence is reused if the glyph substitutions
+        can't vary with the location.
+        """
+        glyphInfos = self.shaper.shapeMultiple(text, varLocations, features=features,
+                                               direction=direction, language=language, script=script)
+        runs = []
+        for varLocation in varLocations:
+            # Our advance callbacks need to see the location before shaping
+            self.setVarLocation(varLocation)
+            glyphInfo = next(glyphInfos)
+            glyphNames = (gi.name for gi in glyphInfo)
+            for glyph, glyphDrawing in zip(glyphInfo, self.getGlyphDrawings(glyphNames, colorLayers)):
+                glyph.glyphDrawing = glyphDrawing
+            runs.append(glyphInfo)
+        return runs
+
     def setVarLocation(self, varLocation):
+        varLocation = self._subsetVarLocation(varLocation)
+        if self._currentVarLocation != varLocation:
+            self._glyphDrawings = self._getGlyphDrawingsForVarLocation(varLocation)
+            self._currentVarLocation = varLocation
+            self.varLocationChanged(varLocation)
+
+    def _subsetVarLocation(self, varLocation):
         axes = self.axes
         if varLocation:
             # subset to our own axes
             varLocation = {k: v for k, v in varLocation.items() if k in axes}
-        if self._currentVarLocation != varLocation:
-            self._purgeCaches()
-            self._currentVarLocation = varLocation
-            self.varLocationChanged(varLocation)
+        return varLocation
+
+    def _getGlyphDrawingsForVarLocation(self, varLocation):
+        key = varLocationKey(varLocation)
+        cache = self._glyphDrawingsByVarLocation
+        glyphDrawings = cache.pop(key, None)  # we re-insert, to keep the dict in LRU order
+        if glyphDrawings is None:
+            glyphDrawings = [{}, {}]
+            while len(cache) >= self.maxCachedVarLocations:
+                del cache[next(iter(cache))]
+        cache[key] = glyphDrawings
+        return glyphDrawings
+
+    async def prefetchVarLocations(self, glyphNames, varLocations, colorLayers=False, timeSlice=0.005):
+        """Compute the glyph drawings for `glyphNames` at each of `varLocations`
+        ahead of time, so a subsequent getGlyphRun() at one of these locations
+        finds them in the cache. This is meant to run as a background task, for
+        example while the user drags a variation slider: the work is done in
+        small time slices, yielding to the event loop in between. Cancel the task
+        to stop prefetching.
+        """
+        glyphNames = list(dict.fromkeys(glyphNames))
+        currentVarLocation = self._currentVarLocation
+        currentKey = varLocationKey(currentVarLocation)
+        uniqueVarLocations = {}
+        for varLocation in varLocations:
+            varLocation = self._subsetVarLocation(varLocation)
+            key = varLocationKey(varLocation)
+            if key != currentKey:
+                uniqueVarLocations[key] = varLocation
+        varLocations = list(uniqueVarLocations.values())
+        if not varLocations or not glyphNames:
+            return
+        try:
+            self._prefetchVarLocations(glyphNames, varLocations)
+            t = time.time()
+            for varLocation in varLocations:
+                self.setVarLocation(varLocation)
+                for glyphDrawing in self.getGlyphDrawings(glyphNames, colorLayers):
+                    if time.time() - t > timeSlice:
+                        # Other code may use the font while we wait, so it
+                        # must see the original location
+                        self.setVarLocation(currentVarLocation)
+                        await asyncio.sleep(0)
+                        self.setVarLocation(varLocation)
+                        t = time.time()
+        finally:
+            self.setVarLocation(currentVarLocation)
 
     def getGlyphDrawings(self, glyphNames, colorLayers=False):
         for glyphName in glyphNames:
@@ -160,6 +239,20 @@ class BaseFont:
 
     def _purgeCaches(self):
         self._glyphDrawings = [{}, {}]
+        self._glyphDrawingsByVarLocation = {varLocationKey(self._currentVarLocation): self._glyphDrawings}
+
+    def _purgeGlyphDrawings(self, glyphNames, purgeAllColorLayers=False):
+        # Remove the cached drawings for `glyphNames`, for all cached locations.
+        # If `purgeAllColorLayers` is True, all color layer drawings are removed.
+        allGlyphDrawings = [self._glyphDrawings]
+        allGlyphDrawings.extend(glyphDrawings for glyphDrawings in self._glyphDrawingsByVarLocation.values()
+                                if glyphDrawings is not self._glyphDrawings)
+        for glyphDrawings in allGlyphDrawings:
+            if purgeAllColorLayers:
+                glyphDrawings[True].clear()
+            for drawings in glyphDrawings:
+                for glyphName in glyphNames:
+                    drawings.pop(glyphName, None)
 
     def _getGlyphDrawing(self, glyphName, colorLayers):
         raise NotImplementedError()
@@ -168,6 +261,42 @@ class BaseFont:
         # Optional override
         pass
 
+    def _prefetchVarLocations(self, glyphNames, varLocations):
+        # Optional override: subclasses can compute data for several locations
+        # at once, before prefetchVarLocations() collects the glyph drawings
+        # one location at a time.
+        pass
+
+
+def varLocationKey(varLocation):
+    """Return a hashable key for a `varLocation` dict."""
+    if not varLocation:
+        return ()
+    return tuple(sorted(varLocation.items()))
+
+
+def predictVarLocations(previousVarLocation, varLocation, axes, count=2):
+    """Extrapolate the change from `previousVarLocation` to `varLocation`
+    `count` steps further, for example to predict where a dragged slider is
+    going. Return a list of locations, clipped to the `axes` ranges, and
+    leaving out locations that don't differ from `varLocation`.
+    """
+    previousVarLocation = previousVarLocation or {}
+    varLocation = varLocation or {}
+    predicted = []
+    for step in range(1, count + 1):
+        newVarLocation = dict(varLocation)
+        for tag, value in varLocation.items():
+            axis = axes.get(tag)
+            previousValue = previousVarLocation.get(tag)
+            if axis is None or previousValue is None or previousValue == value:
+                continue
+            newValue = value + step * (value - previousValue)
+            newVarLocation[tag] = min(max(newValue, axis["minValue"]), axis["maxValue"])
+        if newVarLocation != varLocation and newVarLocation not in predicted:
+            predicted.append(newVarLocation)
+    return predicted
+
 
 class GlyphsRun(list):
 
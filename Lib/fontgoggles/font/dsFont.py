@@ -6,20 +6,24 @@ import os
 import pathlib
 import pickle
 import sys
-import tempfile
 from types import SimpleNamespace
 import numpy
 from fontTools.pens.basePen import BasePen
 from fontTools.pens.pointPen import PointToSegmentPen
 from fontTools.designspaceLib import DesignSpaceDocument
+from fontTools.fontBuilder import FontBuilder
 from fontTools.ttLib import TTFont
 from fontTools.ufoLib import UFOReader
 from fontTools.varLib.models import normalizeValue
-from .baseFont import BaseFont
+from .baseFont import BaseFont, varLocationKey
 from .glyphDrawing import GlyphDrawing
-from .ufoFont import Glyph, NotDefGlyph, UFOState, extractIncludedFeatureFiles
-from ..compile.compilerPool import compileUFOToPath, compileDSToBytes, CompilerError
-from ..compile.dsCompiler import getTTPaths
+from .ufoFont import (Glyph, NotDefGlyph, UFOState, addComponentUsers, extractIncludedFeatureFiles,
+                      loadUFOState, saveUFOStates, storeUFOState)
+from ..compile.compilerPool import compileUFOToBytes, compileDSToBytes, CompilerError
+from ..compile.profiling import claimCompileTimings, writeCompileTimings
+from ..misc.glifParser import (FT_CURVE_TAG_ON, FT_CURVE_TAG_CONIC, FT_CURVE_TAG_CUBIC,
+                               decomposeComponents, parseGLIFOutline)
+from ..misc.glyphOutlineCache import getGlyphOutlineCache
 from ..misc.hbShape import HBShape
 from ..misc.properties import cachedProperty
 from ..mac.makePathFromOutline import makePathFromArrays
@@ -38,120 +42,142 @@ class DSFont(BaseFont):
         self._normalizedLocation = {}
         self._sourceFontData = {}
         self._ufos = {}
+        self._outlineCaches = {}
         self._needsVFRebuild = True
+        self.sourceCompileTimings = {}  # sourcePath: timings
 
     def resetCache(self):
         super().resetCache()
         self._varGlyphs = {}
+        self._componentUsers = defaultdict(set)  # base glyph name -> names of composites using it
         del self.defaultInfo
         del self.defaultVerticalAdvance
         del self.defaultVerticalOriginY
 
+    def close(self):
+        for sourceKey, outlineCache in self._outlineCaches.items():
+            if outlineCache is not None:
+                ufoState = self._ufos.get(sourceKey)
+                outlineCache.save(ufoState.glyphSet.keys() if ufoState is not None else None)
+        for sourcePath in {sourcePath for sourcePath, sourceLayerName in self._ufos}:
+            saveUFOStates(sourcePath)
+
     async def load(self, outputWriter):
         if self.doc is None:
             self.doc = DesignSpaceDocument.fromfile(self.fontPath)
             self.doc.findDefault()
 
-        with tempfile.TemporaryDirectory(prefix="fontgoggles_temp") as ttFolder:
-            sourcePathToTTPath = getTTPaths(self.doc, ttFolder)
-            ufosToCompile = []
-            ttPaths = []
-            outputs = []
-            coros = []
-            self._sourceFiles = defaultdict(list)
-            self._includedFeatureFiles = defaultdict(list)
-            previousUFOs = self._ufos
-            self._ufos = {}
-            previousSourceData = self._sourceFontData
-            self._sourceFontData = {}
-
-            for source in self.doc.sources:
-                sourceKey = (source.path, source.layerName)
-                self._sourceFiles[pathlib.Path(source.path)].append(sourceKey)
-                ufoState = previousUFOs.get(sourceKey)
-                if ufoState is None:
-                    reader = UFOReader(source.path, validate=False)
-                    glyphSet = reader.getGlyphSet(layerName=source.layerName)
-                    glyphSet.glyphClass = Glyph
-                    if source.layerName is None:
-                        includedFeatureFiles = extractIncludedFeatureFiles(source.path, reader)
-                        getUnicodesAndAnchors = functools.partial(self._getUnicodesAndAnchors, source.path)
-                    else:
-                        includedFeatureFiles = []
-                        # We're not compiling features nor do we need cmaps for these sparse layers,
-                        # so we don't need need proper anchor or unicode data
-                        def getUnicodesAndAnchors(): return ({}, {})
-                    ufoState = UFOState(reader, glyphSet,
-                                        getUnicodesAndAnchors=getUnicodesAndAnchors,
-                                        includedFeatureFiles=includedFeatureFiles)
-                for includedFeaFile in ufoState.includedFeatureFiles:
-                    self._includedFeatureFiles[includedFeaFile].append(sourceKey)
-                self._ufos[sourceKey] = ufoState
-
-                if source.layerName is not None:
-                    continue
+        ufosToCompile = []
+        outputs = []
+        coros = []
+        self._sourceFiles = defaultdict(list)
+        self._includedFeatureFiles = defaultdict(list)
+        previousUFOs = self._ufos
+        self._ufos = {}
+        previousSourceData = self._sourceFontData
+        self._sourceFontData = {}
 
-                if source.path in ufosToCompile:
-                    continue
-                ttPath = sourcePathToTTPath[source.path]
-                if source.path in previousSourceData:
-                    with open(ttPath, "wb") as f:
-                        f.write(previousSourceData[source.path])
-                    self._sourceFontData[source.path] = previousSourceData[source.path]
+        for source in self.doc.sources:
+            sourceKey = (source.path, source.layerName)
+            self._sourceFiles[pathlib.Path(source.path)].append(sourceKey)
+            ufoState = previousUFOs.get(sourceKey)
+            if ufoState is None:
+                reader = UFOReader(source.path, validate=False)
+                glyphSet = reader.getGlyphSet(layerName=source.layerName)
+                glyphSet.glyphClass = Glyph
+                ufoState = loadUFOState(reader, glyphSet, source.path, source.layerName)
+            if ufoState is None:
+                if source.layerName is None:
+                    includedFeatureFiles = extractIncludedFeatureFiles(source.path, reader)
+                    getUnicodesAndAnchors = functools.partial(self._getUnicodesAndAnchors, source.path)
                 else:
-                    ufosToCompile.append(source.path)
-                    ttPaths.append(ttPath)
-                    output = io.StringIO()
-                    outputs.append(output)
-                    coros.append(compileUFOToPath(source.path, ttPath, output.write))
-
-            # print(f"compiling {len(coros)} fonts")
-            errors = await asyncio.gather(*coros, return_exceptions=True)
-
-            for sourcePath, exc, output in zip(ufosToCompile, errors, outputs):
-                output = output.getvalue()
-                if output or exc is not None:
-                    outputWriter(f"compile output for {sourcePath}:\n")
-                    if output:
-                        outputWriter(output)
-                    if exc is not None:
-                        outputWriter(f"{exc!r}\n")
-
-            if any(errors):
-                raise DesignSpaceSourceError(
-                    f"Could not build '{os.path.basename(self.fontPath)}': "
-                    "some sources did not successfully compile"
-                )
-            for sourcePath, ttPath in zip(ufosToCompile, ttPaths):
-                # Store compiled tt data so we can reuse it to rebuild ourselves
-                # without recompiling the source.
-                with open(ttPath, "rb") as f:
-                    self._sourceFontData[sourcePath] = f.read()
-
-            if not ufosToCompile and not self._needsVFRebuild:
-                # self.ttFont and self.shaper are still up-to-date
-                return
-
-            vfFontData = await compileDSToBytes(self.fontPath, ttFolder, outputWriter)
+                    includedFeatureFiles = []
+                    # We're not compiling features nor do we need cmaps for these sparse layers,
+                    # so we don't need need proper anchor or unicode data
+                    def getUnicodesAndAnchors(): return ({}, {})
+                ufoState = UFOState(reader, glyphSet,
+                                    getUnicodesAndAnchors=getUnicodesAndAnchors,
+                                    includedFeatureFiles=includedFeatureFiles)
+            storeUFOState(ufoState, source.path, source.layerName)
+            if sourceKey not in self._outlineCaches:
+                self._outlineCaches[sourceKey] = getGlyphOutlineCache(source.path, source.layerName)
+            for includedFeaFile in ufoState.includedFeatureFiles:
+                self._includedFeatureFiles[includedFeaFile].append(sourceKey)
+            self._ufos[sourceKey] = ufoState
+
+            if source.layerName is not None:
+                continue
+
+            if source.path in ufosToCompile:
+                continue
+            if source.path in previousSourceData:
+                self._sourceFontData[source.path] = previousSourceData[source.path]
+            else:
+                ufosToCompile.append(source.path)
+                output = io.StringIO()
+                outputs.append(output)
+                coros.append(compileUFOToBytes(source.path, output.write,
+                                               ufoState.knownUnicodesAndAnchors))
+
+        # print(f"compiling {len(coros)} fonts")
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        errors = [result if isinstance(result, BaseException) else None for result in results]
+
+        for sourcePath, exc, output in zip(ufosToCompile, errors, outputs):
+            output = output.getvalue()
+            if output or exc is not None:
+                outputWriter(f"compile output for {sourcePath}:\n")
+                if output:
+                    outputWriter(output)
+                if exc is not None:
+                    outputWriter(f"{exc!r}\n")
+
+        if any(errors):
+            raise DesignSpaceSourceError(
+                f"Could not build '{os.path.basename(self.fontPath)}': "
+                "some sources did not successfully compile"
+            )
+        for sourcePath, fontData in zip(ufosToCompile, results):
+            # Store compiled tt data so we can reuse it to rebuild ourselves
+            # without recompiling the source.
+            self._sourceFontData[sourcePath] = fontData
+            timings, isFresh = claimCompileTimings(TTFont(io.BytesIO(fontData), lazy=True))
+            self.sourceCompileTimings[sourcePath] = timings if isFresh else {}
+            writeCompileTimings(outputWriter, timings, os.path.basename(sourcePath), isFresh)
+
+        if not ufosToCompile and not self._needsVFRebuild:
+            # self.ttFont and self.shaper are still up-to-date
+            return
+
+        vfFontData = await compileDSToBytes(self.fontPath, self._sourceFontData, outputWriter)
 
         f = io.BytesIO(vfFontData)
         self.ttFont = TTFont(f, lazy=True)
         # Nice cookie for us from the worker
         self.masterModel = pickle.loads(self.ttFont["MPcl"].data)
         assert len(self.masterModel.deltaWeights) == len(self.doc.sources)
+        # Seconds spent per stage of the variable font build
+        timings, isFresh = claimCompileTimings(self.ttFont)
+        self.compileTimings = timings if isFresh else {}
+        writeCompileTimings(outputWriter, timings, os.path.basename(self.fontPath), isFresh)
 
-        self.shaper = HBShape(vfFontData,
-                              getHorizontalAdvance=self._getHorizontalAdvance,
-                              getVerticalAdvance=self._getVerticalAdvance,
-                              getVerticalOrigin=self._getVerticalOrigin,
-                              ttFont=self.ttFont)
+        self.shaper = self._getShaper(vfFontData)
         self._needsVFRebuild = False
 
+    def _getShaper(self, vfFontData):
+        return HBShape(vfFontData,
+                       getHorizontalAdvance=self._getHorizontalAdvance,
+                       getVerticalAdvance=self._getVerticalAdvance,
+                       getVerticalOrigin=self._getVerticalOrigin,
+                       ttFont=self.ttFont)
+
     def getExternalFiles(self):
         return sorted(self._sourceFiles) + sorted(self._includedFeatureFiles)
 
     def canReloadWithChange(self, externalFilePath):
         invalidateCaches = False
+        needsCmapUpdate = False
+        changedGlyphNames = set()
         if not externalFilePath:
             # Our .designspace file itself changed, let's reload
             self.doc = None
@@ -162,27 +188,73 @@ class DSFont(BaseFont):
                 assert sourceLayerName is None
                 self._sourceFontData.pop(sourcePath, None)  # implies self._needsVFRebuild
                 invalidateCaches = True
+            defaultSourceKey = (self.doc.default.path, self.doc.default.layerName)
             for sourcePath, sourceLayerName in self._sourceFiles.get(externalFilePath, ()):
                 sourceKey = sourcePath, sourceLayerName
-                self._ufos[sourceKey] = self._ufos[sourceKey].newState()
+                ufoState = self._ufos[sourceKey]
+                if ufoState.isZip:
+                    # A .ufoz gets rewritten as a whole, so we need to reopen it
+                    ufoState.reader.close()
+                    reader = UFOReader(sourcePath, validate=False)
+                    glyphSet = reader.getGlyphSet(layerName=sourceLayerName)
+                    glyphSet.glyphClass = Glyph
+                    self._ufos[sourceKey] = ufoState.newState(reader, glyphSet)
+                else:
+                    self._ufos[sourceKey] = ufoState.newState()
                 (needsFeaturesUpdate, needsGlyphUpdate,
-                 needsInfoUpdate, needsCmapUpdate, needsLibUpdate) = self._ufos[sourceKey].getUpdateInfo()
+                 needsInfoUpdate, needsSourceCmapUpdate, needsLibUpdate) = self._ufos[sourceKey].getUpdateInfo()
+                storeUFOState(self._ufos[sourceKey], sourcePath, sourceLayerName)
                 if sourceLayerName is not None:
                     # We don't compile features for layer masters
                     needsFeaturesUpdate = False
                 if needsFeaturesUpdate:
                     self._sourceFontData.pop(sourcePath, None)  # implies self._needsVFRebuild
                     invalidateCaches = True
-                if needsGlyphUpdate or needsInfoUpdate:
-                    invalidateCaches = True
-                if needsCmapUpdate:
-                    # TODO: This could be done more efficiently like how UFOFont
-                    # does it, if the changed source is the default source.
-                    self.doc = None
-                    self._needsVFRebuild = True
+                if needsInfoUpdate:
                     invalidateCaches = True
+                if needsGlyphUpdate:
+                    changedGlyphNames.update(self._ufos[sourceKey].changedGlyphNames)
+                if needsSourceCmapUpdate and sourceKey == defaultSourceKey:
+                    # The variable font takes its cmap from the default source,
+                    # the cmaps of the other sources don't matter.
+                    needsCmapUpdate = True
+        if needsCmapUpdate and not self._needsVFRebuild and not self._updateCmap():
+            self.doc = None
+            self._needsVFRebuild = True
+            invalidateCaches = True
         if invalidateCaches:
             self.resetCache()
+        elif changedGlyphNames:
+            self._purgeGlyphs(changedGlyphNames)
+        return True
+
+    def _purgeGlyphs(self, glyphNames):
+        glyphNames = addComponentUsers(glyphNames, self._componentUsers)
+        for glyphName in glyphNames:
+            self._varGlyphs.pop(glyphName, None)
+        self._purgeGlyphDrawings(glyphNames)
+
+    def _updateCmap(self):
+        # Let the shaper use the new character mapping, leaving the variable
+        # font alone. This is not possible if glyphs were added, in which case
+        # we return False, and we'll need to rebuild the variable font.
+        defaultSource = self.doc.default
+        if defaultSource.path not in self._sourceFontData:
+            # The default source will be recompiled, which implies a full rebuild
+            return True
+        unicodes = self._ufos[(defaultSource.path, defaultSource.layerName)].unicodes
+        newCmap = {code: gn for gn, codes in unicodes.items() for code in codes}
+        if not set(newCmap.values()).issubset(self.ttFont.getGlyphOrder()):
+            return False
+        self.shaper.setCharacterMap(newCmap)
+        # The stored default source font will be reused when the variable font
+        # gets rebuilt, so it needs the new cmap, too.
+        sourceFont = TTFont(io.BytesIO(self._sourceFontData[defaultSource.path]), lazy=True)
+        fb = FontBuilder(font=sourceFont)
+        fb.setupCharacterMap(newCmap)
+        f = io.BytesIO()
+        sourceFont.save(f, reorderTables=False)
+        self._sourceFontData[defaultSource.path] = f.getvalue()
         return True
 
     @cachedProperty
@@ -227,6 +299,19 @@ class DSFont(BaseFont):
         varGlyph.setVarLocation(self._normalizedLocation)
         return varGlyph
 
+    def _prefetchVarLocations(self, glyphNames, varLocations):
+        normalizedLocations = [normalizeLocation(self.doc, varLocation or {}) for varLocation in varLocations]
+        for glyphName in glyphNames:
+            try:
+                varGlyph = self._getVarGlyph(glyphName)
+            except Exception:
+                continue  # _getGlyphDrawing() will report the problem
+            if isinstance(varGlyph, VarGlyph):
+                try:
+                    varGlyph.prefetchVarLocations(normalizedLocations)
+                except Exception:
+                    continue  # setVarLocation() will interpolate on demand
+
     def _getVarGlyphRaw(self, glyphName):
         tags = None
         contours = None
@@ -234,19 +319,24 @@ class DSFont(BaseFont):
         getSubGlyph = None
         masterPoints = []
         for source in self.doc.sources:
-            glyphSet = self._ufos[(source.path, source.layerName)].glyphSet
+            sourceKey = (source.path, source.layerName)
+            glyphSet = self._ufos[sourceKey].glyphSet
             if glyphName not in glyphSet:
                 masterPoints.append(None)
                 continue
-            glyph = glyphSet[glyphName]
-            coll = PointCollector(glyphSet)
             try:
-                glyph.draw(coll)
-                if coll.points and coll.components:
+                glyph = self._readGLIFOutline(sourceKey, glyphName)
+                for baseGlyphName, transformation in glyph.components:
+                    self._componentUsers[baseGlyphName].add(glyphName)
+                if len(glyph.tags) and glyph.components:
                     # When the source mixes outlines and component we need
                     # to decompose to match fontmake/TT behavior
-                    coll = PointCollector(glyphSet, decompose=True)
-                    glyph.draw(coll)
+                    getBaseGlyph = functools.partial(self._readBaseGLIFOutline, sourceKey, glyphName)
+                    points, glyphTags, glyphContours = decomposeComponents(glyph, getBaseGlyph)
+                    glyphComponents = []
+                else:
+                    points, glyphTags, glyphContours = glyph.points, glyph.tags, glyph.contours
+                    glyphComponents = glyph.components
             except Exception as e:
                 print(f"Glyph '{glyphName}' could not be read from '{os.path.basename(source.path)}': {e!r}",
                       file=sys.stderr)
@@ -257,20 +347,20 @@ class DSFont(BaseFont):
                 if vAdvance is None or vAdvance == 0:  # XXX default vAdv == 0 -> bad UFO spec
                     vAdvance = self.defaultVerticalAdvance
                 vOrgX = hAdvance / 2
-                vOrgY = getattr(glyph, "lib", {}).get("public.verticalOrigin")
+                vOrgY = glyph.lib.get("public.verticalOrigin")
                 if vOrgY is None:
                     vOrgY = self.defaultVerticalOriginY
                 phantomPoints = [(hAdvance, 0), (vOrgX, vOrgY), (vOrgX, vOrgY - vAdvance)]
-                if coll.components:
+                if glyphComponents:
                     # Use the component offsets as points (the 2x2 matrix won't interpolate anyway)
-                    points = [t[4:6] for bgn, t in coll.components]
+                    points = [t[4:6] for bgn, t in glyphComponents]
                 else:
-                    points = coll.points
+                    points = points.tolist()
                 masterPoints.append(points + phantomPoints)
                 if source is self.doc.default:
-                    tags = coll.tags
-                    contours = coll.contours
-                    components = coll.components
+                    tags = glyphTags
+                    contours = glyphContours
+                    components = glyphComponents
                     getSubGlyph = self._getVarGlyph
 
         if tags is None:
@@ -281,6 +371,20 @@ class DSFont(BaseFont):
                                 components, getSubGlyph)
         return varGlyph
 
+    def _readBaseGLIFOutline(self, sourceKey, compositeGlyphName, glyphName):
+        self._componentUsers[glyphName].add(compositeGlyphName)
+        return self._readGLIFOutline(sourceKey, glyphName)
+
+    def _readGLIFOutline(self, sourceKey, glyphName):
+        ufoState = self._ufos[sourceKey]
+        if glyphName not in ufoState.glyphSet:
+            return None
+        outlineCache = self._outlineCaches.get(sourceKey)
+        if outlineCache is None:
+            return parseGLIFOutline(ufoState.glyphSet.getGLIF(glyphName))
+        stamp = ufoState.glyphModTimes.get(glyphName)
+        return outlineCache.getOutline(glyphName, stamp, ufoState.glyphSet.getGLIF)
+
     def _getHorizontalAdvance(self, glyphName):
         varGlyph = self._getVarGlyph(glyphName)
         return varGlyph.width
@@ -312,11 +416,6 @@ class DSFont(BaseFont):
         return unicodes, anchors
 
 
-# From FreeType:
-FT_CURVE_TAG_ON = 1
-FT_CURVE_TAG_CONIC = 0
-FT_CURVE_TAG_CUBIC = 2
-
 segmentTypes = {FT_CURVE_TAG_ON: "line", FT_CURVE_TAG_CONIC: "qcurve", FT_CURVE_TAG_CUBIC: "curve"}
 coordinateType = numpy.float
 
@@ -348,6 +447,9 @@ NUMPY_IN_PLACE = True  # dubious improvement
 
 class VarGlyph:
 
+    # The number of locations for which we keep interpolated points
+    maxCachedVarLocations = 16
+
     def __init__(self, glyphName, masterModel, masterPoints, contours, tags, components, getSubGlyph):
         self.model, masterPoints = masterModel.getSubModel(masterPoints)
         masterPoints = [numpy.array(pts, coordinateType) for pts in masterPoints]
@@ -367,15 +469,48 @@ class VarGlyph:
         self._getSubGlyph = getSubGlyph
         self.varLocation = {}
         self._points = None
+        self._pointsCache = {}
 
     def setVarLocation(self, varLocation):
         if varLocation is None:
             varLocation = {}
         if self.varLocation == varLocation:
             return
-        self._points = None
+        self._points = self._pointsCache.get(varLocationKey(varLocation))
         self.varLocation = varLocation
 
+    def prefetchVarLocations(self, varLocations):
+        """Interpolate the points for several (normalized) locations in one
+        go, so setVarLocation() will find them in the cache.
+        """
+        if self.components:
+            # Composite points are cheap to interpolate, but they are assembled
+            # from the component glyphs, which getPoints() does on demand.
+            return
+        missing = {}
+        for varLocation in varLocations:
+            key = varLocationKey(varLocation)
+            if key not in self._pointsCache:
+                missing[key] = varLocation
+        if not missing:
+            return
+        if len(self.deltas) != len(self.model.deltaWeights):
+            # Not interpolatable, we only have the default master
+            for key in missing:
+                self._cachePoints(key, self.deltas[0])
+            return
+        scalars = numpy.array([self.model.getScalars(varLocation) for varLocation in missing.values()],
+                              coordinateType)
+        allPoints = numpy.tensordot(scalars, numpy.array(self.deltas), axes=1)
+        for key, points in zip(missing, allPoints):
+            self._cachePoints(key, points)
+
+    def _cachePoints(self, key, points):
+        cache = self._pointsCache
+        while len(cache) >= self.maxCachedVarLocations:
+            del cache[next(iter(cache))]
+        cache[key] = points
+
     @property
     def contours(self):
         if self._contours is None:
@@ -424,6 +559,7 @@ class VarGlyph:
                     allPoints.append(subPoints + offset)  # skip phantom points
                 allPoints.append(self._points[-3:])  # add phantom points
                 self._points = numpy.concatenate(allPoints)
+            self._cachePoints(varLocationKey(self.varLocation), self._points)
 
         return self._points
 
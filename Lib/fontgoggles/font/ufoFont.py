@@ -1,15 +1,17 @@
+import atexit
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
 import io
-import pathlib
+import itertools
+import logging
 import pickle
 import os
-import re
+import pathlib
 import sys
 from types import SimpleNamespace
-from fontTools.feaLib.parser import Parser as FeatureParser
-from fontTools.feaLib.ast import IncludeStatement
-from fontTools.feaLib.error import FeatureLibError
-from fontTools.fontBuilder import FontBuilder
+import numpy
 from fontTools.pens.cocoaPen import CocoaPen  # TODO: factor out mac-specific code
 from fontTools.ttLib import TTFont
 from fontTools.ufoLib import UFOReader, UFOFileStructure
@@ -20,17 +22,25 @@ from ufo2ft.constants import COLOR_LAYER_MAPPING_KEY, COLOR_PALETTES_KEY
 from .baseFont import BaseFont
 from .glyphDrawing import GlyphDrawing
 from ..compile.compilerPool import compileUFOToBytes
-from ..compile.ufoCompiler import fetchCharacterMappingAndAnchors
+from ..compile.profiling import claimCompileTimings, writeCompileTimings
+from ..compile.ufoCompiler import extractIncludedFeatureFiles, fetchCharacterMappingAndAnchors
+from ..misc.diskCache import getCacheFolder, getCacheKey, writeFileAtomically
+from ..misc.glifParser import decomposeComponents, parseGLIFOutline
+from ..misc.glyphOutlineCache import getGlyphOutlineCache
 from ..misc.hbShape import HBShape
 from ..misc.properties import cachedProperty
+from ..mac.makePathFromOutline import makePathFromArrays
 
 
 class UFOFont(BaseFont):
 
     ufoState = None
+    _outlineCache = None
 
     def resetCache(self):
         super().resetCache()
+        self._cachedGlyphs = {}
+        self._componentUsers = defaultdict(set)  # base glyph name -> names of composites using it
         del self.defaultVerticalAdvance
         del self.defaultVerticalOriginY
         del self.globalColorLayerMapping
@@ -40,30 +50,43 @@ class UFOFont(BaseFont):
         self.glyphSet = self.reader.getGlyphSet()
         self.glyphSet.glyphClass = Glyph
         self.layerGlyphSets = {}
+        self._outlineCache = getGlyphOutlineCache(self.fontPath)
+
+    def close(self):
+        if self._outlineCache is not None:
+            self._outlineCache.save(self.glyphSet.keys())
+        saveUFOStates(self.fontPath)
 
     async def load(self, outputWriter):
         if hasattr(self, "reader"):
-            self._cachedGlyphs = {}
+            # We got reloaded, canReloadWithChange() purged what was needed
             return
         self._setupReaderAndGlyphSet()
         self.info = SimpleNamespace()
         self.reader.readInfo(self.info)
         self.lib = self.reader.readLib()
         self._cachedGlyphs = {}
+        if self.ufoState is None:
+            self.ufoState = loadUFOState(self.reader, self.glyphSet, self.fontPath)
         if self.ufoState is None:
             includedFeatureFiles = extractIncludedFeatureFiles(self.fontPath, self.reader)
             self.ufoState = UFOState(self.reader, self.glyphSet,
                                      getUnicodesAndAnchors=self._getUnicodesAndAnchors,
                                      includedFeatureFiles=includedFeatureFiles)
 
-        fontData = await compileUFOToBytes(self.fontPath, outputWriter)
+        fontData = await compileUFOToBytes(self.fontPath, outputWriter, self.ufoState.knownUnicodesAndAnchors)
+        storeUFOState(self.ufoState, self.fontPath)
 
         f = io.BytesIO(fontData)
         self.ttFont = TTFont(f, lazy=True)
+        timings, isFresh = claimCompileTimings(self.ttFont)
+        self.compileTimings = timings if isFresh else {}
+        writeCompileTimings(outputWriter, timings, os.path.basename(self.fontPath), isFresh)
         self.shaper = self._getShaper(fontData)
 
     def updateFontPath(self, newFontPath):
         """This gets called when the source file was moved."""
+        self.close()
         super().updateFontPath(newFontPath)
         self._setupReaderAndGlyphSet()
 
@@ -71,19 +94,27 @@ class UFOFont(BaseFont):
         return self.ufoState.includedFeatureFiles
 
     def canReloadWithChange(self, externalFilePath):
-        if self.reader.fileStructure != UFOFileStructure.PACKAGE:
-            # We can't (won't) partially reload .ufoz
-            return False
-
         if externalFilePath:
             # Features need to be recompiled no matter what
             return False
 
-        self.glyphSet.rebuildContents()
-
-        self.ufoState = self.ufoState.newState()
+        if self.reader.fileStructure == UFOFileStructure.ZIP:
+            # A .ufoz gets rewritten as a whole, so we need to reopen it. The
+            # UFOState compares the zip central directories, and only the
+            # changed members will be read.
+            self.reader.close()
+            self.reader = UFOReader(self.fontPath, validate=False)
+            self.glyphSet = self.reader.getGlyphSet()
+            self.glyphSet.glyphClass = Glyph
+            # Keep the layer names, so _purgeGlyphs() knows layers were used;
+            # getLayerGlyphSet() will reopen their glyph sets.
+            self.layerGlyphSets = dict.fromkeys(self.layerGlyphSets)
+            self.ufoState = self.ufoState.newState(self.reader, self.glyphSet)
+        else:
+            self.ufoState = self.ufoState.newState()
         (needsFeaturesUpdate, needsGlyphUpdate, needsInfoUpdate,
          needsCmapUpdate, needsLibUpdate) = self.ufoState.getUpdateInfo()
+        storeUFOState(self.ufoState, self.fontPath)
 
         if needsFeaturesUpdate:
             return False
@@ -94,23 +125,39 @@ class UFOFont(BaseFont):
             self.reader.readInfo(self.info)
 
         if needsCmapUpdate:
-            # The cmap changed. Let's update it in-place and only rebuild the shaper
+            # The cmap changed. We don't touch the compiled font, but let the
+            # shaper use the new character mapping.
             newCmap = {code: gn for gn, codes in self.ufoState.unicodes.items() for code in codes}
-            fb = FontBuilder(font=self.ttFont)
-            fb.setupCharacterMap(newCmap)
-            f = io.BytesIO()
-            self.ttFont.save(f, reorderTables=False)
-            self.shaper = self._getShaper(f.getvalue())
+            self.shaper.setCharacterMap(newCmap)
 
         if needsLibUpdate:
             self.lib = self.reader.readLib()
 
-        # We don't explicitly track changes in layers, but they may be involved
-        # in building layered color glyphs, so let's just always reset the cache.
-        self.resetCache()
+        if needsInfoUpdate or needsLibUpdate:
+            # These may affect all glyphs, for example through the unitsPerEm or
+            # the color layer mapping.
+            self.resetCache()
+        else:
+            self._purgeGlyphs(self.ufoState.changedGlyphNames)
 
         return True
 
+    def _purgeGlyphs(self, glyphNames):
+        glyphNames = addComponentUsers(glyphNames, self._componentUsers)
+        if ".notdef" in glyphNames:
+            # Glyphs that could not be read share the .notdef glyph
+            self.resetCache()
+            return
+        for glyphName in glyphNames:
+            self._cachedGlyphs.pop((None, glyphName), None)
+        # We don't explicitly track changes in layers, but they may be involved
+        # in building layered color glyphs, so if we used any, let's purge all
+        # glyphs from other layers, and all color glyph drawings.
+        usesLayers = bool(self.layerGlyphSets)
+        if usesLayers:
+            self._cachedGlyphs = {key: glyph for key, glyph in self._cachedGlyphs.items() if key[0] is None}
+        self._purgeGlyphDrawings(glyphNames, purgeAllColorLayers=usesLayers)
+
     def _getUnicodesAndAnchors(self):
         unicodes = defaultdict(list)
         for code, gn in self.ttFont.getBestCmap().items():
@@ -135,14 +182,16 @@ class UFOFont(BaseFont):
             if glyphName == ".notdef" and glyphName not in self.glyphSet:
                 # We need a .notdef glyph, so let's make one.
                 glyph = NotDefGlyph(self.info.unitsPerEm)
-                self._addOutlinePathToGlyph(glyph)
+                glyph.outline = glyph.getOutline()
             else:
                 try:
                     if layerName is None:
-                        glyph = self.glyphSet[glyphName]
+                        glyphSet = self.glyphSet
                     else:
-                        glyph = self.getLayerGlyphSet(layerName)[glyphName]
-                    self._addOutlinePathToGlyph(glyph)
+                        glyphSet = self.getLayerGlyphSet(layerName)
+                    glyph = self._readGLIFOutline(glyphSet, layerName, glyphName)
+                    getBaseGlyph = functools.partial(self._getBaseGlyph, glyphSet, layerName, glyphName)
+                    glyph.outline = makePathFromArrays(*decomposeComponents(glyph, getBaseGlyph))
                 except Exception as e:
                     # TODO: logging would be better but then capturing in mainWindow.py is harder
                     print(f"Glyph '{glyphName}' could not be read: {e!r}", file=sys.stderr)
@@ -150,10 +199,21 @@ class UFOFont(BaseFont):
             self._cachedGlyphs[(layerName, glyphName)] = glyph
         return glyph
 
-    def _addOutlinePathToGlyph(self, glyph):
-        pen = CocoaPen(self.glyphSet)
-        glyph.draw(pen)
-        glyph.outline = pen.path
+    def _readGLIFOutline(self, glyphSet, layerName, glyphName):
+        if layerName is None and self._outlineCache is not None:
+            stamp = self.ufoState.glyphModTimes.get(glyphName)
+            return self._outlineCache.getOutline(glyphName, stamp, glyphSet.getGLIF)
+        return parseGLIFOutline(glyphSet.getGLIF(glyphName))
+
+    def _getBaseGlyph(self, glyphSet, layerName, compositeGlyphName, glyphName):
+        if layerName is None:
+            self._componentUsers[glyphName].add(compositeGlyphName)
+        if glyphName not in glyphSet:
+            return None
+        glyph = self._getGlyph(glyphName, layerName)
+        if isinstance(glyph, NotDefGlyph):
+            return None
+        return glyph
 
     def _getHorizontalAdvance(self, glyphName):
         glyph = self._getGlyph(glyphName)
@@ -224,6 +284,21 @@ class UFOFont(BaseFont):
         return layerGlyphSet
 
 
+def addComponentUsers(glyphNames, componentUsers):
+    """Return a set with `glyphNames`, plus the names of the glyphs that use
+    any of them as a component, directly or indirectly. `componentUsers` maps
+    base glyph names to the names of the composite glyphs using them.
+    """
+    result = set(glyphNames)
+    stack = list(result)
+    while stack:
+        for userGlyphName in componentUsers.get(stack.pop(), ()):
+            if userGlyphName not in result:
+                result.add(userGlyphName)
+                stack.append(userGlyphName)
+    return result
+
+
 class NotDefGlyph:
 
     def __init__(self, unitsPerEm):
@@ -269,57 +344,6 @@ class Glyph(GLIFGlyph):
     lib = {}  # readonly default!
 
 
-def extractIncludedFeatureFiles(ufoPath, reader=None):
-    if isinstance(ufoPath, str):
-        ufoPath = pathlib.Path(ufoPath)
-    if reader is None:
-        reader = UFOReader(ufoPath, validate=False)
-    mainFeatures = reader.readFeatures()
-    if not mainFeatures:
-        return ()
-    return sorted(set(_extractIncludedFeatureFiles(mainFeatures, [ufoPath.parent])))
-
-
-def _extractIncludedFeatureFiles(featureSource, searchPaths, recursionLevel=0):
-    if recursionLevel > 50:
-        raise FeatureLibError("Too many recursive includes", None)
-    for fileName in _parseFeaSource(featureSource):
-        for d in searchPaths:
-            p = d / fileName
-            if p.exists():
-                p = p.resolve()
-                yield p
-                yield from _extractIncludedFeatureFiles(p.read_text("utf-8", "replace"),
-                                                        [searchPaths[0], p.parent],
-                                                        recursionLevel+1)
-                break
-
-
-_feaIncludePat = re.compile(r"include\s*\(([^)]+)\)")
-
-
-def _parseFeaSource(featureSource):
-    pos = 0
-    while True:
-        m = _feaIncludePat.search(featureSource, pos)
-        if m is None:
-            break
-        pos = m.end()
-
-        lineStart = featureSource.rfind("\n", 0, m.start())
-        lineEnd = featureSource.find("\n", m.end())
-        if lineStart == -1:
-            lineStart = 0
-        if lineEnd == -1:
-            lineEnd = len(featureSource)
-        line = featureSource[lineStart:lineEnd]
-        f = io.StringIO(line)
-        p = FeatureParser(f, followIncludes=False)
-        for st in p.parse().statements:
-            if isinstance(st, IncludeStatement):
-                yield st.filename
-
-
 ufoFilesToTrack = [FONTINFO_FILENAME, GROUPS_FILENAME, KERNING_FILENAME, FEATURES_FILENAME,
                    LIB_FILENAME]
 
@@ -344,10 +368,17 @@ class UFOState:
     # by UFOFont.canReloadWithChange() as we'll get separate file-changed events
     # for that.
     #
+    # Modification times can change without the file contents changing, for
+    # example after a git checkout. If useContentHashes is True, we keep hashes
+    # of the tracked files, and only report files whose hash changed. That
+    # costs reading all .glif files once, when the first state is made.
+    #
+
+    useContentHashes = False
 
     def __init__(self, reader, glyphSet, anchors=None, unicodes=None,
                  getUnicodesAndAnchors=None, includedFeatureFiles=(),
-                 previousState=None):
+                 previousState=None, modTimes=None, useContentHashes=None):
         self.reader = reader
         self.glyphSet = glyphSet
         assert (anchors is not None) == (getUnicodesAndAnchors is None)
@@ -355,20 +386,51 @@ class UFOState:
         self._anchors = anchors
         self._unicodes = unicodes
         self._getUnicodesAndAnchors = getUnicodesAndAnchors
-        self.glyphModTimes, self.contentsModTime = getGlyphModTimes(glyphSet)
-        self.fileModTimes = getFileModTimes(reader.fs.getsyspath("/"), ufoFilesToTrack)
+        self.isZip = reader.fileStructure == UFOFileStructure.ZIP
+        if modTimes is None and self.isZip:
+            # The (CRC32, size) of the archive members take the place of the
+            # (mtime, size) of the files, so we don't need content hashes
+            self.glyphModTimes = getZipGlyphStamps(glyphSet)
+            self.contentsModTime = self.glyphModTimes.contentsModTime
+            self.fileModTimes = set(getZipStamps(reader.fs, "/", ufoFilesToTrack).items())
+            useContentHashes = False
+        elif modTimes is None:
+            previousGlyphModTimes = None if previousState is None else previousState.glyphModTimes
+            self.glyphModTimes = getGlyphModTimes(glyphSet, previousGlyphModTimes)
+            self.contentsModTime = self.glyphModTimes.contentsModTime
+            self.fileModTimes = getFileModTimes(reader.fs.getsyspath("/"), ufoFilesToTrack)
+        else:
+            # The state as it was saved earlier, see UFOState.fromSnapshot()
+            self.glyphModTimes, self.contentsModTime, self.fileModTimes = modTimes
+        if useContentHashes is not None:
+            self.useContentHashes = useContentHashes
+        self.glyphHashes = None  # glyph name -> hash of the .glif data
+        self.fileHashes = None  # file name -> hash of the file data, for ufoFilesToTrack
+        if self.useContentHashes and previousState is None and modTimes is None:
+            self.glyphHashes = getGlyphHashes(glyphSet)
+            self.fileHashes = getFileHashes(reader.fs.getsyspath("/"), ufoFilesToTrack)
         self.includedFeatureFiles = includedFeatureFiles
         self._previousState = previousState
+        self.changedGlyphNames = set()  # set by getUpdateInfo()
 
-    def newState(self):
+    def newState(self, reader=None, glyphSet=None):
         # This method can only be called on a brand new state without a previous
         # state, or on a state that was properly updated via a call to getUpdateInfo()
+        # For a .ufoz, pass a freshly opened reader and glyph set, as the archive
+        # may have been rewritten.
         assert self._previousState is None, "state was not updated"
-        newState = UFOState(self.reader, self.glyphSet,
+        if reader is None:
+            reader, glyphSet = self.reader, self.glyphSet
+            assert not self.isZip, "the .ufoz must be reopened"
+            contentsPath = os.path.join(glyphSet.fs.getsyspath("/"), CONTENTS_FILENAME)
+            if getModTime(contentsPath) != self.contentsModTime:
+                # Glyphs may have been added, deleted or renamed
+                glyphSet.rebuildContents()
+        newState = UFOState(reader, glyphSet,
                             self._anchors, self._unicodes,
                             self._getUnicodesAndAnchors,
                             self.includedFeatureFiles,
-                            self)
+                            self, useContentHashes=self.useContentHashes)
         self._previousState = None
         return newState
 
@@ -380,6 +442,9 @@ class UFOState:
         self._previousState = None
 
         changedFiles = {fileName for fileName, modTime in prev.fileModTimes ^ self.fileModTimes}
+        changedGlyphNames = self.glyphModTimes.getChangedGlyphNames(prev.glyphModTimes)
+        if self.useContentHashes and not self.isZip:
+            changedFiles, changedGlyphNames = self._confirmChanges(prev, changedFiles, changedGlyphNames)
 
         needsInfoUpdate = FONTINFO_FILENAME in changedFiles
         needsLibUpdate = LIB_FILENAME in changedFiles
@@ -391,12 +456,12 @@ class UFOState:
         needsGlyphUpdate = False
         needsCmapUpdate = False
 
-        if prev.glyphModTimes != self.glyphModTimes or prev.contentsModTime != self.contentsModTime:
-            changedGlyphNames = {glyphName for glyphName, mtime in prev.glyphModTimes ^ self.glyphModTimes}
+        if changedGlyphNames:
+            self.changedGlyphNames = changedGlyphNames
             deletedGlyphNames = {glyphName for glyphName in changedGlyphNames if glyphName not in self.glyphSet}
 
             _, changedUnicodes, changedAnchors = fetchCharacterMappingAndAnchors(self.glyphSet,
-                                                                                 self.reader.fs.getsyspath("/"),
+                                                                                 _getUFOPath(self.reader),
                                                                                  changedGlyphNames - deletedGlyphNames)
 
             # Within the changed glyphs, let's see if their anchors changed
@@ -422,6 +487,72 @@ class UFOState:
 
         return needsFeaturesUpdate, needsGlyphUpdate, needsInfoUpdate, needsCmapUpdate, needsLibUpdate
 
+    def _confirmChanges(self, prev, changedFiles, changedGlyphNames):
+        # Return the subsets of the files and glyphs with changed modification
+        # times, whose contents actually changed. Only their data is hashed.
+        ufoFolder = self.reader.fs.getsyspath("/")
+        if prev.fileHashes is None or prev.glyphHashes is None:
+            # We have nothing to compare with: start keeping hashes from here
+            self.fileHashes = getFileHashes(ufoFolder, ufoFilesToTrack)
+            self.glyphHashes = getGlyphHashes(self.glyphSet)
+            return changedFiles, changedGlyphNames
+
+        fileHashes = dict(prev.fileHashes)
+        fileHashes.update(getFileHashes(ufoFolder, changedFiles))
+        self.fileHashes = fileHashes
+        changedFiles = {fileName for fileName in changedFiles
+                        if fileHashes.get(fileName) != prev.fileHashes.get(fileName)}
+
+        glyphHashes = dict(prev.glyphHashes)
+        glyphHashes.update(getGlyphHashes(self.glyphSet, changedGlyphNames))
+        changedGlyphNames = {glyphName for glyphName in changedGlyphNames
+                             if glyphHashes.get(glyphName) != prev.glyphHashes.get(glyphName)}
+        self.glyphHashes = {glyphName: glyphHash for glyphName, glyphHash in glyphHashes.items()
+                            if glyphHash is not None}
+        return changedFiles, changedGlyphNames
+
+    def getSnapshot(self):
+        """Return a picklable snapshot of the state, from which it can be
+        restored with UFOState.fromSnapshot().
+        """
+        includedFeatureFiles = [(os.fspath(path), getModTime(path)) for path in self.includedFeatureFiles]
+        return dict(glyphModTimes=self.glyphModTimes, contentsModTime=self.contentsModTime,
+                    fileModTimes=self.fileModTimes, unicodes=self.unicodes, anchors=self.anchors,
+                    includedFeatureFiles=includedFeatureFiles,
+                    glyphHashes=self.glyphHashes, fileHashes=self.fileHashes)
+
+    @classmethod
+    def fromSnapshot(cls, reader, glyphSet, snapshot, layerName=None):
+        """Restore a state from a snapshot made by getSnapshot(), and update it
+        to the current state of the UFO. Only the .glif files that changed since
+        the snapshot was made will be read. The state of a sparse layer
+        (`layerName` is not None) has no included feature files, as its
+        features are not compiled.
+        """
+        modTimes = snapshot["glyphModTimes"], snapshot["contentsModTime"], snapshot["fileModTimes"]
+        includedFeatureFiles = [pathlib.Path(path) for path, modTime in snapshot["includedFeatureFiles"]]
+        snapshotState = cls(reader, glyphSet, anchors=snapshot["anchors"], unicodes=snapshot["unicodes"],
+                            includedFeatureFiles=includedFeatureFiles, modTimes=modTimes)
+        snapshotState.glyphHashes = snapshot["glyphHashes"]
+        snapshotState.fileHashes = snapshot["fileHashes"]
+        state = snapshotState.newState()
+        needsFeaturesUpdate = state.getUpdateInfo()[0]
+        if layerName is not None:
+            state.includedFeatureFiles = []
+        elif needsFeaturesUpdate or any(getModTime(path) != modTime
+                                        for path, modTime in snapshot["includedFeatureFiles"]):
+            state.includedFeatureFiles = extractIncludedFeatureFiles(reader.fs.getsyspath("/"), reader)
+        return state
+
+    @property
+    def knownUnicodesAndAnchors(self):
+        """The (unicodes, anchors) tuple if we have it, or None if getting it
+        would require the compiled font.
+        """
+        if self._getUnicodesAndAnchors is not None:
+            return None
+        return self._unicodes, self._anchors
+
     @property
     def anchors(self):
         if self._anchors is None:
@@ -447,6 +578,80 @@ class UFOState:
         self._getUnicodesAndAnchors = None
 
 
+UFO_STATE_SNAPSHOT_VERSION = 3
+
+logger = logging.getLogger(__name__)
+
+# States that were stored with storeUFOState(), but not yet written to disk
+_unsavedUFOStates = {}
+
+
+def _getUFOStateSnapshotPath(ufoPath, layerName):
+    cacheFolder = getCacheFolder("ufoStates")
+    if cacheFolder is None:
+        return None
+    return cacheFolder / (getCacheKey(os.fspath(ufoPath), layerName) + ".fgufostate")
+
+
+def loadUFOState(reader, glyphSet, ufoPath, layerName=None):
+    """Return a UFOState for the UFO at `ufoPath`, restored from the snapshot
+    saved in an earlier session and updated to the current state of the UFO.
+    Return None if there is no usable snapshot, or if on-disk caching is
+    disabled.
+    """
+    if reader.fileStructure != UFOFileStructure.PACKAGE:
+        return None
+    snapshotPath = _getUFOStateSnapshotPath(ufoPath, layerName)
+    if snapshotPath is None:
+        return None
+    try:
+        with open(snapshotPath, "rb") as f:
+            version, snapshotUFOPath, snapshotLayerName, snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Can't read UFO state snapshot '%s': %r", snapshotPath, e)
+        return None
+    if (version, snapshotUFOPath, snapshotLayerName) != (UFO_STATE_SNAPSHOT_VERSION, os.fspath(ufoPath), layerName):
+        return None
+    try:
+        return UFOState.fromSnapshot(reader, glyphSet, snapshot, layerName)
+    except Exception as e:
+        logger.warning("Can't restore UFO state from '%s': %r", snapshotPath, e)
+        return None
+
+
+def storeUFOState(ufoState, ufoPath, layerName=None):
+    """Remember `ufoState` as the latest state of the UFO at `ufoPath`. It will
+    be written to disk by saveUFOStates(), which is called at exit.
+    """
+    if ufoState.reader.fileStructure != UFOFileStructure.PACKAGE:
+        return
+    _unsavedUFOStates[os.fspath(ufoPath), layerName] = ufoState
+
+
+def saveUFOStates(ufoPath=None):
+    """Write the snapshots of the stored UFO states to disk, either for all
+    UFOs, or for `ufoPath` only.
+    """
+    for key in list(_unsavedUFOStates):
+        if ufoPath is not None and key[0] != os.fspath(ufoPath):
+            continue
+        ufoState = _unsavedUFOStates.pop(key)
+        snapshotPath = _getUFOStateSnapshotPath(*key)
+        if snapshotPath is None:
+            continue
+        try:
+            data = pickle.dumps((UFO_STATE_SNAPSHOT_VERSION, *key, ufoState.getSnapshot()),
+                                protocol=pickle.HIGHEST_PROTOCOL)
+            writeFileAtomically(snapshotPath, data)
+        except Exception as e:
+            logger.warning("Can't write UFO state snapshot '%s': %r", snapshotPath, e)
+
+
+atexit.register(saveUFOStates)
+
+
 def getModTime(path):
     try:
         return os.stat(path).st_mtime
@@ -454,16 +659,213 @@ def getModTime(path):
         return None
 
 
-def getGlyphModTimes(glyphSet):
+# Above this number of .glif files, we stat or hash them from multiple threads,
+# which helps a lot for network volumes
+parallelStatMinFiles = 2000
+parallelStatChunkSize = 1000
+parallelStatMaxWorkers = 16
+
+
+class GlyphModTimes:
+
+    """The (mtime, size) stamps of the .glif files of a glyph set, stored as
+    arrays, as returned by getGlyphModTimes(). The mtimes of the glyphs folder
+    and of contents.plist are kept as well.
+    """
+
+    def __init__(self, folderModTime, contentsModTime, glyphNames, fileNames, modTimes, sizes,
+                 scannedFileNames=None, scanIndices=None):
+        self.folderModTime = folderModTime
+        self.contentsModTime = contentsModTime
+        self.glyphNames = glyphNames  # tuple
+        self.fileNames = fileNames  # tuple, in the same order as glyphNames
+        self.modTimes = modTimes  # float array, 0 for missing files
+        self.sizes = sizes  # int array, -1 for missing files
+        # The file names in the order os.scandir() returned them, and for each
+        # glyph the index into that order, so the next scan can skip matching
+        # the file names if the folder didn't change.
+        self.scannedFileNames = scannedFileNames
+        self.scanIndices = scanIndices
+        self._glyphIndices = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_glyphIndices"] = None
+        return state
+
+    def __len__(self):
+        return len(self.glyphNames)
+
+    def get(self, glyphName, default=None):
+        """Return the (mtime, size) tuple for `glyphName`, or `default` if the
+        glyph or its .glif file doesn't exist.
+        """
+        if self._glyphIndices is None:
+            self._glyphIndices = {glyphName: index for index, glyphName in enumerate(self.glyphNames)}
+        index = self._glyphIndices.get(glyphName)
+        if index is None or self.sizes[index] < 0:
+            return default
+        return float(self.modTimes[index]), int(self.sizes[index])
+
+    def items(self):
+        for glyphName, modTime, size in zip(self.glyphNames, self.modTimes.tolist(), self.sizes.tolist()):
+            yield glyphName, (None if size < 0 else (modTime, size))
+
+    def getChangedGlyphNames(self, other):
+        """Return the set of names of the glyphs that were added, deleted or
+        changed compared to `other`.
+        """
+        if self.glyphNames == other.glyphNames:
+            # This is the common case, we can compare the arrays
+            changed = (self.modTimes != other.modTimes) | (self.sizes != other.sizes)
+            return {self.glyphNames[index] for index in numpy.flatnonzero(changed)}
+        return {glyphName for glyphName, stamp in set(self.items()) ^ set(other.items())}
+
+
+def getGlyphModTimes(glyphSet, previous=None):
+    """Return a GlyphModTimes object for `glyphSet`. If `previous` is given,
+    and neither the glyphs folder nor contents.plist changed since, its glyph
+    name mapping will be reused.
+    """
     folder = glyphSet.fs.getsyspath("/")  # We don't support .ufoz here
+    folderModTime = getModTime(folder)
     contentsModTime = getModTime(os.path.join(folder, CONTENTS_FILENAME))
-    return {(glyphName, getModTime(os.path.join(folder, fileName)))
-            for glyphName, fileName in glyphSet.contents.items()}, contentsModTime
+    scannedFileNames, scannedModTimes, scannedSizes = _scanFolderModTimes(folder)
+    if (previous is not None and previous.folderModTime == folderModTime and
+            previous.contentsModTime == contentsModTime):
+        # No files were added or removed, and the glyph names map to the same
+        # files. We do still need to check all files, as files that are written
+        # in-place don't change the modification time of the folder.
+        glyphNames = previous.glyphNames
+        fileNames = previous.fileNames
+    else:
+        glyphNames = tuple(glyphSet.contents.keys())
+        fileNames = tuple(glyphSet.contents.values())
+        previous = None
+    if previous is not None and previous.scannedFileNames == scannedFileNames:
+        scanIndices = previous.scanIndices
+    else:
+        fileIndices = {fileName: index for index, fileName in enumerate(scannedFileNames)}
+        scanIndices = numpy.array([fileIndices.get(fileName, -1) for fileName in fileNames], numpy.intp)
+    # Append an entry for missing files, so we can index with -1
+    modTimes = numpy.append(scannedModTimes, 0)[scanIndices]
+    sizes = numpy.append(scannedSizes, -1)[scanIndices]
+    return GlyphModTimes(folderModTime, contentsModTime, glyphNames, fileNames, modTimes, sizes,
+                         scannedFileNames, scanIndices)
+
+
+def _scanFolderModTimes(folder):
+    # Return the names of the .glif files in `folder`, plus arrays with their
+    # mtimes and sizes, using a single os.scandir() pass.
+    with os.scandir(folder) as scanner:
+        entries = [entry for entry in scanner if entry.name.endswith(".glif")]
+    if len(entries) < parallelStatMinFiles:
+        stats = _statEntries(entries)
+    else:
+        chunks = [entries[i:i + parallelStatChunkSize] for i in range(0, len(entries), parallelStatChunkSize)]
+        with ThreadPoolExecutor(min(len(chunks), parallelStatMaxWorkers)) as executor:
+            stats = list(itertools.chain.from_iterable(executor.map(_statEntries, chunks)))
+    fileNames = tuple(fileName for fileName, modTime, size in stats)
+    modTimes = numpy.array([modTime for fileName, modTime, size in stats], numpy.float64)
+    sizes = numpy.array([size for fileName, modTime, size in stats], numpy.int64)
+    return fileNames, modTimes, sizes
+
+
+def _statEntries(entries):
+    result = []
+    for entry in entries:
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        result.append((entry.name, st.st_mtime, st.st_size))
+    return result
+
+
+def getZipGlyphStamps(glyphSet):
+    """Like getGlyphModTimes(), but for a glyph set in a .ufoz archive. The
+    (CRC32, size) of the members, as listed in the central directory of the
+    archive, are used as stamps, instead of (mtime, size). Members are not
+    read, nor extracted.
+    """
+    glyphNames = tuple(glyphSet.contents.keys())
+    fileNames = tuple(glyphSet.contents.values())
+    stamps = getZipStamps(glyphSet.fs, "/")
+    missing = (0, -1)
+    crcs = numpy.array([stamps.get(fileName, missing)[0] for fileName in fileNames], numpy.float64)
+    sizes = numpy.array([stamps.get(fileName, missing)[1] for fileName in fileNames], numpy.int64)
+    return GlyphModTimes(None, stamps.get(CONTENTS_FILENAME), glyphNames, fileNames, crcs, sizes)
+
+
+def getZipStamps(zipFS, folder, fileNames=None):
+    """Return a {fileName: (crc32, size)} dict for the members in `folder` of
+    a zip file system, taken from the central directory of the archive. If
+    `fileNames` is given, it will have an entry for each of those, with None
+    for missing members.
+    """
+    stamps = {} if fileNames is None else dict.fromkeys(fileNames)
+    for info in zipFS.scandir(folder, namespaces=["zip"]):
+        zipInfo = info.raw.get("zip")
+        if zipInfo is None or info.is_dir:
+            continue
+        if fileNames is None or info.name in stamps:
+            stamps[info.name] = zipInfo["CRC"], zipInfo["file_size"]
+    return stamps
+
+
+def _getUFOPath(reader):
+    # For messages only: the root of a .ufoz has no system path
+    if reader.fileStructure == UFOFileStructure.ZIP:
+        return reader._path
+    return reader.fs.getsyspath("/")
 
 
 def getFileModTimes(folder, fileNames):
-    return {(fileName, getModTime(os.path.join(folder, fileName)))
-            for fileName in fileNames}
+    modTimes = dict.fromkeys(fileNames)
+    with os.scandir(folder) as scanner:
+        for entry in scanner:
+            if entry.name in modTimes:
+                try:
+                    modTimes[entry.name] = entry.stat().st_mtime
+                except FileNotFoundError:
+                    pass
+    return set(modTimes.items())
+
+
+def getFileHashes(folder, fileNames):
+    """Return a {fileName: hash} dict for the files in `folder`. The hash is
+    None for files that don't exist.
+    """
+    return {fileName: _hashFile(os.path.join(folder, fileName)) for fileName in fileNames}
+
+
+def getGlyphHashes(glyphSet, glyphNames=None):
+    """Return a {glyphName: hash} dict for the .glif files of `glyphSet`, or
+    of the glyphs in `glyphNames` only. The hash is None for glyphs that don't
+    exist.
+    """
+    folder = glyphSet.fs.getsyspath("/")  # We don't support .ufoz here
+    if glyphNames is None:
+        glyphNames = glyphSet.contents.keys()
+    glyphNames = list(glyphNames)
+    paths = [None if glyphName not in glyphSet.contents else
+             os.path.join(folder, glyphSet.contents[glyphName]) for glyphName in glyphNames]
+    if len(paths) < parallelStatMinFiles:
+        hashes = [_hashFile(path) for path in paths]
+    else:
+        with ThreadPoolExecutor(parallelStatMaxWorkers) as executor:
+            hashes = list(executor.map(_hashFile, paths))
+    return dict(zip(glyphNames, hashes))
+
+
+def _hashFile(path):
+    if path is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            return hashlib.blake2b(f.read(), digest_size=16).digest()
+    except FileNotFoundError:
+        return None
 
 
 if __name__ == "__main__":
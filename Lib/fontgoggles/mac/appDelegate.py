@@ -1,10 +1,14 @@
+import asyncio
 import os
 import pathlib
 from AppKit import NSDocumentController
-from Foundation import NSObject, NSURL
+from Foundation import (NSObject, NSURL, NSSearchPathForDirectoriesInDomains,
+                        NSCachesDirectory, NSUserDomainMask)
 from vanilla.dialogs import getFile
+from ..compile.compilerPool import prewarmCompilerPool
 from ..font import sniffFontType, fileTypes
 from ..misc.decorators import suppressAndLogException
+from ..misc.diskCache import setCacheFolder
 from .document import FGDocument
 
 
@@ -13,6 +17,12 @@ class FGAppDelegate(NSObject):
     filesToOpen = None
     unicodePicker = None
 
+    def applicationWillFinishLaunching_(self, notification):
+        cachesFolder = NSSearchPathForDirectoriesInDomains(NSCachesDirectory, NSUserDomainMask, True)[0]
+        setCacheFolder(os.path.join(cachesFolder, "com.github.justvanrossum.FontGoggles"))
+        # Start a compile worker while the user is picking fonts
+        asyncio.ensure_future(prewarmCompilerPool())
+
     def openDocument_(self, sender):
         result = getFile(allowsMultipleSelection=True,
                          fileTypes=fileTypes + ["gggls"])  # resultCallback=self.getFileResultCallback_)
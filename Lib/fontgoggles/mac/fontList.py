@@ -649,6 +649,11 @@ class FontList(Group):
                 selRect = AppKit.NSUnionRect(selRect, fontItem._nsObject.frame())
         return selRect
 
+    def getVisibleFontItemIdentifiers(self):
+        visibleRect = self._nsObject.visibleRect()
+        return {fontItemInfo.identifier for fontItemInfo, fontItem in self.iterFontItemInfoAndItems()
+                if AppKit.NSIntersectsRect(fontItem._nsObject.frame(), visibleRect)}
+
     def scrollSelectionToVisible(self, selection=None):
         if selection is None:
             selection = self._selection
@@ -15,7 +15,7 @@ from vanilla import (ActionButton, CheckBox, EditText, Group, List, PopUpButton,
 from vanilla.dialogs import getFile
 from fontTools.misc.arrayTools import offsetRect
 from fontgoggles.font import mergeAxes, mergeScriptsAndLanguages, mergeStylisticSetNames
-from fontgoggles.font.baseFont import GlyphsRun
+from fontgoggles.font.baseFont import GlyphsRun, predictVarLocations
 from fontgoggles.mac.aligningScrollView import AligningScrollView
 from fontgoggles.mac.featureTagGroup import FeatureTagGroup
 from fontgoggles.mac.fileObserver import getFileObserver
@@ -25,6 +25,7 @@ from fontgoggles.mac.sliderGroup import SliderGroup, SliderPlus
 from fontgoggles.compile.compilerPool import CompilerError
 from fontgoggles.misc.decorators import asyncTaskAutoCancel, suppressAndLogException
 from fontgoggles.misc.textInfo import TextInfo
+from fontgoggles.project import sortByPriority
 from fontgoggles.misc import opentypeTags
 
 
@@ -71,6 +72,7 @@ class FGMainWindowController(AppKit.NSWindowController, metaclass=ClassNameIncre
         self.observedPaths = {}
         self._callbackRecursionLock = 0
         self._previouslySingleSelectedItem = None
+        self._recentlyEditedFontItems = set()
 
         characterListGroup = self.setupCharacterListGroup()
         glyphListGroup = self.setupGlyphListGroup()
@@ -122,6 +124,10 @@ class FGMainWindowController(AppKit.NSWindowController, metaclass=ClassNameIncre
         self.textEntry.set(self.project.textSettings.text)
         self.textEntryChangedCallback(self.textEntry)
         self.w.bind("close", self._windowCloseCallback)
+        clipView = self._fontListScrollView._nsObject.contentView()
+        clipView.setPostsBoundsChangedNotifications_(True)
+        AppKit.NSNotificationCenter.defaultCenter().addObserver_selector_name_object_(
+            self, "fontListBoundsChanged:", AppKit.NSViewBoundsDidChangeNotification, clipView)
         self.updateFileObservers()
         self.loadFonts(shouldRestoreSettings=True)
 
@@ -130,6 +136,9 @@ class FGMainWindowController(AppKit.NSWindowController, metaclass=ClassNameIncre
         obs = getFileObserver()
         for path in self.observedPaths:
             obs.removeObserver(path, self._fileChanged)
+        AppKit.NSNotificationCenter.defaultCenter().removeObserver_(self)
+        for fontItemInfo in self.project.fonts:
+            fontItemInfo.unload()  # gives fonts a chance to write their caches
         self.__dict__.clear()
 
     def windowTitleForDocumentDisplayName_(self, displayName):
@@ -434,6 +443,7 @@ class FGMainWindowController(AppKit.NSWindowController, metaclass=ClassNameIncre
             else:
                 externalFile = oldPath
             if wasModified:
+                self._recentlyEditedFontItems.add(fontItemInfo.identifier)
                 font = fontItemInfo.font
                 if font is not None:
                     if font.canReloadWithChange(externalFile):
@@ -476,11 +486,15 @@ class FGMainWindowController(AppKit.NSWindowController, metaclass=ClassNameIncre
         if not hasattr(self, "fontList"):
             # Window closed before we got to run
             return ()
+        # Start with the fonts the user is looking at
+        self.updateFontPriorities()
         coros = []
-        for fontItemInfo, fontItem in self.iterFontItemInfoAndItems():
+        for fontItemInfo in sortByPriority(self.project.fonts):
             if fontItemInfo.font is None or fontItemInfo.wantsReload:
+                fontItem = self.fontList.getFontItem(fontItemInfo.identifier)
                 coros.append(self._loadFont(fontItemInfo, fontItem))
         await asyncio.gather(*coros)
+        self._recentlyEditedFontItems.clear()
         self._updateSidebarItems(*self._gatherSidebarInfo(self.project.fonts))
         if shouldRestoreSettings:
             self._updateSidebarSettings()
@@ -488,6 +502,19 @@ class FGMainWindowController(AppKit.NSWindowController, metaclass=ClassNameIncre
             self.setLanguagesFromScript()  # update the available languages
         self.fontListSelectionChangedCallback(self.fontList)
 
+    @objc.python_method
+    def updateFontPriorities(self):
+        # Fonts that are waiting to be loaded or compiled will be re-prioritized
+        self.project.setFontPriorities(visible=self.fontList.getVisibleFontItemIdentifiers(),
+                                       selected=self.fontList.selection,
+                                       recentlyEdited=self._recentlyEditedFontItems)
+
+    @suppressAndLogException
+    def fontListBoundsChanged_(self, notification):
+        # The font list got scrolled or resized
+        if hasattr(self, "fontList"):
+            self.updateFontPriorities()
+
     @objc.python_method
     async def _loadFont(self, fontItemInfo, fontItem):
         fontItem.setIsLoading(True)
@@ -749,6 +776,7 @@ class FGMainWindowController(AppKit.NSWindowController, metaclass=ClassNameIncre
             self.compileOutput.set("")
         self._previouslySingleSelectedItem = fontItem
         self.updateGlyphList(glyphs, delay=0.05)
+        self.updateFontPriorities()
 
     @objc.python_method
     def fontListGlyphSelectionChangedCallback(self, sender):
@@ -941,8 +969,25 @@ class FGMainWindowController(AppKit.NSWindowController, metaclass=ClassNameIncre
 
     @objc.python_method
     def varLocationChanged(self, sender):
+        previousVarLocation = self.project.textSettings.varLocation
         self.project.textSettings.varLocation = {k: v for k, v in sender.get().items() if v is not None}
         self.textEntryChangedCallback(self.textEntry, updateCharacterList=False)
+        self.prefetchVarLocations(previousVarLocation, self.project.textSettings.varLocation)
+
+    @asyncTaskAutoCancel
+    async def prefetchVarLocations(self, previousVarLocation, varLocation):
+        # While a slider is being dragged, compute the outlines for where it
+        # seems to be going, so the next update can come from the cache. The
+        # next slider change cancels us.
+        if not hasattr(self, "fontList"):
+            return
+        for fontItemInfo, fontItem in list(self.iterFontItemInfoAndItems()):
+            font = fontItemInfo.font
+            if font is None or fontItem.glyphs is None or not font.axes:
+                continue
+            varLocations = predictVarLocations(previousVarLocation, varLocation, font.axes)
+            await font.prefetchVarLocations(fontItem.glyphs.glyphNames, varLocations,
+                                            colorLayers=self.project.textSettings.enableColor)
 
     @objc.python_method
     def relativeSizeChangedCallback(self, sender):
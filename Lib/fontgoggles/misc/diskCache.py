@@ -0,0 +1,59 @@
+""" Location and helpers for the optional on-disk caches."""
+
+import hashlib
+import os
+import pathlib
+import tempfile
+
+
+# On-disk caching is disabled unless a cache folder is set, either through
+# setCacheFolder(), or through the FONTGOGGLES_CACHE_FOLDER environment
+# variable.
+_cacheFolder = os.environ.get("FONTGOGGLES_CACHE_FOLDER") or None
+
+
+def setCacheFolder(folder):
+    """Enable the on-disk caches by setting a root folder for them, or
+    disable them by passing None.
+    """
+    global _cacheFolder
+    _cacheFolder = None if folder is None else os.fspath(folder)
+
+
+def getCacheFolder(subFolderName):
+    """Return the cache folder named `subFolderName` as a Path, creating
+    it if needed, or None if on-disk caching is disabled.
+    """
+    if _cacheFolder is None:
+        return None
+    folder = pathlib.Path(_cacheFolder) / subFolderName
+    try:
+        folder.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return folder
+
+
+def getCacheKey(*parts):
+    """Return a hex digest usable as a cache file name, for the string
+    representation of `parts`.
+    """
+    return hashlib.sha1("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def writeFileAtomically(path, data):
+    """Write `data` to `path` so concurrent readers never see a partially
+    written file.
+    """
+    path = pathlib.Path(path)
+    fd, tempPath = tempfile.mkstemp(prefix=".fontgoggles_temp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tempPath, path)
+    except BaseException:
+        try:
+            os.remove(tempPath)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,227 @@
+""" Read outlines and metrics from .glif data straight into arrays."""
+
+import re
+from types import SimpleNamespace
+import numpy
+from fontTools.misc import etree, plistlib
+from fontTools.ufoLib.glifLib import readGlyphFromString
+
+
+# From FreeType:
+FT_CURVE_TAG_ON = 1
+FT_CURVE_TAG_CONIC = 0
+FT_CURVE_TAG_CUBIC = 2
+
+coordinateType = numpy.float64
+identityTransformation = (1, 0, 0, 1, 0, 0)
+
+
+class GLIFOutline:
+
+    """Outline and metrics of a single glyph. The points, tags and contours
+    are numpy arrays in the format FreeType uses for its outlines, so they
+    can be used directly with makePathFromArrays(), or for interpolation.
+
+    Components are not decomposed: they are listed in `components` as
+    (baseGlyphName, transformation) tuples. Use decomposeComponents() to
+    get the flattened arrays.
+    """
+
+    def __init__(self, points, tags, contours, components, width=0, height=None, lib=None):
+        self.points = points
+        self.tags = tags
+        self.contours = contours
+        self.components = components
+        self.width = width
+        self.height = height
+        self.lib = {} if lib is None else lib
+
+
+def parseGLIFOutline(data):
+    """Parse the .glif `data` (bytes) and return a GLIFOutline object.
+
+    This uses a regex-based fast path for plain format 2 .glif data, and
+    falls back to the full glifLib parser for anything else, for example
+    when the data contains comments or entity references.
+    """
+    if b"<!--" not in data and b"<![CDATA[" not in data and _glifFormat2Pattern.search(data):
+        outline = _parseGLIFOutlineFast(data)
+        if outline is not None:
+            return outline
+    return _parseGLIFOutlineFull(data)
+
+
+def decomposeComponents(outline, getOutline):
+    """Return a (points, tags, contours) tuple of arrays for `outline`, with
+    all components recursively decomposed. `getOutline` should be a callable
+    taking a glyph name, returning a GLIFOutline-like object, or None if the
+    glyph does not exist, in which case the component will be skipped.
+    """
+    if not outline.components:
+        return outline.points, outline.tags, outline.contours
+    allPoints = [outline.points]
+    allTags = [outline.tags]
+    allContours = [outline.contours]
+    numPoints = len(outline.tags)
+    for baseGlyphName, transformation in outline.components:
+        baseOutline = getOutline(baseGlyphName)
+        if baseOutline is None:
+            continue
+        points, tags, contours = decomposeComponents(baseOutline, getOutline)
+        if not len(tags):
+            continue
+        twoByTwo = tuple(transformation[:4])
+        if twoByTwo != identityTransformation[:4]:
+            points = points @ [twoByTwo[:2], twoByTwo[2:]]  # matrix multiply
+        allPoints.append(points + transformation[4:])
+        allTags.append(tags)
+        allContours.append((contours + numPoints).astype(numpy.short))
+        numPoints += len(tags)
+    return numpy.concatenate(allPoints), numpy.concatenate(allTags), numpy.concatenate(allContours)
+
+
+_glifFormat2Pattern = re.compile(rb'<\s*glyph\s[^>]*format\s*=\s*["\']2["\']')
+_glifLibPattern = re.compile(rb'<\s*lib\s*>(.*?)<\s*/\s*lib\s*>', re.DOTALL)
+_glifOutlineElementPattern = re.compile(rb'<\s*(/?)\s*(contour|point|component|advance)\b([^>]*)>')
+_glifAttributePattern = re.compile(rb'([\w.:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+
+def _parseGLIFOutlineFast(data):
+    lib = None
+    m = _glifLibPattern.search(data)
+    if m is not None:
+        lib = plistlib.fromtree(etree.fromstring(m.group(1).strip()))
+        data = data[:m.start()] + data[m.end():]
+    if b"&" in data:
+        # Entity references need proper XML parsing
+        return None
+
+    width = 0
+    height = None
+    pen = _OutlineCollector()
+    inContour = False
+    for closing, tag, rawAttributes in _glifOutlineElementPattern.findall(data):
+        if tag == b"point":
+            if not inContour:
+                return None
+            attrs = _parseAttributes(rawAttributes)
+            segmentType = attrs.get("type")
+            if segmentType == "offcurve":
+                segmentType = None
+            pen.addPoint((float(attrs["x"]), float(attrs["y"])), segmentType)
+        elif tag == b"contour":
+            if closing:
+                pen.endPath()
+                inContour = False
+            else:
+                pen.beginPath()
+                inContour = True
+                if rawAttributes.rstrip().endswith(b"/"):
+                    pen.endPath()
+                    inContour = False
+        elif tag == b"component":
+            attrs = _parseAttributes(rawAttributes)
+            transformation = tuple(_number(attrs.get(attrName), default)
+                                   for attrName, default in _transformationAttributes)
+            pen.addComponent(attrs["base"], transformation)
+        elif tag == b"advance":
+            attrs = _parseAttributes(rawAttributes)
+            width = _number(attrs.get("width"), 0)
+            height = _number(attrs.get("height"), 0)
+    if inContour:
+        return None
+    return pen.getOutline(width, height, lib)
+
+
+def _parseGLIFOutlineFull(data):
+    glyph = SimpleNamespace(width=0, height=None, lib=None)
+    pen = _OutlineCollector()
+    readGlyphFromString(data, glyph, pen, validate=False)
+    return pen.getOutline(glyph.width, glyph.height, glyph.lib)
+
+
+_transformationAttributes = [
+    ("xScale", 1),
+    ("xyScale", 0),
+    ("yxScale", 0),
+    ("yScale", 1),
+    ("xOffset", 0),
+    ("yOffset", 0),
+]
+
+
+def _parseAttributes(rawAttributes):
+    return {name.decode("utf-8"): (doubleQuoted or singleQuoted).decode("utf-8")
+            for name, doubleQuoted, singleQuoted in _glifAttributePattern.findall(rawAttributes)}
+
+
+def _number(s, default):
+    if s is None:
+        return default
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+
+class _OutlineCollector:
+
+    # A point pen that collects the outline in the same point order and with
+    # the same tags as dsFont.PointCollector would get through the segment
+    # pen protocol: closed contours start at their first on-curve point.
+
+    def __init__(self):
+        self.points = []
+        self.tags = []
+        self.contours = []
+        self.components = []
+        self._currentContour = None
+
+    def beginPath(self, identifier=None, **kwargs):
+        self._currentContour = []
+
+    def addPoint(self, pt, segmentType=None, smooth=False, name=None, identifier=None, **kwargs):
+        self._currentContour.append((pt, segmentType))
+
+    def endPath(self):
+        contour = self._currentContour
+        self._currentContour = None
+        if not contour:
+            return
+        if contour[0][1] == "move":
+            # Open contour: trailing off-curve points don't belong to a segment
+            while contour[-1][1] is None:
+                contour.pop()
+            segmentType = None
+        else:
+            for i, (pt, segmentType) in enumerate(contour):
+                if segmentType is not None:
+                    contour = contour[i:] + contour[:i]
+                    break
+            # segmentType is now the type of the first on-curve point, or
+            # None if there are none. Trailing off-curve points belong to it.
+        tags = []
+        for pt, pointType in reversed(contour):
+            if pointType is None:
+                tags.append(FT_CURVE_TAG_CUBIC if segmentType == "curve" else FT_CURVE_TAG_CONIC)
+            else:
+                tags.append(FT_CURVE_TAG_ON)
+                segmentType = pointType
+        tags.reverse()
+        points = [pt for pt, pointType in contour]
+        if contour[0][1] == "move" and len(points) > 1 and points[0] == points[-1]:
+            # Drop duplicate end point of open contour
+            points.pop()
+            tags.pop()
+        self.points.extend(points)
+        self.tags.extend(tags)
+        self.contours.append(len(self.points) - 1)
+
+    def addComponent(self, baseGlyphName, transformation, identifier=None, **kwargs):
+        self.components.append((baseGlyphName, tuple(transformation)))
+
+    def getOutline(self, width, height, lib):
+        points = numpy.array(self.points, coordinateType).reshape(-1, 2)
+        tags = numpy.array(self.tags, numpy.byte)
+        contours = numpy.array(self.contours, numpy.short)
+        return GLIFOutline(points, tags, contours, self.components, width, height, lib)
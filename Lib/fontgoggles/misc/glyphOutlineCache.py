@@ -0,0 +1,132 @@
+""" Optional on-disk cache for parsed .glif outlines, so reopening a large UFO
+doesn't mean parsing every displayed .glif file again.
+"""
+
+import atexit
+import logging
+import os
+import pickle
+import numpy
+from .diskCache import getCacheFolder, getCacheKey, writeFileAtomically
+from .glifParser import GLIFOutline, coordinateType, parseGLIFOutline
+
+
+CACHE_FORMAT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+# Caches with unsaved entries, so we can save them at exit
+_dirtyCaches = set()
+
+# One cache per file, shared by the fonts using the same UFO layer, so they
+# don't overwrite each other's entries
+_glyphOutlineCaches = {}  # cachePath: GlyphOutlineCache
+
+
+def getGlyphOutlineCache(ufoPath, layerName=None):
+    """Return the GlyphOutlineCache for the given UFO layer, or None if on-disk
+    caching is disabled.
+    """
+    cacheFolder = getCacheFolder("glyphOutlines")
+    if cacheFolder is None:
+        return None
+    cachePath = cacheFolder / (getCacheKey(os.fspath(ufoPath), layerName) + ".fgglyphs")
+    cache = _glyphOutlineCaches.get(cachePath)
+    if cache is None:
+        cache = _glyphOutlineCaches[cachePath] = GlyphOutlineCache(cachePath, ufoPath, layerName)
+    return cache
+
+
+def saveGlyphOutlineCaches():
+    for cache in list(_dirtyCaches):
+        cache.save()
+
+
+atexit.register(saveGlyphOutlineCaches)
+
+
+class GlyphOutlineCache:
+
+    """Cache of GLIFOutline objects for a single UFO layer, stored in one file.
+
+    Entries are validated with a "stamp", which is the (mtime, size) of the
+    .glif file, as collected by getGlyphModTimes(). The file is read lazily
+    upon first access, and only written by save() if entries were added.
+    """
+
+    def __init__(self, cachePath, ufoPath, layerName=None):
+        self.cachePath = cachePath
+        self.ufoPath = os.fspath(ufoPath)
+        self.layerName = layerName
+        self._entries = None
+        self._dirty = False
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self):
+        try:
+            with open(self.cachePath, "rb") as f:
+                version, ufoPath, layerName, entries = pickle.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning("Can't read glyph outline cache '%s': %r", self.cachePath, e)
+            return {}
+        if (version, ufoPath, layerName) != (CACHE_FORMAT_VERSION, self.ufoPath, self.layerName):
+            return {}
+        return entries
+
+    def getOutline(self, glyphName, stamp, getGLIF):
+        """Return the GLIFOutline for `glyphName`. If the cache contains an
+        entry with a matching `stamp`, that will be used, else the .glif data
+        will be read with `getGLIF(glyphName)` and parsed. If `stamp` is None,
+        the cache is bypassed.
+        """
+        if stamp is None:
+            return parseGLIFOutline(getGLIF(glyphName))
+        entry = self.entries.get(glyphName)
+        if entry is not None and entry[0] == stamp:
+            return _unpackOutline(entry)
+        outline = parseGLIFOutline(getGLIF(glyphName))
+        self.entries[glyphName] = _packOutline(stamp, outline)
+        self._dirty = True
+        _dirtyCaches.add(self)
+        return outline
+
+    def save(self, glyphNames=None):
+        """Write the cache if entries were added. If `glyphNames` is given,
+        drop the entries of glyphs that are not in it: these were deleted
+        or renamed.
+        """
+        if glyphNames is not None and self._entries is not None:
+            glyphNames = set(glyphNames)
+            for glyphName in [glyphName for glyphName in self._entries if glyphName not in glyphNames]:
+                del self._entries[glyphName]
+                self._dirty = True
+        if not self._dirty:
+            return
+        data = pickle.dumps((CACHE_FORMAT_VERSION, self.ufoPath, self.layerName, self._entries),
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            writeFileAtomically(self.cachePath, data)
+        except OSError as e:
+            logger.warning("Can't write glyph outline cache '%s': %r", self.cachePath, e)
+        self._dirty = False
+        _dirtyCaches.discard(self)
+
+
+def _packOutline(stamp, outline):
+    return (stamp, outline.points.tobytes(), outline.tags.tobytes(), outline.contours.tobytes(),
+            outline.components, outline.width, outline.height, outline.lib)
+
+
+def _unpackOutline(entry):
+    stamp, points, tags, contours, components, width, height, lib = entry
+    return GLIFOutline(numpy.frombuffer(points, coordinateType).reshape(-1, 2),
+                       numpy.frombuffer(tags, numpy.byte),
+                       numpy.frombuffer(contours, numpy.short),
+                       components, width, height, lib)
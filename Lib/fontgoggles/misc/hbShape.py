@@ -2,8 +2,10 @@ from collections import defaultdict
 import functools
 import io
 import itertools
+import unicodedata2 as unicodedata
 from fontTools.ttLib import TTFont
 import uharfbuzz as hb
+from .properties import cachedProperty
 
 
 class GlyphInfo:
@@ -60,6 +62,15 @@ def _getVerticalOriginFunc(font, glyphID, shaper):
     return shaper.getVerticalOrigin(glyphName)
 
 
+# When repositioning an already substituted glyph sequence, we shape a
+# string of private use characters, that map one-to-one to the glyphs.
+_repositionCodePointBase = 0xF0000
+
+
+def _getRepositionGlyphIDFunc(font, char, glyphIDs):
+    return glyphIDs[char - _repositionCodePointBase]
+
+
 _stylisticSets = {f"ss{i:02}" for i in range(1, 21)}
 
 
@@ -112,6 +123,15 @@ class HBShape:
         else:
             self._funcs = None
 
+    def setCharacterMap(self, cmap):
+        """Use `cmap`, a {codePoint: glyphName} dict, instead of the font's
+        own cmap. This leaves the font data alone, so it's a cheap way to
+        update the character mapping, for example after the unicodes of a
+        source changed. It requires the callbacks to be set up.
+        """
+        assert self._funcs is not None
+        self.getGlyphNameFromCodePoint = cmap.get
+
     def getFeatures(self, otTableTag):
         features = set()
         for scriptIndex, script in enumerate(hb.ot_layout_table_get_script_tags(self.face, otTableTag)):
@@ -153,10 +173,128 @@ class HBShape:
         except KeyError:
             return default
 
+    @cachedProperty
+    def hasVariableSubstitutions(self):
+        """True if the glyph substitutions can depend on the variation
+        location, which is the case if GSUB has FeatureVariations.
+        """
+        if "fvar" not in self._ttFont or "GSUB" not in self._ttFont:
+            return False
+        return getattr(self._ttFont["GSUB"].table, "FeatureVariations", None) is not None
+
+    @cachedProperty
+    def _gsubFeatureTags(self):
+        return self.getFeatures("GSUB")
+
+    @cachedProperty
+    def _canRepositionGlyphs(self):
+        # To position glyphs without substituting them again, we need to be
+        # able to switch off all GSUB features, which is not possible for
+        # required features.
+        if "GSUB" in self._ttFont:
+            gsub = self._ttFont["GSUB"].table
+            for scriptRecord in gsub.ScriptList.ScriptRecord if gsub.ScriptList else []:
+                langSystems = [langSysRecord.LangSys for langSysRecord in scriptRecord.Script.LangSysRecord]
+                if scriptRecord.Script.DefaultLangSys is not None:
+                    langSystems.append(scriptRecord.Script.DefaultLangSys)
+                if any(langSys.ReqFeatureIndex != 0xFFFF for langSys in langSystems):
+                    return False
+        return True
+
+    @cachedProperty
+    def _hasGlyphClasses(self):
+        gdef = self._ttFont.get("GDEF")
+        return gdef is not None and gdef.table.GlyphClassDef is not None
+
     def shape(self, text, *, features=None, varLocation=None,
               direction=None, language=None, script=None):
-        if features is None:
-            features = {}
+        buf = self._shape(text, features=features, varLocation=varLocation,
+                          direction=direction, language=language, script=script)
+        return self._getGlyphInfos(buf)
+
+    def shapeMultiple(self, text, varLocations, *, features=None,
+                      direction=None, language=None, script=None):
+        """Shape `text` for each of `varLocations`, yielding a list of
+        GlyphInfo objects per location.
+
+        If the glyph substitutions can't vary with the location, the text is
+        only fully shaped for the first location. For the other locations,
+        the resulting glyph sequence is reused, and only the positions are
+        recomputed.
+
+        This is a generator, and the shaping for a location only happens when
+        the generator is advanced, so the caller can prepare its advance
+        callbacks for each location in between.
+        """
+        firstSequence = None
+        for varLocation in varLocations:
+            infos = None
+            if firstSequence is not None:
+                infos = self._reposition(firstSequence, features=features, varLocation=varLocation,
+                                         direction=direction, language=language, script=script)
+            if infos is None:
+                buf = self._shape(text, features=features, varLocation=varLocation,
+                                  direction=direction, language=language, script=script)
+                infos = self._getGlyphInfos(buf)
+                if firstSequence is None and self._canReuseGlyphSequence(text):
+                    firstSequence = _ShapedGlyphSequence(infos, buf.direction, buf.script, buf.language)
+            yield infos
+
+    def _canReuseGlyphSequence(self, text):
+        if self.hasVariableSubstitutions or not self._canRepositionGlyphs:
+            return False
+        for char in text:
+            category = unicodedata.category(char)
+            if category == "Cf" or 0xFE00 <= ord(char) <= 0xFE0F or 0xE0100 <= ord(char) <= 0xE01EF:
+                # HarfBuzz hides default ignorables and consumes variation
+                # selectors based on the characters, not the glyphs
+                return False
+            if category == "Zs" and char not in " \u00A0":
+                # HarfBuzz may synthesize the advance of missing space characters
+                return False
+            if category[0] == "M" and not self._hasGlyphClasses:
+                # Without GDEF glyph classes, HarfBuzz uses the character
+                # properties to find marks
+                return False
+        return True
+
+    def _reposition(self, sequence, *, features, varLocation, direction, language, script):
+        # Position the glyphs of an earlier shaping result at a different
+        # location, with all glyph substitutions switched off. Returns None
+        # if the result does not contain the same glyphs, in which case the
+        # caller needs to shape the text from scratch.
+        infos = sequence.infos
+        logicalInfos = infos[::-1] if sequence.direction in ("rtl", "btt") else infos
+        glyphIDs = [gi.gid for gi in logicalInfos]
+
+        self._setupFont(varLocation)
+        font = hb.Font(self.font)  # sub font, delegates all but the cmap to self.font
+        funcs = hb.FontFuncs.create()
+        funcs.set_nominal_glyph_func(_getRepositionGlyphIDFunc, glyphIDs)
+        font.funcs = funcs
+
+        buf = hb.Buffer.create()
+        buf.add_codepoints([_repositionCodePointBase + i for i in range(len(glyphIDs))])
+        buf.cluster_level = hb.BufferClusterLevel.MONOTONE_CHARACTERS
+        buf.direction = sequence.direction
+        buf.script = sequence.script
+        if sequence.language is not None:
+            buf.language = sequence.language
+
+        features = dict(features) if features else {}
+        for tag in self._gsubFeatureTags:
+            features[tag] = False
+        hb.shape(font, buf, features)
+
+        if [info.codepoint for info in buf.glyph_infos] != [gi.gid for gi in infos]:
+            return None
+        newInfos = []
+        for info, pos in zip(buf.glyph_infos, buf.glyph_positions):
+            gi = logicalInfos[info.cluster]
+            newInfos.append(GlyphInfo(gi.gid, gi.name, gi.cluster, *pos.position))
+        return newInfos
+
+    def _setupFont(self, varLocation):
         if varLocation is None:
             varLocation = {}
 
@@ -168,6 +306,13 @@ class HBShape:
         if self._funcs is not None:
             self.font.funcs = self._funcs
 
+    def _shape(self, text, *, features=None, varLocation=None,
+               direction=None, language=None, script=None):
+        if features is None:
+            features = {}
+
+        self._setupFont(varLocation)
+
         buf = hb.Buffer.create()
         buf.add_str(str(text))  # add_str() does not accept str subclasses
         buf.guess_segment_properties()
@@ -182,15 +327,25 @@ class HBShape:
             buf.set_script_from_ot_tag(script)
 
         hb.shape(self.font, buf, features)
+        return buf
 
+    def _getGlyphInfos(self, buf):
         glyphOrder = self.glyphOrder
         infos = []
         for info, pos in zip(buf.glyph_infos, buf.glyph_positions):
             infos.append(GlyphInfo(info.codepoint, glyphOrder[info.codepoint], info.cluster, *pos.position))
-
         return infos
 
 
+class _ShapedGlyphSequence:
+
+    def __init__(self, infos, direction, script, language):
+        self.infos = infos
+        self.direction = direction
+        self.script = script
+        self.language = language
+
+
 def characterGlyphMapping(clusters, numChars):
     """This implements character to glyph mapping and vice versa, using
     cluster information from HarfBuzz. It should be correct for HB
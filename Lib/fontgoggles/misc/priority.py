@@ -0,0 +1,70 @@
+""" Priorities for loading fonts and compiling their sources, so the fonts
+the user is looking at don't wait for the others.
+
+A Priority object is shared by all jobs done for one font item, and can be
+changed while these jobs are waiting for a compile worker. The jobs find it
+through a context variable: see priorityContext() and getCurrentPriority().
+"""
+
+import contextlib
+import contextvars
+
+
+# Lower values go first
+VISIBLE = 0
+SELECTED = 1
+RECENTLY_EDITED = 2
+BACKGROUND = 3
+
+
+class Priority:
+
+    """A mutable priority value."""
+
+    def __init__(self, value=BACKGROUND):
+        self.value = value
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.value})"
+
+
+class CombinedPriority:
+
+    """The most urgent of a changing collection of priorities, for a job
+    that is done on behalf of several callers.
+    """
+
+    def __init__(self):
+        self.priorities = []
+
+    @property
+    def value(self):
+        return min((priority.value for priority in self.priorities), default=BACKGROUND)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.value})"
+
+
+_currentPriority = contextvars.ContextVar("fontgoggles_priority", default=None)
+
+
+def getCurrentPriority():
+    """Return the priority set with priorityContext(), or a background
+    priority if there is none.
+    """
+    priority = _currentPriority.get()
+    if priority is None:
+        priority = Priority()
+    return priority
+
+
+@contextlib.contextmanager
+def priorityContext(priority):
+    """Do the jobs started in this context, including those in tasks created
+    from it, with `priority`.
+    """
+    token = _currentPriority.set(priority)
+    try:
+        yield
+    finally:
+        _currentPriority.reset(token)
@@ -7,6 +7,7 @@ import pathlib
 import sys
 import typing
 from .font import getOpener
+from .misc.priority import BACKGROUND, RECENTLY_EDITED, SELECTED, VISIBLE, Priority, priorityContext
 
 
 class Project:
@@ -73,11 +74,44 @@ class Project:
         return FontItemInfo(fontItemIdentifier, fontKey, self._fontLoader)
 
     async def loadFonts(self, outputWriter=None):
-        """Load fonts as concurrently as possible."""
+        """Load fonts as concurrently as possible, starting with the most
+        urgent ones, see setFontPriorities().
+        """
         if outputWriter is None:
             outputWriter = sys.stderr.write
+        fontItemInfos = [fontItemInfo for fontItemInfo in self.fonts if fontItemInfo.font is None]
         await asyncio.gather(*(fontItemInfo.load(outputWriter)
-                               for fontItemInfo in self.fonts if fontItemInfo.font is None))
+                               for fontItemInfo in sortByPriority(fontItemInfos)))
+
+    def setFontPriority(self, fontItemIdentifier, priority):
+        """Set the priority value (see misc/priority.py) for loading and
+        compiling the font of a font item. This also affects its jobs that
+        are already waiting.
+        """
+        self.getFontItemInfo(fontItemIdentifier).priority.value = priority
+
+    def setFontPriorities(self, visible=(), selected=(), recentlyEdited=()):
+        """Set the priorities of all font items, given collections of font
+        item identifiers. A font item gets the most urgent priority that
+        applies, the others get a background priority.
+        """
+        for fontItemInfo in self.fonts:
+            identifier = fontItemInfo.identifier
+            if identifier in visible:
+                priority = VISIBLE
+            elif identifier in selected:
+                priority = SELECTED
+            elif identifier in recentlyEdited:
+                priority = RECENTLY_EDITED
+            else:
+                priority = BACKGROUND
+            fontItemInfo.priority.value = priority
+
+    def getFontItemInfo(self, fontItemIdentifier):
+        for fontItemInfo in self.fonts:
+            if fontItemInfo.identifier == fontItemIdentifier:
+                return fontItemInfo
+        raise KeyError(fontItemIdentifier)
 
     def _nextFontItemIdentifier(self):
         return next(self._fontItemIdentifierGenerator)
@@ -102,6 +136,7 @@ class FontItemInfo:
     def __init__(self, identifier, fontKey, fontLoader):
         self.identifier = identifier
         self.fontKey = fontKey
+        self.priority = Priority()
         self._fontLoader = fontLoader
 
     @property
@@ -136,12 +171,18 @@ class FontItemInfo:
     async def load(self, outputWriter=None):
         if outputWriter is None:
             outputWriter = sys.stderr.write
-        await self._fontLoader.loadFont(self.fontKey, outputWriter)
+        with priorityContext(self.priority):
+            await self._fontLoader.loadFont(self.fontKey, outputWriter)
 
     def unload(self):
         self._fontLoader.unloadFont(self.fontKey)
 
 
+def sortByPriority(fontItemInfos):
+    """Return the font item infos, most urgent first."""
+    return sorted(fontItemInfos, key=lambda fontItemInfo: fontItemInfo.priority.value)
+
+
 class FontLoader:
 
     def __init__(self):
@@ -173,10 +214,15 @@ class FontLoader:
             self.fonts[fontKey] = font
 
     def unloadFont(self, fontKey):
-        self.fonts.pop(fontKey, None)  # discard
+        font = self.fonts.pop(fontKey, None)  # discard
+        if font is not None:
+            font.close()
         self.cachedFontData = {}
 
     def purgeFonts(self, usedKeys):
+        for fontKey, fontObject in self.fonts.items():
+            if fontKey not in usedKeys:
+                fontObject.close()
         self.fonts = {fontKey: fontObject for fontKey, fontObject in self.fonts.items()
                       if fontKey in usedKeys}
         self.cachedFontData = {}
@@ -0,0 +1,97 @@
+import os
+import pathlib
+import shutil
+import pytest
+from fontTools.ufoLib import UFOReader
+from fontgoggles.compile import compileCache, compilerPool
+from fontgoggles.compile.compileCache import CompileCache, getCompileCache, getUFOCacheKey
+from fontgoggles.compile.compilerPool import CompilerPool, compileUFOToBytes
+from fontgoggles.compile.ufoCompiler import fetchCharacterMappingAndAnchors
+from fontgoggles.misc import diskCache
+from testSupport import getFontPath
+
+
+@pytest.fixture
+def cacheFolder(tmpdir, monkeypatch):
+    monkeypatch.setattr(diskCache, "_cacheFolder", str(tmpdir / "cache"))
+    return tmpdir / "cache"
+
+
+def test_getCompileCache_disabled(monkeypatch):
+    monkeypatch.setattr(diskCache, "_cacheFolder", None)
+    assert getCompileCache() is None
+
+
+@pytest.mark.asyncio
+async def test_compileUFOToBytes_cached(cacheFolder, monkeypatch):
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    output = []
+    fontData = await compileUFOToBytes(ufoPath, output.append)
+    assert fontData
+
+    async def callFunction(self, func, args, outputWriter, affinityKey=None):
+        raise AssertionError("the compile cache should have been used")
+
+    monkeypatch.setattr(CompilerPool, "callFunction", callFunction)
+    cachedOutput = []
+    assert await compileUFOToBytes(ufoPath, cachedOutput.append) == fontData
+    assert "".join(cachedOutput) == "".join(output)
+
+
+@pytest.mark.asyncio
+async def test_compileUFOToBytes_cacheDisabled(monkeypatch):
+    monkeypatch.setattr(diskCache, "_cacheFolder", None)
+
+    keyCalls = []
+
+    def getUFOCacheKey(*args):
+        keyCalls.append(args)
+        return compileCache.getUFOCacheKey(*args)
+
+    monkeypatch.setattr(compilerPool, "getUFOCacheKey", getUFOCacheKey)
+    assert await compileUFOToBytes(getFontPath("MutatorSansBoldWideMutated.ufo"), [].append)
+    # Without unicodes and anchors, the key would take scanning the .glif files
+    assert keyCalls == []
+
+
+def test_getUFOCacheKey(tmpdir):
+    ufoSource = getFontPath("MutatorSansBoldWideMutated.ufo")
+    ufoPath = pathlib.Path(shutil.copytree(ufoSource, tmpdir / "test.ufo"))
+    cacheKey = getUFOCacheKey(ufoPath)
+    assert cacheKey != getUFOCacheKey(ufoSource)  # the included feature files are missing
+    for feaFileName in ["features_test.fea", "features_test_nested.fea"]:
+        shutil.copy(ufoSource.parent / feaFileName, tmpdir)
+    cacheKey = getUFOCacheKey(ufoPath)
+    assert cacheKey == getUFOCacheKey(ufoSource)  # the key depends on the contents only
+
+    os.utime(ufoPath / "glyphs" / "B_.glif", (0, 0))
+    assert cacheKey == getUFOCacheKey(ufoPath)
+
+    kerningPath = ufoPath / "kerning.plist"
+    kerningPath.write_text(kerningPath.read_text("utf-8").replace("<integer>", "<integer>1"), "utf-8")
+    assert cacheKey != getUFOCacheKey(ufoPath)
+
+
+def test_compileCache_evict(tmpdir, monkeypatch):
+    cache = CompileCache(pathlib.Path(tmpdir), 3500)
+    for i, cacheKey in enumerate(["a", "b", "c"]):
+        cache.put(cacheKey, bytes(1000), "")
+        os.utime(cache._getPath(cacheKey), (i, i))
+    assert cache.get("a") is not None  # this marks "a" as recently used
+    cache.put("d", bytes(1000), "")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.get("d") == (bytes(1000), "")
+
+    monkeypatch.setattr(compileCache, "_versionStamp", ("something", "else"))
+    assert cache.get("d") is None
+
+
+def test_getUFOCacheKey_unicodesAndAnchors():
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    glyphSet = UFOReader(ufoPath).getGlyphSet()
+    cmap, revCmap, anchors = fetchCharacterMappingAndAnchors(glyphSet, ufoPath)
+    assert getUFOCacheKey(ufoPath) == getUFOCacheKey(ufoPath, (revCmap, anchors))
+    anchors = dict(anchors, A=[("top", 0, 0)])
+    assert getUFOCacheKey(ufoPath) != getUFOCacheKey(ufoPath, (revCmap, anchors))
@@ -0,0 +1,391 @@
+import asyncio
+import io
+import logging
+import os
+import pytest
+from fontTools.ttLib import TTFont
+from fontgoggles.compile import compilerPool, sharedMemory
+from fontgoggles.compile.compilerPool import BrokenWorkerError, CompilerError, CompilerPool
+from fontgoggles.misc.priority import BACKGROUND, SELECTED, VISIBLE, Priority, priorityContext
+from testSupport import getFontPath
+
+
+class FakeWorker:
+
+    crashed = False
+    cancelDelay = 0
+
+    def __init__(self):
+        self.calls = []
+        self.stopped = False
+        self.process = None
+        self.isDead = False
+        self.jobCount = 0
+        self.maxResidentSize = 0
+
+    async def start(self):
+        self.process = "fake process"
+
+    async def stop(self):
+        self.stopped = True
+
+    async def callFunction(self, func, args, outputWriter, eventHandler=None):
+        self.calls.append(func)
+        self.jobCount += 1
+        if func == "crashOnce" and not FakeWorker.crashed:
+            FakeWorker.crashed = True
+            self.isDead = True
+            raise BrokenWorkerError("broken subprocess")
+        if func == "sleep":
+            output, duration = args
+            outputWriter(output)
+            try:
+                await asyncio.sleep(duration)
+            except asyncio.CancelledError:
+                # A real worker takes a while to handle the interrupt
+                await asyncio.sleep(self.cancelDelay)
+                self.calls.append("cancelled")
+                raise
+        return func + " result"
+
+
+@pytest.fixture
+def fakeWorkers(monkeypatch):
+    monkeypatch.setattr(compilerPool, "CompilerWorker", FakeWorker)
+
+
+@pytest.mark.asyncio
+async def test_compilerPool_affinity(fakeWorkers):
+    pool = CompilerPool(maxWorkers=2)
+    worker1 = await pool.getWorker("a.ufo")
+    worker2 = await pool.getWorker("b.ufo")
+    assert worker1 is not worker2
+    await pool.releaseWorker(worker2)
+    await pool.releaseWorker(worker1)
+    # The least recently used worker would be worker2
+    assert await pool.getWorker("a.ufo") is worker1
+    await pool.releaseWorker(worker1)
+    assert await pool.getWorker("b.ufo") is worker2
+    await pool.releaseWorker(worker2)
+    # A new key gets any available worker, and the job gets done
+    await pool.callFunction("some.func", [], None, affinityKey="c.ufo")
+    assert pool.affinities["c.ufo"] in (worker1, worker2)
+    assert len(pool.workers) == 2
+    assert len(pool.availableWorkers) == 2
+
+
+@pytest.mark.asyncio
+async def test_compilerPool_sharedJobs(fakeWorkers, monkeypatch):
+    monkeypatch.setattr(compilerPool, "detachedJobGracePeriod", 0.1)
+    pool = CompilerPool(maxWorkers=2)
+    outputs = [[], [], []]
+    results = []
+
+    def callFunctionShared(jobKey, output, duration=0.05):
+        return asyncio.ensure_future(pool.callFunctionShared(jobKey, "sleep", ["output\n", duration], output.append,
+                                                             resultHandler=lambda *args: results.append(args)))
+
+    tasks = [callFunctionShared("key", outputs[0]), callFunctionShared("key", outputs[1])]
+    await asyncio.sleep(0.01)
+    # Someone joining later still gets the output so far
+    tasks.append(callFunctionShared("key", outputs[2]))
+    assert await asyncio.gather(*tasks) == ["sleep result"] * 3
+    assert outputs == [["output\n"]] * 3
+    assert results == [("sleep result", "output\n")]
+    assert sum(len(worker.calls) for worker in pool.workers) == 1
+    assert pool.sharedJobs == {}
+
+    # A cancelled caller doesn't cancel the job if it gets requested again soon
+    task = callFunctionShared("key", [])
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.sleep(0.01)
+    assert await callFunctionShared("key", []) == "sleep result"
+    assert sum(len(worker.calls) for worker in pool.workers) == 2
+
+    # But it gets cancelled if nobody wants it anymore
+    task = callFunctionShared("key", [], 1)
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.sleep(0.2)
+    assert "cancelled" in [call for worker in pool.workers for call in worker.calls]
+    assert pool.sharedJobs == {}
+
+    # Someone arriving while the job is being cancelled gets a new job
+    monkeypatch.setattr(FakeWorker, "cancelDelay", 0.3)
+    task = callFunctionShared("key", [], 1)
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.sleep(0.15)
+    assert pool.sharedJobs == {}
+    assert await callFunctionShared("key", []) == "sleep result"
+
+
+@pytest.mark.asyncio
+async def test_compilerPool_recycling(fakeWorkers, monkeypatch):
+    monkeypatch.setattr(compilerPool, "maxJobsPerWorker", 2)
+    monkeypatch.setattr(FakeWorker, "crashed", False)
+    pool = CompilerPool(maxWorkers=1)
+    await pool.callFunction("some.func", [], None, affinityKey="a.ufo")
+    [worker] = pool.workers
+    await pool.callFunction("some.func", [], None, affinityKey="a.ufo")
+    await asyncio.sleep(0)
+    assert worker.stopped
+    assert pool.workers == []
+    assert pool.affinities == {}
+
+    # Workers using too much memory are recycled, too
+    monkeypatch.setattr(compilerPool, "maxJobsPerWorker", None)
+    await pool.callFunction("some.func", [], None)
+    [worker] = pool.workers
+    worker.maxResidentSize = compilerPool.maxWorkerMemory
+    assert await pool.callFunction("some.func", [], None) == "some.func result"
+    assert pool.workers == []
+
+    # A job waiting for a worker gets a fresh one
+    worker = await pool.getWorker()
+    worker.isDead = True
+    task = asyncio.ensure_future(pool.callFunction("some.func", [], None))
+    await asyncio.sleep(0.01)
+    await pool.releaseWorker(worker)
+    assert await task == "some.func result"
+    assert pool.workers[0] is not worker
+
+    # A job is tried again if its worker dies
+    assert await pool.callFunction("crashOnce", [], None) == "crashOnce result"
+    assert len(pool.workers) == 1
+    assert not pool.workers[0].isDead
+
+
+@pytest.mark.asyncio
+async def test_compilerPool_brokenWorker():
+    pool = CompilerPool(maxWorkers=1)
+    with pytest.raises(BrokenWorkerError):
+        await pool.callFunction("os._exit", [1], None)
+    assert pool.workers == []
+    assert await pool.callFunction("os.path.join", ["a", "b"], None) == os.path.join("a", "b")
+    [worker] = pool.workers
+    assert worker.jobCount == 1
+    assert worker.maxResidentSize > 0
+    await worker.stop()
+
+
+def test_getMaxWorkers(monkeypatch):
+    monkeypatch.setattr(compilerPool, "_maxWorkers", None)
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    monkeypatch.setattr(compilerPool, "_getPhysicalMemorySize", lambda: 64 * 1024 ** 3)
+    assert compilerPool.getMaxWorkers() == 7
+    monkeypatch.setattr(compilerPool, "_getPhysicalMemorySize", lambda: 4 * 1024 ** 3)
+    assert compilerPool.getMaxWorkers() == 2
+    monkeypatch.setattr(compilerPool, "_getPhysicalMemorySize", lambda: 1024 ** 3)
+    assert compilerPool.getMaxWorkers() == 1
+    compilerPool.setMaxWorkers(3)
+    assert compilerPool.getMaxWorkers() == 3
+
+
+@pytest.mark.asyncio
+async def test_compilerPool_prewarmAndReap(fakeWorkers):
+    pool = CompilerPool(maxWorkers=2, idleTimeout=0.05)
+    await pool.prewarm()
+    assert len(pool.workers) == 2
+    assert len(pool.availableWorkers) == 2
+    workers = list(pool.workers)
+    assert [worker.calls for worker in workers] == [["fontgoggles.compile.workServer.importModules"]] * 2
+    await pool.callFunction("some.func", [], None, affinityKey="a.ufo")
+    await asyncio.sleep(0.2)
+    assert pool.workers == []
+    assert pool.affinities == {}
+    assert [worker.stopped for worker in workers] == [True, True]
+    assert pool.metrics.jobCount == 1
+    assert pool.metrics.jobDurations["some.func"][0] == 1
+
+
+@pytest.mark.asyncio
+async def test_prewarmCompilerPool(fakeWorkers, monkeypatch):
+    monkeypatch.setattr(compilerPool, "_maxWorkers", 4)
+    monkeypatch.setattr(compilerPool, "_prewarmWorkers", 0)
+    await compilerPool.prewarmCompilerPool()
+    assert not hasattr(asyncio.get_running_loop(), "__FG_compiler_pool")
+    compilerPool.setPrewarmWorkers(1)
+    await compilerPool.prewarmCompilerPool()
+    assert len(compilerPool.getCompilerPool().workers) == 1
+
+
+@pytest.mark.asyncio
+async def test_compilerPool_metrics(fakeWorkers):
+    pool = CompilerPool(maxWorkers=1)
+    worker = await pool.getWorker()
+    task = asyncio.ensure_future(pool.callFunction("some.func", [], None))
+    await asyncio.sleep(0.01)
+    assert pool.metrics.queueDepth == 1
+    await pool.releaseWorker(worker)
+    await task
+    assert pool.metrics.queueDepth == 0
+    assert pool.metrics.maxQueueDepth == 1
+    assert pool.metrics.maxWaitTime > 0
+    assert pool.metrics.averageWaitTime == pool.metrics.maxWaitTime
+
+
+@pytest.mark.asyncio
+async def test_compilerWorker_messages():
+    worker = compilerPool.CompilerWorker()
+    await worker.start()
+    output = []
+    events = []
+    assert await worker.callFunction("builtins.print", ["hello", "world"], output.append) is None
+    assert "".join(output) == "hello world\n"
+    output = []
+    await worker.callFunction("logging.warning", ["be %s", "careful"], output.append, events.append)
+    assert output == ["be careful\n"]
+    assert events == [("log", logging.WARNING, "root", "be careful")]
+    events = []
+    await worker.callFunction("fontgoggles.compile.workServer.reportProgress", [(1, 3)], output.append,
+                              events.append)
+    assert events == [("progress", (1, 3))]
+    # Large results come back over the pipe
+    assert len(await worker.callFunction("os.urandom", [10_000_000], output.append)) == 10_000_000
+    output = []
+    with pytest.raises(CompilerError):
+        await worker.callFunction("os.urandom", ["not a number"], output.append)
+    assert "TypeError" in "".join(output)
+    # The worker is still fine
+    await worker.callFunction("fontgoggles.compile.workServer.importModules", [compilerPool.prewarmModules],
+                              output.append)
+    assert await worker.callFunction("os.path.join", ["a", "b"], output.append) == os.path.join("a", "b")
+    worker.process.stdin.close()
+    await worker.process.wait()
+
+
+@pytest.mark.asyncio
+async def test_compilerPool_inProcess():
+    pool = CompilerPool(maxWorkers=1)
+    output = []
+    events = []
+    assert await pool.callFunction("builtins.print", ["hello", "world"], output.append, inProcess=True) is None
+    await pool.callFunction("logging.warning", ["be %s", "careful"], output.append, eventHandler=events.append,
+                            inProcess=True)
+    assert "".join(output) == "hello world\nbe careful\n"
+    assert events == [("log", logging.WARNING, "root", "be careful")]
+    output = []
+    with pytest.raises(CompilerError):
+        await pool.callFunction("os.urandom", ["not a number"], output.append, inProcess=True)
+    assert "TypeError" in "".join(output)
+    assert pool.workers == []
+
+    # The jobs wait for the compile thread in order of priority
+    order = []
+
+    async def callFunction(name, priority):
+        with priorityContext(priority):
+            await pool.callFunction("time.sleep", [0.01], None, inProcess=True)
+        order.append(name)
+
+    busyTask = asyncio.ensure_future(pool.callFunction("time.sleep", [0.1], None, inProcess=True))
+    await asyncio.sleep(0.01)
+    priorities = {name: Priority(BACKGROUND) for name in ["a", "b", "c"]}
+    tasks = [asyncio.ensure_future(callFunction(name, priority)) for name, priority in priorities.items()]
+    await asyncio.sleep(0.01)
+    priorities["c"].value = VISIBLE
+    await asyncio.gather(busyTask, *tasks)
+    assert order == ["c", "a", "b"]
+    assert pool.inProcessWaiters == []
+    assert not pool.inProcessBusy
+
+
+@pytest.mark.asyncio
+async def test_compileUFOToBytes_inProcess(monkeypatch):
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    assert compilerPool.getUFOJobSize(ufoPath) <= compilerPool.maxInProcessJobSize
+    results = []
+    for maxInProcessJobSize in [0, compilerPool.maxInProcessJobSize]:
+        monkeypatch.setattr(compilerPool, "maxInProcessJobSize", maxInProcessJobSize)
+        output = []
+        fontData = await compilerPool.compileUFOToBytes(ufoPath, output.append)
+        font = TTFont(io.BytesIO(fontData))
+        font["head"].created = font["head"].modified = 0  # the compile time
+        del font["FGTm"]  # the compile timings
+        f = io.BytesIO()
+        font.save(f, reorderTables=False)
+        results.append((f.getvalue(), "".join(output)))
+    assert compilerPool.getCompilerPool().workers  # the first compile used a worker
+    assert results[0] == results[1]
+
+
+@pytest.mark.skipif(sharedMemory.shared_memory is None, reason="no shared memory support")
+def test_shareBytes():
+    data = os.urandom(sharedMemory.minSharedBytesSize)
+    shared = sharedMemory.shareBytes(["a", b"b", {"data": data}])
+    assert shared[:2] == ["a", b"b"]
+    sharedData = shared[2]["data"]
+    assert isinstance(sharedData, sharedMemory.SharedBytes)
+    assert list(sharedMemory.iterSharedBytes(shared)) == [sharedData]
+    assert sharedMemory.unshareBytes(shared) == ["a", b"b", {"data": data}]
+    sharedData.unlink()
+    with pytest.raises(FileNotFoundError):
+        sharedData.read()
+
+
+@pytest.mark.asyncio
+async def test_compilerWorker_sharedBytes():
+    worker = compilerPool.CompilerWorker()
+    await worker.start()
+    data = os.urandom(1_000_000)
+    # Both the argument and the result go through shared memory
+    assert await worker.callFunction("builtins.bytes", [data], None) == data
+    worker.process.stdin.close()
+    await worker.process.wait()
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="can't list the shared memory segments")
+@pytest.mark.asyncio
+async def test_compilerWorker_sharedBytesUnpicklableResult():
+    segmentsBefore = set(os.listdir("/dev/shm"))
+    worker = compilerPool.CompilerWorker()
+    await worker.start()
+    output = []
+    # The bytes go into a segment before the lock fails to pickle
+    with pytest.raises(CompilerError):
+        await worker.callFunction("builtins.eval", ["(bytes(200_000), __import__('threading').Lock())"],
+                                  output.append)
+    assert "pickle" in "".join(output)
+    worker.process.stdin.close()
+    await worker.process.wait()
+    assert set(os.listdir("/dev/shm")) - segmentsBefore == set()
+
+
+@pytest.mark.asyncio
+async def test_compilerPool_priorities(fakeWorkers):
+    pool = CompilerPool(maxWorkers=1)
+    worker = await pool.getWorker()
+    order = []
+
+    async def callFunction(name, priority):
+        with priorityContext(priority):
+            await pool.callFunction("some.func", [], None)
+        order.append(name)
+
+    priorities = {name: Priority(BACKGROUND) for name in ["a", "b", "c"]}
+    tasks = [asyncio.ensure_future(callFunction(name, priority)) for name, priority in priorities.items()]
+    await asyncio.sleep(0.01)
+    # Re-prioritize while waiting
+    priorities["c"].value = VISIBLE
+    await pool.releaseWorker(worker)
+    await asyncio.gather(*tasks)
+    assert order == ["c", "a", "b"]
+    assert pool.waiters == []
+
+    # A shared job has the most urgent priority of its callers
+    worker = await pool.getWorker()
+
+    async def callFunctionShared(priority):
+        with priorityContext(priority):
+            await pool.callFunctionShared("key", "shared.func", [], None)
+
+    tasks = [asyncio.ensure_future(callFunction("a", Priority(BACKGROUND)))]
+    tasks.append(asyncio.ensure_future(callFunctionShared(Priority(BACKGROUND))))
+    await asyncio.sleep(0.01)
+    tasks.append(asyncio.ensure_future(callFunctionShared(Priority(SELECTED))))
+    await asyncio.sleep(0.01)
+    await pool.releaseWorker(worker)
+    await asyncio.gather(*tasks)
+    assert worker.calls[-2:] == ["shared.func", "some.func"]
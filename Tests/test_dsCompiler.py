@@ -0,0 +1,41 @@
+import io
+import itertools
+import pytest
+from fontTools.designspaceLib import DesignSpaceDocument
+from fontgoggles.compile.dsCompiler import compileDSToFont, getTTPaths
+from fontgoggles.compile.ufoCompiler import compileUFOToPath
+from fontgoggles.misc.hbShape import HBShape
+from testSupport import getFontPath
+
+
+def _shapeAll(ttFont, texts, axisValues):
+    f = io.BytesIO()
+    ttFont.save(f, reorderTables=False)
+    shaper = HBShape(f.getvalue())
+    axisTags = [axis.axisTag for axis in ttFont["fvar"].axes]
+    results = []
+    for values in itertools.product(axisValues, repeat=len(axisTags)):
+        varLocation = dict(zip(axisTags, values))
+        for text in texts:
+            glyphs = shaper.shape(text, varLocation=varLocation)
+            results.append([(gi.name, gi.dx, gi.dy, gi.ax, gi.ay) for gi in glyphs])
+    return results
+
+
+@pytest.mark.parametrize("fileName", ["MutatorSans.designspace", "MiniMutatorSans.designspace"])
+def test_compileDSToFont_layoutOnly(fileName, tmpdir):
+    dsPath = getFontPath(fileName)
+    doc = DesignSpaceDocument.fromfile(dsPath)
+    for ufoPath, ttPath in getTTPaths(doc, tmpdir).items():
+        compileUFOToPath(ufoPath, ttPath)
+
+    timings = {}
+    layoutFont = compileDSToFont(dsPath, tmpdir, layoutOnly=True, timings=timings)
+    assert {"loadDesignSpace", "loadMasters", "setupVariableFont", "mergeOTL"} <= set(timings)
+    fullFont = compileDSToFont(dsPath, tmpdir, layoutOnly=False)
+    assert "FGAx" not in layoutFont
+    assert "FGAx" in fullFont
+
+    texts = ["TABC", "AVATAR", "IS$", "HIHIH"]
+    axisValues = [0, 327, 500, 1000]
+    assert _shapeAll(layoutFont, texts, axisValues) == _shapeAll(fullFont, texts, axisValues)
@@ -1,7 +1,15 @@
-import pytest
+import pathlib
+import shutil
 import sys
+import numpy
+import pytest
 from fontTools.ufoLib import UFOReader
-from fontgoggles.font.dsFont import DSFont, PointCollector
+from fontTools.varLib.models import VariationModel
+from fontgoggles.compile import profiling
+from fontgoggles.font import dsFont
+from fontgoggles.font.dsFont import DSFont, PointCollector, VarGlyph
+from fontgoggles.font.ufoFont import saveUFOStates
+from fontgoggles.misc import diskCache
 from testSupport import getFontPath
 
 
@@ -73,3 +81,141 @@ async def test_DSFont():
     assert run[0].ay == -900
     assert run[0].dx == -370
     assert run[0].dy == -700
+
+
+@pytest.mark.asyncio
+async def test_DSFont_compileTimings(tmpdir, monkeypatch):
+    monkeypatch.setattr(profiling, "_printCompileTimings", True)
+    # A fresh copy, so the compilers have not seen the sources before
+    sourceFolder = pathlib.Path(getFontPath("MutatorSans.designspace")).parent
+    folder = pathlib.Path(shutil.copytree(sourceFolder, tmpdir / "MutatorSans"))
+    dsPath = folder / "MutatorSans.designspace"
+    font = DSFont(dsPath, 0)
+    output = []
+    await font.load(output.append)
+    assert "mergeOTL" in font.compileTimings
+    assert sorted(pathlib.Path(path).name for path in font.sourceCompileTimings) == [
+        p.name for p in font.getExternalFiles()]
+    assert all("buildOTL" in timings for timings in font.sourceCompileTimings.values())
+    output = "".join(output)
+    assert "compile timings for MutatorSans.designspace:\n" in output
+    assert "compile timings for MutatorSansLightWide.ufo:\n" in output
+
+    # The unchanged sources are not compiled again
+    font = DSFont(dsPath, 0)
+    output = []
+    await font.load(output.append)
+    assert "mergeOTL" in font.compileTimings
+    assert all(timings == {} for timings in font.sourceCompileTimings.values())
+    output = "".join(output)
+    assert "compile timings for MutatorSansLightWide.ufo: none, reused an earlier compile\n" in output
+
+
+@pytest.mark.asyncio
+async def test_DSFont_prefetchVarLocations():
+    dsPath = getFontPath("MutatorSans.designspace")
+    font = DSFont(dsPath, 0)
+    await font.load(sys.stderr.write)
+    glyphNames = ["A", "B", "Aacute"]
+    varLocations = [dict(wght=300), dict(wght=600, wdth=200)]
+    await font.prefetchVarLocations(glyphNames, varLocations)
+    assert font._currentVarLocation is None  # restored
+    for varLocation in varLocations:
+        font.setVarLocation(varLocation)
+        cachedDrawings = list(font.getGlyphDrawings(glyphNames))
+        for glyphName, glyphDrawing in zip(glyphNames, cachedDrawings):
+            # Compare with a freshly interpolated glyph
+            varGlyph = font._getVarGlyphRaw(glyphName)
+            varGlyph.setVarLocation(font._normalizedLocation)
+            assert numpy.allclose(font._getVarGlyph(glyphName).getPoints(), varGlyph.getPoints())
+        assert cachedDrawings == list(font.getGlyphDrawings(glyphNames))
+
+    font.setVarLocation(dict(wght=300))
+    drawings = list(font.getGlyphDrawings(glyphNames))
+    font.setVarLocation(dict(wght=600))
+    font.setVarLocation(dict(wght=300))
+    assert drawings == list(font.getGlyphDrawings(glyphNames))  # still cached
+
+
+def test_VarGlyph_prefetchVarLocations_incompatible():
+    model = VariationModel([{}, {"wght": 1}, {"wdth": 1}])
+    points = [(0, 0), (100, 0), (100, 100)]
+    masterPoints = [points, [(0, 0), (200, 0), (200, 200)], points[:2]]
+    varGlyph = VarGlyph("A", model, masterPoints, [2], [1, 1, 1], None, None)
+    varLocations = [{"wght": 0.5}, {"wdth": 0.5}]
+    varGlyph.prefetchVarLocations(varLocations)
+    for varLocation in varLocations:
+        varGlyph.setVarLocation(varLocation)
+        assert numpy.array_equal(varGlyph.getPoints(), numpy.array(points))
+
+
+@pytest.mark.asyncio
+async def test_DSFont_getGlyphRuns():
+    dsPath = getFontPath("MiniMutatorSans.designspace")
+    font = DSFont(dsPath, 0)
+    await font.load(sys.stderr.write)
+    assert not font.shaper.hasVariableSubstitutions
+    varLocations = [dict(wdth=0), dict(wdth=200), dict(wdth=500)]
+    runs = font.getGlyphRuns("TABC", varLocations)
+    assert [[gi.ax for gi in run] for run in runs] == [
+        [600, 740, 710, 822],
+        [630, 776, 747, 858],
+        [814, 996, 971, 1079],
+    ]
+    for varLocation, run in zip(varLocations, runs):
+        expected = font.getGlyphRun("TABC", varLocation=varLocation)
+        assert [repr(gi) for gi in run] == [repr(gi) for gi in expected]
+        assert [gi.glyphDrawing for gi in run] == [gi.glyphDrawing for gi in expected]
+
+
+@pytest.mark.asyncio
+async def test_DSFont_cmapUpdate(tmpdir, monkeypatch):
+    sourceFolder = pathlib.Path(getFontPath("MutatorSans.designspace")).parent
+    folder = pathlib.Path(shutil.copytree(sourceFolder, tmpdir / "MutatorSans"))
+    font = DSFont(folder / "MutatorSans.designspace", 0)
+    await font.load(sys.stderr.write)
+    assert [gi.name for gi in font.getGlyphRun("B\uE000")] == ["B", ".notdef"]
+
+    async def compileDSToBytes(*args):
+        raise AssertionError("the variable font should not be rebuilt")
+
+    monkeypatch.setattr(dsFont, "compileDSToBytes", compileDSToBytes)
+
+    # A cmap change in the default source
+    glifPath = folder / "MutatorSansLightCondensed.ufo" / "glyphs" / "B_.glif"
+    glifPath.write_text(glifPath.read_text().replace('<unicode hex="0042"/>',
+                                                     '<unicode hex="0042"/>\n  <unicode hex="E000"/>'))
+    assert font.canReloadWithChange(glifPath.parent.parent)
+    await font.load(sys.stderr.write)
+    assert [gi.name for gi in font.getGlyphRun("B\uE000")] == ["B", "B"]
+
+    # A cmap change in a non-default source
+    glifPath = folder / "MutatorSansBoldWide.ufo" / "glyphs" / "B_.glif"
+    glifPath.write_text(glifPath.read_text().replace('<unicode hex="0042"/>', ""))
+    assert font.canReloadWithChange(glifPath.parent.parent)
+    await font.load(sys.stderr.write)
+    assert [gi.name for gi in font.getGlyphRun("B\uE000")] == ["B", "B"]
+
+
+@pytest.mark.asyncio
+async def test_DSFont_layerSnapshotIncludes(tmpdir, monkeypatch):
+    monkeypatch.setattr(diskCache, "_cacheFolder", str(tmpdir / "cache"))
+    sourceFolder = pathlib.Path(getFontPath("MutatorSans.designspace")).parent
+    folder = pathlib.Path(shutil.copytree(sourceFolder, tmpdir / "MutatorSans"))
+    ufoPath = folder / "MutatorSansLightCondensed.ufo"
+    feaPath = folder / "inc.fea"
+    feaPath.write_text("# included\n")
+    with open(ufoPath / "features.fea", "a") as f:
+        f.write("include(inc.fea);\n")
+    font = DSFont(folder / "MutatorSans.designspace", 0)
+    await font.load(sys.stderr.write)
+    saveUFOStates()
+
+    # An anchor change in a sparse layer, restored from the snapshot
+    glifPath = ufoPath / "glyphs.support.crossbar" / "E_.glif"
+    glifPath.write_text(glifPath.read_text().replace('x="282.15144"', 'x="283"'))
+    font = DSFont(folder / "MutatorSans.designspace", 0)
+    await font.load(sys.stderr.write)
+    sourceKeys = font._includedFeatureFiles[feaPath]
+    assert sourceKeys == [(str(ufoPath), None)]
+    assert font.canReloadWithChange(feaPath)
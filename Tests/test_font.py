@@ -1,5 +1,6 @@
 import pytest
 from fontgoggles.font import getOpener, sniffFontType, sortedFontPathsAndNumbers
+from fontgoggles.font.baseFont import predictVarLocations
 from fontgoggles.misc.textInfo import TextInfo
 from testSupport import getFontPath, testDataFolder
 
@@ -321,3 +322,15 @@ async def test_verticalGlyphMetricsFromUFO():
     assert expectedAY == ay
     assert expectedDX == dx
     assert expectedDY == dy
+
+
+def test_predictVarLocations():
+    axes = dict(wght=dict(minValue=100, defaultValue=400, maxValue=900),
+                wdth=dict(minValue=50, defaultValue=100, maxValue=200))
+    assert predictVarLocations(dict(wght=400), dict(wght=500), axes) == [dict(wght=600), dict(wght=700)]
+    assert predictVarLocations(dict(wght=400, wdth=100), dict(wght=800, wdth=100), axes) == \
+        [dict(wght=900, wdth=100)]
+    assert predictVarLocations(dict(wght=500), dict(wght=500), axes) == []
+    assert predictVarLocations(None, dict(wght=500), axes) == []
+    assert predictVarLocations(dict(wght=500), dict(wght=400, ital=1), axes, count=1) == \
+        [dict(wght=300, ital=1)]
@@ -0,0 +1,98 @@
+import pytest
+from fontTools.ufoLib import UFOReader
+from fontgoggles.misc.glifParser import (decomposeComponents, parseGLIFOutline,
+                                         _parseGLIFOutlineFast, _parseGLIFOutlineFull)
+from testSupport import getFontPath
+
+
+def _getOutlineFunc(glyphSet):
+    def getOutline(glyphName):
+        if glyphName not in glyphSet:
+            return None
+        return parseGLIFOutline(glyphSet.getGLIF(glyphName))
+    return getOutline
+
+
+def test_parseGLIFOutline():
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    glyphSet = UFOReader(ufoPath).getGlyphSet()
+    outline = parseGLIFOutline(glyphSet.getGLIF("B"))
+    assert len(outline.points) == 38
+    assert len(outline.tags) == 38
+    assert outline.contours.tolist() == [3, 37]
+    assert outline.tags[:12].tolist() == [1, 1, 1, 1, 1, 1, 2, 2, 1, 2, 2, 1]
+    assert outline.components == []
+    assert outline.width == 1270
+
+    outline = parseGLIFOutline(glyphSet.getGLIF("O"))
+    assert len(outline.points) == 28
+    assert outline.contours.tolist() == [13, 27]
+
+
+def test_parseGLIFOutline_components():
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    glyphSet = UFOReader(ufoPath).getGlyphSet()
+    outline = parseGLIFOutline(glyphSet.getGLIF("Aacute"))
+    assert len(outline.points) == 0
+    assert outline.contours.tolist() == []
+    assert outline.components == [("A", (1, 0, 0, 1, 0, 0)), ("acute", (1, 0, 0, 1, 484, 20))]
+
+    points, tags, contours = decomposeComponents(outline, _getOutlineFunc(glyphSet))
+    assert len(points) == 20
+    assert len(tags) == 20
+    assert contours.tolist() == [3, 7, 11, 15, 19]
+    # The acute contour, shifted by the component offset
+    assert points[-4:].tolist() == [[504.0, 850.0], [854.0, 850.0], [854.0, 970.0], [504.0, 940.0]]
+
+
+def test_parseGLIFOutline_metrics():
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    glyphSet = UFOReader(ufoPath).getGlyphSet()
+    # A.glif contains comments, so this goes through the full parser
+    outline = parseGLIFOutline(glyphSet.getGLIF("A"))
+    assert outline.width == 1290
+    assert outline.height == 1022
+    assert outline.lib["public.verticalOrigin"] == 822
+
+
+def test_parseGLIFOutlineQuad():
+    ufoPath = getFontPath("QuadTest-Regular.ufo")
+    glyphSet = UFOReader(ufoPath).getGlyphSet()
+    outline = parseGLIFOutline(glyphSet.getGLIF("a"))
+    assert len(outline.points) == 4
+    assert outline.contours.tolist() == [3]
+    assert outline.tags.tolist() == [0, 0, 0, 0]
+
+
+@pytest.mark.parametrize("fileName", ["MutatorSansBoldWideMutated.ufo", "QuadTest-Regular.ufo"])
+def test_fastPathMatchesFullParser(fileName):
+    ufoPath = getFontPath(fileName)
+    glyphSet = UFOReader(ufoPath).getGlyphSet()
+    for glyphName in sorted(glyphSet.keys()):
+        data = glyphSet.getGLIF(glyphName)
+        if b"<!--" in data:
+            continue
+        fast = _parseGLIFOutlineFast(data)
+        full = _parseGLIFOutlineFull(data)
+        assert fast is not None
+        assert fast.points.tolist() == full.points.tolist()
+        assert fast.tags.tolist() == full.tags.tolist()
+        assert fast.contours.tolist() == full.contours.tolist()
+        assert fast.components == full.components
+        assert (fast.width, fast.height) == (full.width, full.height)
+        assert fast.lib == full.lib
+
+
+def test_fastPathFallback():
+    data = b"""<?xml version='1.0' encoding='UTF-8'?>
+<glyph name="a&amp;b" format="2">
+  <advance width="500"/>
+  <outline>
+    <component base="x&amp;y" xOffset="10"/>
+  </outline>
+</glyph>
+"""
+    assert _parseGLIFOutlineFast(data) is None
+    outline = parseGLIFOutline(data)
+    assert outline.components == [("x&y", (1, 0, 0, 1, 10, 0))]
+    assert outline.width == 500
@@ -0,0 +1,80 @@
+import pytest
+from fontTools.ufoLib import UFOReader
+from fontgoggles.misc import diskCache
+from fontgoggles.misc.glyphOutlineCache import getGlyphOutlineCache
+from testSupport import getFontPath
+
+
+@pytest.fixture
+def cacheFolder(tmpdir, monkeypatch):
+    monkeypatch.setattr(diskCache, "_cacheFolder", str(tmpdir / "cache"))
+    return tmpdir / "cache"
+
+
+def test_getGlyphOutlineCache_disabled(monkeypatch):
+    monkeypatch.setattr(diskCache, "_cacheFolder", None)
+    assert getGlyphOutlineCache(getFontPath("MutatorSansBoldWideMutated.ufo")) is None
+
+
+def test_glyphOutlineCache(cacheFolder):
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    glyphSet = UFOReader(ufoPath).getGlyphSet()
+    readGlyphNames = []
+
+    def getGLIF(glyphName):
+        readGlyphNames.append(glyphName)
+        return glyphSet.getGLIF(glyphName)
+
+    cache = getGlyphOutlineCache(ufoPath)
+    outline = cache.getOutline("B", (123.0, 456), getGLIF)
+    assert readGlyphNames == ["B"]
+    assert outline.contours.tolist() == [3, 37]
+    cache.getOutline("Aacute", (123.0, 789), getGLIF)
+    assert readGlyphNames == ["B", "Aacute"]
+    cache.save()
+
+    cache = getGlyphOutlineCache(ufoPath)
+    cachedOutline = cache.getOutline("B", (123.0, 456), getGLIF)
+    assert readGlyphNames == ["B", "Aacute"]  # read from the cache
+    assert cachedOutline.points.tolist() == outline.points.tolist()
+    assert cachedOutline.tags.tolist() == outline.tags.tolist()
+    assert cachedOutline.contours.tolist() == outline.contours.tolist()
+    assert cachedOutline.width == outline.width
+    cachedOutline = cache.getOutline("Aacute", (123.0, 789), getGLIF)
+    assert cachedOutline.components == [("A", (1, 0, 0, 1, 0, 0)), ("acute", (1, 0, 0, 1, 484, 20))]
+    assert readGlyphNames == ["B", "Aacute"]
+
+    cache.getOutline("B", (124.0, 456), getGLIF)  # stale entry
+    assert readGlyphNames == ["B", "Aacute", "B"]
+    cache.getOutline("B", None, getGLIF)  # no stamp, bypass cache
+    assert readGlyphNames == ["B", "Aacute", "B", "B"]
+
+    # Different layer, different cache
+    assert getGlyphOutlineCache(ufoPath, "foreground") is not cache
+    cache = getGlyphOutlineCache(ufoPath, "foreground")
+    cache.getOutline("B", (123.0, 456), getGLIF)
+    assert readGlyphNames == ["B", "Aacute", "B", "B", "B"]
+
+
+def test_glyphOutlineCache_shared(cacheFolder):
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    glyphSet = UFOReader(ufoPath).getGlyphSet()
+    cache = getGlyphOutlineCache(ufoPath)
+    assert getGlyphOutlineCache(ufoPath) is cache
+    cache.getOutline("B", (123.0, 456), glyphSet.getGLIF)
+    cache.getOutline("Aacute", (123.0, 789), glyphSet.getGLIF)
+    cache.save(glyphSet.keys())
+    assert set(cache.entries) == {"B", "Aacute"}
+    # Aacute got deleted
+    cache.save(name for name in glyphSet.keys() if name != "Aacute")
+    cache._entries = None  # read it back
+    assert set(cache.entries) == {"B"}
+
+
+def test_glyphOutlineCache_corrupt(cacheFolder):
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    glyphSet = UFOReader(ufoPath).getGlyphSet()
+    cache = getGlyphOutlineCache(ufoPath)
+    cache.cachePath.write_bytes(b"garbage")
+    outline = cache.getOutline("B", (123.0, 456), glyphSet.getGLIF)
+    assert outline.contours.tolist() == [3, 37]
@@ -72,3 +72,43 @@ def test_characterGlyphMapping(clusters, numChars, expectedGlyphToChars, expecte
     glyphToChars, charToGlyphs = characterGlyphMapping(clusters, numChars)
     assert glyphToChars == expectedGlyphToChars
     assert charToGlyphs == expectedCharToGlyphs
+
+
+shapeMultipleTestData = [
+    ("Amiri-Regular.ttf", "فعل الله كتبَ"),
+    ("NotoNastaliqUrdu-Regular.ttf", "فعلالو"),
+    ("NotoSansMyanmar-Regular.ttf", "က္ကော"),
+    ("IBMPlexSans-Regular.ttf", "Type fierce AV"),
+]
+
+
+@pytest.mark.parametrize("fileName,text", shapeMultipleTestData)
+@pytest.mark.parametrize("direction", [None, "TTB"])
+def test_shapeMultiple_reposition(fileName, text, direction, monkeypatch):
+    s = HBShape.fromPath(getFontPath(fileName))
+    assert not s.hasVariableSubstitutions
+    repositioned = []
+    reposition = s._reposition
+
+    def _reposition(*args, **kwargs):
+        result = reposition(*args, **kwargs)
+        repositioned.append(result)
+        return result
+
+    monkeypatch.setattr(s, "_reposition", _reposition)
+    expected = [repr(gi) for gi in s.shape(text, direction=direction)]
+    runs = list(s.shapeMultiple(text, [{}, {}, {}], direction=direction))
+    assert len(repositioned) == 2
+    assert None not in repositioned
+    for run in runs:
+        assert [repr(gi) for gi in run] == expected
+
+
+def test_shapeMultiple_variableSubstitutions():
+    s = HBShape.fromPath(getFontPath("MutatorSans.ttf"))
+    assert s.hasVariableSubstitutions
+    varLocations = [dict(wdth=0, wght=0), dict(wdth=1000, wght=0), dict(wdth=0, wght=1000)]
+    runs = list(s.shapeMultiple("IS", varLocations))
+    assert [gi.name for gi in runs[0]] == ["I.narrow", "S.closed"]
+    assert [gi.name for gi in runs[1]] == ["I", "S.closed"]
+    assert [gi.name for gi in runs[2]] == ["I.narrow", "S"]
@@ -1,7 +1,8 @@
 import pathlib
 import pytest
 from fontgoggles.font import iterFontNumbers
-from fontgoggles.project import Project
+from fontgoggles.misc.priority import BACKGROUND, RECENTLY_EDITED, SELECTED, VISIBLE, getCurrentPriority
+from fontgoggles.project import FontLoader, Project
 from testSupport import getFontPath
 
 
@@ -74,3 +75,32 @@ async def test_project_load_ttc():
     for fontPath, fontNumber, getSortInfo in iterFontNumbers(fontPath):
         pr.addFont(fontPath, fontNumber)
     await pr.loadFonts()
+
+
+@pytest.mark.asyncio
+async def test_project_fontPriorities(monkeypatch):
+    pr = Project()
+    for fileName in ["IBMPlexSans-Regular.ttf", "IBMPlexSans-Regular.otf", "MutatorSans.ttf"]:
+        pr.addFont(getFontPath(fileName), 0)
+    identifiers = [fii.identifier for fii in pr.fonts]
+    pr.setFontPriorities(visible={identifiers[2]}, selected={identifiers[1], identifiers[2]})
+    assert [fii.priority.value for fii in pr.fonts] == [BACKGROUND, SELECTED, VISIBLE]
+    pr.setFontPriority(identifiers[0], RECENTLY_EDITED)
+    assert pr.fonts[0].priority.value == RECENTLY_EDITED
+    with pytest.raises(KeyError):
+        pr.setFontPriority("fontItem_123", VISIBLE)
+
+    loaded = []
+    loadFont = FontLoader.loadFont
+
+    async def loadFontWithPriority(self, fontKey, outputWriter):
+        loaded.append((fontKey[0].name, getCurrentPriority().value))
+        await loadFont(self, fontKey, outputWriter)
+
+    monkeypatch.setattr(FontLoader, "loadFont", loadFontWithPriority)
+    await pr.loadFonts()
+    assert loaded == [
+        ("MutatorSans.ttf", VISIBLE),
+        ("IBMPlexSans-Regular.otf", SELECTED),
+        ("IBMPlexSans-Regular.ttf", RECENTLY_EDITED),
+    ]
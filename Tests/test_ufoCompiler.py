@@ -1,9 +1,15 @@
 import asyncio
 import os
+import pathlib
+import shutil
+import time
 import pytest
 from fontTools.ufoLib import UFOReader
-from fontgoggles.compile.ufoCompiler import fetchCharacterMappingAndAnchors
+from fontgoggles.compile import profiling, ufoCompiler
+from fontgoggles.compile.ufoCompiler import (UFOCompileData, compileUFOToFont, extractIncludedFeatureFiles,
+                                             fetchCharacterMappingAndAnchors)
 from fontgoggles.compile.compilerPool import compileUFOToPath
+from fontgoggles.compile.profiling import claimCompileTimings, readCompileTimings
 from testSupport import getFontPath
 
 
@@ -28,6 +34,50 @@ def test_ufoCharacterMapping_glyphNames():
     assert anchors == {"A": [("top", 645, 815)]}
 
 
+@pytest.mark.parametrize("fileName", ["MutatorSansBoldWideMutated.ufo", "MutatorSansBoldWideMutated.ufoz"])
+def test_ufoCharacterMapping_parallel(fileName, monkeypatch):
+    ufoPath = getFontPath(fileName)
+    glyphSet = UFOReader(ufoPath).getGlyphSet()
+    expected = fetchCharacterMappingAndAnchors(glyphSet, ufoPath)
+    monkeypatch.setattr(ufoCompiler, "parallelScanMinGlyphs", 0)
+    monkeypatch.setattr(ufoCompiler, "parallelScanChunkSize", 7)
+    assert fetchCharacterMappingAndAnchors(glyphSet, ufoPath) == expected
+
+
+def test_parseRawAttributes():
+    attrs = ufoCompiler._parseRawAttributes(b"""name="a&amp;b" x='12.5' y = "-3" """)
+    assert attrs == {"name": "a&b", "x": "12.5", "y": "-3"}
+    assert ufoCompiler._parseAnchorAttrs(attrs) == ("a&b", 12.5, -3)
+
+
+def test_extractIncludedFeatureFiles(tmpdir, monkeypatch):
+    ufoSource = getFontPath("MutatorSansBoldWideMutated.ufo")
+    ufoPath = pathlib.Path(shutil.copytree(ufoSource, tmpdir / "test.ufo"))
+    for feaFileName in ["features_test.fea", "features_test_nested.fea"]:
+        shutil.copy(ufoSource.parent / feaFileName, tmpdir)
+    includedPath = pathlib.Path(tmpdir / "features_test.fea").resolve()
+    nestedPath = pathlib.Path(tmpdir / "features_test_nested.fea").resolve()
+    assert extractIncludedFeatureFiles(ufoPath) == [includedPath, nestedPath]
+
+    parsedSources = []
+    originalParseFeaSource = ufoCompiler._parseFeaSource
+
+    def parseFeaSource(featureSource):
+        parsedSources.append(featureSource)
+        return originalParseFeaSource(featureSource)
+
+    monkeypatch.setattr(ufoCompiler, "_parseFeaSource", parseFeaSource)
+    assert extractIncludedFeatureFiles(ufoPath) == [includedPath, nestedPath]
+    assert parsedSources == []
+
+    # Only the changed file gets parsed again
+    nestedPath.write_text(nestedPath.read_text("utf-8") + "\n# comment\n", "utf-8")
+    st = os.stat(nestedPath)
+    os.utime(nestedPath, (st.st_atime, st.st_mtime + 1))
+    assert extractIncludedFeatureFiles(ufoPath) == [includedPath, nestedPath]
+    assert parsedSources == [nestedPath.read_text("utf-8")]
+
+
 @pytest.mark.asyncio
 async def test_compileUFOToPath(tmpdir):
     ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
@@ -60,3 +110,114 @@ async def test_compileUFOToPathMultiple(tmpdir):
     results = await asyncio.gather(*coros)
     assert results == [None] * len(results)
     assert [(os.stat(p).st_size > 0) for p in ttPaths] == [True] * len(results)
+
+
+def test_UFOCompileData(tmpdir, monkeypatch):
+    ufoSource = getFontPath("MutatorSansBoldWideMutated.ufo")
+    ufoPath = pathlib.Path(shutil.copytree(ufoSource, tmpdir / "test.ufo"))
+    for feaFileName in ["features_test.fea", "features_test_nested.fea"]:
+        shutil.copy(ufoSource.parent / feaFileName, tmpdir)
+    ufoData = UFOCompileData(ufoPath)
+    assert ufoData.update()
+    assert not ufoData.update()
+    assert ufoData.unicodes["B"] == [0x42]
+
+    scannedGlyphNames = []
+    originalScanGLIFs = ufoCompiler.scanGLIFs
+
+    def scanGLIFs(glyphSet, glyphNames=None):
+        scannedGlyphNames.extend(glyphNames)
+        return originalScanGLIFs(glyphSet, glyphNames)
+
+    monkeypatch.setattr(ufoCompiler, "scanGLIFs", scanGLIFs)
+
+    def touch(path):
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 1))
+
+    glifPath = ufoPath / "glyphs" / "B_.glif"
+    glifPath.write_text(glifPath.read_text("utf-8").replace('hex="0042"', 'hex="E000"'), "utf-8")
+    touch(glifPath)
+    kerning = ufoData.kerning
+    assert ufoData.update()
+    assert scannedGlyphNames == ["B"]
+    assert ufoData.unicodes["B"] == [0xE000]
+    assert ufoData.kerning is kerning
+
+    kerningPath = ufoPath / "kerning.plist"
+    kerningPath.write_text(kerningPath.read_text("utf-8").replace("</integer>", "0</integer>"), "utf-8")
+    touch(kerningPath)
+    assert ufoData.update()
+    assert ufoData.kerning != kerning
+
+    touch(tmpdir / "features_test_nested.fea")
+    assert ufoData.update()
+    assert scannedGlyphNames == ["B"]
+
+    ttFont, error = compileUFOToFont(ufoPath, ufoData)
+    expectedTTFont, expectedError = compileUFOToFont(ufoPath)
+    assert error == expectedError
+    assert ttFont.getBestCmap() == expectedTTFont.getBestCmap()
+    assert ttFont.getBestCmap()[0xE000] == "B"
+
+
+def test_compileUFOToFont_cachedGSUB(tmpdir, monkeypatch):
+    ufoSource = getFontPath("MutatorSansBoldWideMutated.ufo")
+    ufoPath = pathlib.Path(shutil.copytree(ufoSource, tmpdir / "test.ufo"))
+    for feaFileName in ["features_test.fea", "features_test_nested.fea"]:
+        shutil.copy(ufoSource.parent / feaFileName, tmpdir)
+    ufoData = UFOCompileData(ufoPath)
+    ufoData.update()
+    ttFont, error = compileUFOToFont(ufoPath, ufoData)
+    assert error is None
+    gsubData = ttFont["GSUB"].data
+
+    builtTables = []
+    originalBuild = ufoCompiler.FeatureBuilder.build
+
+    def build(self, tables=None, debug=False):
+        builtTables.append(tables)
+        return originalBuild(self, tables, debug)
+
+    monkeypatch.setattr(ufoCompiler.FeatureBuilder, "build", build)
+
+    kerningPath = ufoPath / "kerning.plist"
+    kerningPath.write_text(kerningPath.read_text("utf-8").replace("</integer>", "0</integer>"), "utf-8")
+    assert ufoData.update()
+    ttFont, error = compileUFOToFont(ufoPath, ufoData)
+    assert error is None
+    assert "GSUB" not in builtTables[0]
+    assert ttFont["GSUB"].data == gsubData
+    expectedTTFont, expectedError = compileUFOToFont(ufoPath)
+    assert builtTables[1] is None or "GSUB" in builtTables[1]
+    for tag in ["GDEF", "GPOS", "GSUB"]:
+        assert ttFont[tag].compile(ttFont) == expectedTTFont[tag].compile(expectedTTFont)
+
+    featuresPath = ufoPath / "features.fea"
+    featuresPath.write_text(featuresPath.read_text("utf-8") + "\n", "utf-8")
+    assert ufoData.update()
+    ttFont, error = compileUFOToFont(ufoPath, ufoData)
+    assert builtTables[2] is None or "GSUB" in builtTables[2]
+
+
+def test_compileUFOToFont_timings():
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    timings = {}
+    ttFont, error = compileUFOToFont(ufoPath, timings=timings)
+    assert error is None
+    assert list(timings) == ["readSources", "setupFont", "parseFeatures", "KernFeatureWriter",
+                             "MarkFeatureWriter", "writeFeatures", "buildOTL", "compileGSUB", "compilePost"]
+    assert readCompileTimings(ttFont) == timings
+
+
+def test_claimCompileTimings(monkeypatch):
+    ufoPath = getFontPath("MutatorSansBoldWideMutated.ufo")
+    timings = {}
+    ttFont, error = compileUFOToFont(ufoPath, timings=timings)
+    assert claimCompileTimings(ttFont) == (timings, True)
+    # The same font data again, for example from the compile cache
+    assert claimCompileTimings(ttFont) == (timings, False)
+    # A compile from an earlier session
+    ttFont, error = compileUFOToFont(ufoPath, timings=timings)
+    monkeypatch.setattr(profiling, "_sessionStartTime", time.time() + 1)
+    assert claimCompileTimings(ttFont) == (timings, False)
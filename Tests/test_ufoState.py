@@ -1,10 +1,18 @@
+import os
 import pathlib
+import pickle
 import shutil
+import zipfile
+import pytest
 from fontTools.pens.recordingPen import RecordingPointPen
+from fontTools.ttLib import TTFont
 from fontTools.ufoLib import UFOReader, UFOReaderWriter
 from fontTools.ufoLib.glifLib import Glyph
-from fontgoggles.font.ufoFont import UFOState
-from fontgoggles.compile.ufoCompiler import fetchCharacterMappingAndAnchors
+from fontgoggles.font import ufoFont
+from fontgoggles.font.ufoFont import (UFOFont, UFOState, addComponentUsers, getGlyphModTimes, loadUFOState,
+                                       saveUFOStates, storeUFOState)
+from fontgoggles.compile.ufoCompiler import extractIncludedFeatureFiles, fetchCharacterMappingAndAnchors
+from fontgoggles.misc import diskCache
 from testSupport import getFontPath
 
 
@@ -83,3 +91,240 @@ def test_getUpdateInfo(tmpdir):
     assert needsGlyphUpdate
     assert not needsInfoUpdate
     assert not needsCmapUpdate
+
+
+@pytest.mark.asyncio
+async def test_UFOFont_purgeChangedGlyphs(tmpdir):
+    ufoSource = getFontPath("MutatorSansBoldWideMutated.ufo")
+    ufoPath = pathlib.Path(shutil.copytree(ufoSource, tmpdir / "test.ufo"))
+    font = UFOFont(ufoPath, 0)
+    await font.load(None)
+    glyphNames = ["A", "Aacute", "Adieresis", "B", "acute"]
+    drawings = dict(zip(glyphNames, font.getGlyphDrawings(glyphNames)))
+
+    glyph = Glyph("A", None)
+    ppen = RecordingPointPen()
+    font.glyphSet.readGlyph("A", glyph, ppen)
+    glyph.width += 123
+    font.glyphSet.writeGlyph("A", glyph, ppen.replay)
+    glifPath = ufoPath / "glyphs" / "A_.glif"
+    st = os.stat(glifPath)
+    os.utime(glifPath, (st.st_atime, st.st_mtime + 1))  # make sure the change is noticed
+
+    assert font.canReloadWithChange(None)
+    await font.load(None)
+    newDrawings = dict(zip(glyphNames, font.getGlyphDrawings(glyphNames)))
+    # A changed, and so did the composites using it
+    assert newDrawings["A"] is not drawings["A"]
+    assert newDrawings["Aacute"] is not drawings["Aacute"]
+    assert newDrawings["Adieresis"] is not drawings["Adieresis"]
+    # Unrelated glyphs are still cached
+    assert newDrawings["B"] is drawings["B"]
+    assert newDrawings["acute"] is drawings["acute"]
+
+
+@pytest.mark.asyncio
+async def test_UFOFont_cmapUpdate(tmpdir, monkeypatch):
+    ufoSource = getFontPath("MutatorSansBoldWideMutated.ufo")
+    ufoPath = pathlib.Path(shutil.copytree(ufoSource, tmpdir / "test.ufo"))
+    font = UFOFont(ufoPath, 0)
+    await font.load(None)
+    assert [gi.name for gi in font.shaper.shape("AB")] == ["A", "B"]
+    shaper = font.shaper
+
+    glifPath = ufoPath / "glyphs" / "B_.glif"
+    glifPath.write_text(glifPath.read_text("utf-8").replace('hex="0042"', 'hex="E000"'), "utf-8")
+    st = os.stat(glifPath)
+    os.utime(glifPath, (st.st_atime, st.st_mtime + 1))  # make sure the change is noticed
+
+    def save(*args, **kwargs):
+        raise AssertionError("the compiled font should not be saved")
+
+    monkeypatch.setattr(TTFont, "save", save)
+    assert font.canReloadWithChange(None)
+    await font.load(None)
+    assert font.shaper is shaper
+    assert [gi.name for gi in font.shaper.shape("AB\uE000")] == ["A", ".notdef", "B"]
+
+
+def _rewriteZip(sourcePath, destPath, changeMember):
+    with zipfile.ZipFile(sourcePath) as source, zipfile.ZipFile(destPath, "w") as dest:
+        for info in source.infolist():
+            dest.writestr(info, changeMember(info.filename, source.read(info)))
+
+
+@pytest.mark.asyncio
+async def test_UFOFont_reloadUFOZ(tmpdir):
+    ufoSource = getFontPath("MutatorSansBoldWideMutated.ufoz")
+    ufozPath = pathlib.Path(tmpdir / "test.ufoz")
+    shutil.copy(ufoSource, ufozPath)
+    font = UFOFont(ufozPath, 0)
+    await font.load(None)
+    glyphNames = ["A", "Aacute", "B"]
+    drawings = dict(zip(glyphNames, font.getGlyphDrawings(glyphNames)))
+
+    def changeWidth(fileName, data):
+        if fileName.endswith("/glyphs/A_.glif"):
+            data = data.replace(b'<advance width="', b'<advance width="1')
+        return data
+
+    _rewriteZip(ufoSource, ufozPath, changeWidth)
+    assert font.canReloadWithChange(None)
+    assert font.ufoState.changedGlyphNames == {"A"}
+    await font.load(None)
+    newDrawings = dict(zip(glyphNames, font.getGlyphDrawings(glyphNames)))
+    assert newDrawings["A"] is not drawings["A"]
+    assert newDrawings["Aacute"] is not drawings["Aacute"]
+    assert newDrawings["B"] is drawings["B"]
+
+    # Rewritten, but not changed
+    shutil.copy(ufozPath, tmpdir / "copy.ufoz")
+    _rewriteZip(tmpdir / "copy.ufoz", ufozPath, lambda fileName, data: data)
+    assert font.canReloadWithChange(None)
+    assert font.ufoState.changedGlyphNames == set()
+
+    def changeFeatures(fileName, data):
+        if fileName.endswith("/features.fea"):
+            data += b"\n"
+        return data
+
+    _rewriteZip(tmpdir / "copy.ufoz", ufozPath, changeFeatures)
+    assert not font.canReloadWithChange(None)
+
+
+def test_addComponentUsers():
+    componentUsers = {"A": {"Aacute", "Adieresis"}, "acute": {"Aacute"},
+                      "Aacute": {"Aacute.sc"}, "dieresis": {"Adieresis"}}
+    assert addComponentUsers({"acute"}, componentUsers) == {"acute", "Aacute", "Aacute.sc"}
+    assert addComponentUsers(["A"], componentUsers) == {"A", "Aacute", "Adieresis", "Aacute.sc"}
+    assert addComponentUsers({"B"}, componentUsers) == {"B"}
+
+
+def test_UFOState_snapshot(tmpdir, monkeypatch):
+    monkeypatch.setattr(diskCache, "_cacheFolder", str(tmpdir / "cache"))
+    ufoSource = getFontPath("MutatorSansBoldWideMutated.ufo")
+    ufoPath = pathlib.Path(shutil.copytree(ufoSource, tmpdir / "test.ufo"))
+    reader = UFOReaderWriter(ufoPath, validate=False)
+    glyphSet = reader.getGlyphSet()
+    assert loadUFOState(reader, glyphSet, ufoPath) is None
+
+    for feaFileName in ["features_test.fea", "features_test_nested.fea"]:
+        shutil.copy(ufoSource.parent / feaFileName, tmpdir)
+    includedFeatureFiles = extractIncludedFeatureFiles(ufoPath, reader)
+    assert len(includedFeatureFiles) == 2
+    cmap, unicodes, anchors = fetchCharacterMappingAndAnchors(glyphSet, ufoPath)
+    state = UFOState(reader, glyphSet, getUnicodesAndAnchors=lambda: (unicodes, anchors),
+                     includedFeatureFiles=includedFeatureFiles)
+    storeUFOState(state, ufoPath)
+    saveUFOStates()
+
+    glyph = Glyph("A", None)
+    ppen = RecordingPointPen()
+    glyphSet.readGlyph("A", glyph, ppen)
+    glyph.anchors[0]["x"] = 123
+    glyphSet.writeGlyph("A", glyph, ppen.replay)
+    glifPath = ufoPath / "glyphs" / "A_.glif"
+    st = os.stat(glifPath)
+    os.utime(glifPath, (st.st_atime, st.st_mtime + 1))  # make sure the change is noticed
+
+    readGlyphNames = []
+
+    def fetchCharacterMappingAndAnchorsWrapper(glyphSet, ufoPath, glyphNames=None):
+        readGlyphNames.append(set(glyphNames))
+        return fetchCharacterMappingAndAnchors(glyphSet, ufoPath, glyphNames)
+
+    monkeypatch.setattr(ufoFont, "fetchCharacterMappingAndAnchors", fetchCharacterMappingAndAnchorsWrapper)
+    reader = UFOReaderWriter(ufoPath, validate=False)
+    glyphSet = reader.getGlyphSet()
+    state = loadUFOState(reader, glyphSet, ufoPath)
+    assert readGlyphNames == [{"A"}]
+    assert state.changedGlyphNames == {"A"}
+    assert state.anchors["A"] == [("top", 123, 815)]
+    assert state.unicodes == unicodes
+    assert state.includedFeatureFiles == includedFeatureFiles
+    assert loadUFOState(reader, glyphSet, ufoPath, "some.layer") is None
+
+
+def test_getGlyphModTimes(tmpdir, monkeypatch):
+    ufoSource = getFontPath("MutatorSansBoldWideMutated.ufo")
+    ufoPath = pathlib.Path(shutil.copytree(ufoSource, tmpdir / "test.ufo"))
+    reader = UFOReaderWriter(ufoPath, validate=False)
+    glyphSet = reader.getGlyphSet()
+    modTimes = getGlyphModTimes(glyphSet)
+    assert len(modTimes) == len(glyphSet)
+    st = os.stat(ufoPath / "glyphs" / "B_.glif")
+    assert modTimes.get("B") == (st.st_mtime, st.st_size)
+    assert modTimes.get("nonexistent") is None
+    monkeypatch.setattr(ufoFont, "parallelStatChunkSize", 7)
+    monkeypatch.setattr(ufoFont, "parallelStatMinFiles", 0)
+    assert list(getGlyphModTimes(glyphSet).items()) == list(modTimes.items())
+
+    # Unchanged: the file name mapping is reused
+    newModTimes = getGlyphModTimes(glyphSet, modTimes)
+    assert newModTimes.glyphNames is modTimes.glyphNames
+    assert newModTimes.getChangedGlyphNames(modTimes) == set()
+
+    # Changed in-place
+    os.utime(ufoPath / "glyphs" / "B_.glif", (st.st_atime, st.st_mtime + 1))
+    newModTimes = getGlyphModTimes(glyphSet, modTimes)
+    assert newModTimes.getChangedGlyphNames(modTimes) == {"B"}
+
+    # Added and deleted
+    glyph = Glyph("B.alt", None)
+    glyphSet.writeGlyph("B.alt", glyph)
+    glyphSet.deleteGlyph("C")
+    glyphSet.writeContents()
+    newModTimes = getGlyphModTimes(glyphSet, modTimes)
+    assert newModTimes.getChangedGlyphNames(modTimes) == {"B", "B.alt", "C"}
+    assert pickle.loads(pickle.dumps(newModTimes)).getChangedGlyphNames(modTimes) == {"B", "B.alt", "C"}
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_getUpdateInfo_useContentHashes(tmpdir, monkeypatch, parallel):
+    if parallel:
+        monkeypatch.setattr(ufoFont, "parallelStatMinFiles", 0)
+    ufoSource = getFontPath("MutatorSansBoldWideMutated.ufo")
+    ufoPath = pathlib.Path(shutil.copytree(ufoSource, tmpdir / "test.ufo"))
+    reader = UFOReaderWriter(ufoPath, validate=False)
+    glyphSet = reader.getGlyphSet()
+    cmap, unicodes, anchors = fetchCharacterMappingAndAnchors(glyphSet, ufoPath)
+    state = UFOState(reader, glyphSet, getUnicodesAndAnchors=lambda: (unicodes, anchors),
+                     useContentHashes=True)
+    assert set(state.glyphHashes) == set(glyphSet.keys())
+
+    def touch(path):
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 1))
+
+    # Touched, but not changed
+    touch(ufoPath / "glyphs" / "A_.glif")
+    touch(ufoPath / "features.fea")
+    touch(ufoPath / "kerning.plist")
+    state = state.newState()
+    assert state.getUpdateInfo() == (False, False, False, False, False)
+    assert state.changedGlyphNames == set()
+
+    # Actually changed
+    glyph = Glyph("A", None)
+    ppen = RecordingPointPen()
+    glyphSet.readGlyph("A", glyph, ppen)
+    glyph.anchors[0]["x"] = 123
+    glyphSet.writeGlyph("A", glyph, ppen.replay)
+    touch(ufoPath / "glyphs" / "A_.glif")
+    feaPath = ufoPath / "features.fea"
+    feaPath.write_text(feaPath.read_text("utf-8") + "\n", "utf-8")
+    touch(feaPath)
+    touch(ufoPath / "kerning.plist")
+    state = state.newState()
+    needsFeaturesUpdate, needsGlyphUpdate, *_ = state.getUpdateInfo()
+    assert needsFeaturesUpdate
+    assert needsGlyphUpdate
+    assert state.changedGlyphNames == {"A"}
+
+    # Deleted
+    glyphSet.deleteGlyph("C")
+    glyphSet.writeContents()
+    state = state.newState()
+    state.getUpdateInfo()
+    assert state.changedGlyphNames == {"C"}
+    assert "C" not in state.glyphHashes